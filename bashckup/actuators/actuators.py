@@ -1,11 +1,13 @@
+import os
 import subprocess
 from abc import abstractmethod
-from typing import AnyStr, IO, Dict
+from typing import AnyStr, IO, Dict, Callable
 
 from jsonschema.exceptions import ValidationError
 from jsonschema.validators import validate
 
 from bashckup.actuators.exceptions import ParameterException
+from bashckup.actuators.native import NativeProcess
 
 
 class ActuatorMetadata:
@@ -21,10 +23,33 @@ class ActuatorMetadata:
                    'file-prefix': {
                        'type': 'string',
                        'description': 'Prefix of each files (with timestamp)'},
+                   'file-name': {
+                       'type': 'string',
+                       'description': 'File name of backups, without prefix'},
+                   'output-file': {
+                       'type': 'string',
+                       'description': 'Path of the file written (or restored) by the writer'},
+                   'members': {
+                       'type': 'array',
+                       'items': {'type': 'string'},
+                       'description': 'Names of the archive members to restore, when only some paths are restored'},
                    'backup-datetime': {
                        'type': 'string',
                        'format': 'date-time',
-                       'description': 'Date time of the backup'}
+                       'description': 'Date time of the backup'},
+                   'output-directory-files': {
+                       'type': 'string',
+                       'description': 'Parameter of the reader which keeps files in the output directory (e.g. '
+                                      'indexes of incremental backups), writers must have a local output directory'},
+                   'output-file-index': {
+                       'type': 'string',
+                       'description': 'Parameter of the transformer which writes an index next to the output file, '
+                                      'writers must write a local output file'},
+                   'shards': {
+                       'type': 'array',
+                       'items': {'type': ['array', 'null'], 'items': {'type': 'string'}},
+                       'description': 'Entries of each shard when the plan is split in several pipelines, null '
+                                      'entries when they are not known (restoration)'}
                },
                'additionalProperties': False
                }
@@ -44,6 +69,14 @@ class AbstractActuator:
         self._verbose = global_context['verbose']
         self._isBackup = global_context['backup']
         self._isRestore = not global_context['backup']
+        self._in_process = global_context.get('in-process', False)
+        # CPUs available for this backup, they are shared between backups run at the same time
+        self._threads = global_context.get('threads', os.cpu_count() or 1)
+        # Pipeline of the plan run by this actuator, when the reader splits the plan in shards
+        self._shard_index = global_context.get('shard-index', 0)
+        self._shards = global_context.get('shards')
+        # Paths to restore (restore --path), None to restore everything
+        self._restore_paths = global_context.get('restore-paths')
         self._args: dict = args
         self._metadata: Dict[str, Dict[str, ActuatorMetadata]] = metadata
 
@@ -67,6 +100,13 @@ class AbstractActuator:
     def _generate_metadata(self) -> dict:
         return {}
 
+    def catalog_entry(self) -> dict:
+        """
+        Part of the entry of the backup in the catalog of the output directory, called once the backup has run
+        :returns: 'files' written by this actuator and 'depends-on' (date times of backups needed to restore this one)
+        """
+        return {}
+
     def _validate_parameters(self) -> None:
         try:
             self._get_params()
@@ -92,9 +132,27 @@ class CommandActuator(AbstractActuator):
             raise Exception('You are not allowed to call this function outside dry-run')
         return self._generate_backup_cmd()
 
-    def generate_backup_process(self, stdin: IO[AnyStr], stdout: IO[AnyStr]) -> subprocess.Popen:
+    def _run_in_process(self) -> bool:
+        """ True if native implementations of this actuator have to be used instead of commands """
+        return self._in_process
+
+    def _native_backup_target(self) -> Callable[[int, int], None] or None:
+        """
+        Function run in a thread of bashckup instead of the backup command when in-process mode is enabled
+        :returns: None if this actuator has no native implementation
+        """
+        return None
+
+    def end_backup(self, success: bool) -> None:
+        """ Called once all processes of the backup ended, to keep or discard what this actuator prepared for it """
+        pass
+
+    def generate_backup_process(self, stdin: IO[AnyStr], stdout: IO[AnyStr]) -> subprocess.Popen or NativeProcess:
         if self._dry_run is True:
             raise Exception('You are not allowed to call this function in dry-run')
+        native_target = self._native_backup_target() if self._run_in_process() else None
+        if native_target is not None:
+            return NativeProcess(self._generate_backup_cmd(), native_target, stdin, stdout)
         return subprocess.Popen(self._generate_backup_cmd(), shell=False, stdin=stdin, stdout=stdout,
                                 stderr=subprocess.PIPE)
 
@@ -107,10 +165,20 @@ class CommandActuator(AbstractActuator):
             raise Exception('You are not allowed to call this function outside dry-run')
         return self._generate_restore_cmd()
 
+    def _native_restore_target(self) -> Callable[[int, int], None] or None:
+        """
+        Function run in a thread of bashckup instead of the restore command when in-process mode is enabled
+        :returns: None if this actuator has no native implementation
+        """
+        return None
+
     def generate_restore_process(self, stdin: IO[AnyStr],
-                                 stdout: IO[AnyStr] = None) -> subprocess.Popen:
+                                 stdout: IO[AnyStr] = None) -> subprocess.Popen or NativeProcess:
         if self._dry_run is True:
             raise Exception('You are not allowed to call this function in dry-run')
+        native_target = self._native_restore_target() if self._run_in_process() else None
+        if native_target is not None:
+            return NativeProcess(self._generate_restore_cmd(), native_target, stdin, stdout)
         return subprocess.Popen(self._generate_restore_cmd(), shell=False, stdin=stdin, stdout=stdout,
                                 stderr=subprocess.PIPE)
 
@@ -126,19 +194,27 @@ class PythonActuator(AbstractActuator):
         pass
 
     @abstractmethod
-    def _run_backup(self, args: dict) -> None:
+    def _run_backup(self, args: dict) -> dict or None:
+        """
+        :return: Metrics of the run (e.g. number of removed files), None if there is nothing to report
+        """
         pass
 
     @abstractmethod
     def _dry_run_backup(self, args: dict) -> None:
         pass
 
-    def run_backup(self) -> None:
+    def run_backup(self) -> dict:
+        """
+        :return: Metrics of the run, empty in dry-run
+        """
         args = self._prepare_run_backup()
         if self._dry_run is True:
             self._dry_run_backup(args)
+            return {}
         else:
-            self._run_backup(args)
+            metrics = self._run_backup(args)
+            return metrics if metrics is not None else {}
 
     @abstractmethod
     def _prepare_run_restore(self) -> dict:
@@ -2,15 +2,17 @@ from typing import Dict, List
 
 from bashckup.actuators.actuators import ActuatorMetadata
 from bashckup.actuators.post_backup import CleanFolderPostBackup, RsyncPostBackup, AbstractPostBackup
-from bashckup.actuators.readers import FileReader, MariaDBReader, AbstractReader
-from bashckup.actuators.transformers import GzipTransformer, OpenSSLTransformer, AbstractTransformer
-from bashckup.actuators.writers import FileWriter, AbstractWriter
+from bashckup.actuators.readers import FileReader, IncrementalFileReader, MariaDBReader, AbstractReader
+from bashckup.actuators.transformers import GzipTransformer, OpenSSLTransformer, AbstractTransformer, \
+    PigzTransformer, ZstdTransformer, XzTransformer, AeadTransformer
+from bashckup.actuators.writers import FileWriter, AbstractWriter, DedupStoreWriter, SshFileWriter
 
 
 class ActuatorFactory:
-    readerModules = [FileReader, MariaDBReader]
-    transformerModules = [GzipTransformer, OpenSSLTransformer]
-    writerModules = [FileWriter]
+    readerModules = [FileReader, IncrementalFileReader, MariaDBReader]
+    transformerModules = [GzipTransformer, PigzTransformer, ZstdTransformer, XzTransformer, OpenSSLTransformer,
+                          AeadTransformer]
+    writerModules = [FileWriter, DedupStoreWriter, SshFileWriter]
     postBackupModules = [CleanFolderPostBackup, RsyncPostBackup]
 
     _reader = dict((x.module_name(), x.__name__) for x in readerModules)
@@ -0,0 +1,307 @@
+import collections
+import hashlib
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from bashckup.actuators import native
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey, RSAPrivateKey
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PublicKey, X25519PrivateKey
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:  # Optional dependency (bashckup[aead]), checked by the aead transformer
+    InvalidTag = None
+    AESGCM = None
+    ChaCha20Poly1305 = None
+
+"""
+Authenticated encryption of a stream by chunks (STREAM construction): the stream is cut in chunks of chunk-size bytes,
+each one encrypted alone with AES-256-GCM or ChaCha20-Poly1305, so chunks are encrypted and decrypted on several
+threads, and each chunk is authenticated: corruption is detected on the chunk, without decrypting the whole stream.
+- header: magic, cipher, chunk size, source of the key and prefix of the nonces
+- chunks: ciphertext and tag of each chunk. The nonce of a chunk is the prefix, the index of the chunk and a flag set on
+  the last chunk, so chunks can not be reordered, and a truncated stream is detected. The header is authenticated
+  with each chunk.
+Each stream has its own key, either:
+- derived from a password and a random salt (PBKDF2-HMAC-SHA256), given by the header
+- random, and wrapped for each recipient in the header: with X25519 (ephemeral key exchange, HKDF-SHA256 and
+  AES-256-GCM) or with RSA-OAEP-SHA256. Only the private key of a recipient is needed to decrypt the stream.
+"""
+
+magic = b'bashckup-aead 1\n'  # Key derived from a password
+recipientsMagic = b'bashckup-aead 2\n'  # Key wrapped for each recipient
+header = struct.Struct('>BII16s7s')  # Cipher, chunk size, PBKDF2 iterations, salt and prefix of the nonces
+recipientsHeader = struct.Struct('>BIH7s')  # Cipher, chunk size, number of recipients and prefix of the nonces
+recipientRecord = struct.Struct('>B8sH')  # Type of the public key, its identifier and size of the wrapped key
+nonceSuffix = struct.Struct('>I?')  # Index of the chunk and flag of the last chunk
+tagSize = 16
+keySize = 32
+ciphers = {'aes-256-gcm': 1, 'chacha20-poly1305': 2}
+keyTypes = {'x25519': 1, 'rsa': 2}
+defaultCipher = 'aes-256-gcm'
+defaultChunkSize = 1024 * 1024
+minimumChunkSize = 4 * 1024
+maximumChunkSize = 64 * 1024 * 1024
+defaultIterations = 600000
+headerSize = len(magic) + header.size  # Header of streams encrypted with a password
+
+
+class AeadError(Exception):
+    pass
+
+
+def is_available() -> bool:
+    """ :returns: True if the cryptography package is installed """
+    return AESGCM is not None
+
+
+def read_password(password_file: Path) -> bytes:
+    """ :returns: First line of the file, as openssl -kfile does """
+    with open(password_file, 'rb') as f:
+        return f.readline().rstrip(b'\r\n')
+
+
+def load_public_key(key_file: Path):
+    """ :returns: X25519 or RSA public key of a PEM file """
+    try:
+        with open(key_file, 'rb') as f:
+            key = serialization.load_pem_public_key(f.read())
+    except ValueError as e:
+        raise AeadError(f'[{key_file}] is not a PEM public key: {e}') from None
+    if not isinstance(key, (X25519PublicKey, RSAPublicKey)):
+        raise AeadError(f'[{key_file}] is neither a X25519 nor a RSA public key')
+    return key
+
+
+def load_private_key(key_file: Path):
+    """ :returns: X25519 or RSA private key of a PEM file, which is not encrypted """
+    try:
+        with open(key_file, 'rb') as f:
+            key = serialization.load_pem_private_key(f.read(), password=None)
+    except (ValueError, TypeError) as e:
+        raise AeadError(f'[{key_file}] is not a PEM private key without password: {e}') from None
+    if not isinstance(key, (X25519PrivateKey, RSAPrivateKey)):
+        raise AeadError(f'[{key_file}] is neither a X25519 nor a RSA private key')
+    return key
+
+
+def _key_id(public_key) -> bytes:
+    return hashlib.sha256(public_key.public_bytes(serialization.Encoding.DER,
+                                                  serialization.PublicFormat.SubjectPublicKeyInfo)).digest()[:8]
+
+
+def _key_encryption_key(shared_key: bytes, ephemeral_key: bytes, public_key: bytes) -> bytes:
+    return HKDF(hashes.SHA256(), keySize, None, b'bashckup-aead x25519' + ephemeral_key + public_key).derive(shared_key)
+
+
+def _raw(public_key) -> bytes:
+    return public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+
+def _rsa_padding():
+    return padding.OAEP(padding.MGF1(hashes.SHA256()), hashes.SHA256(), None)
+
+
+def _wrap(public_key, key: bytes) -> bytes:
+    """ :returns: Record of the recipient in the header, with the key wrapped for its public key """
+    if isinstance(public_key, X25519PublicKey):
+        ephemeral = X25519PrivateKey.generate()
+        ephemeral_key = _raw(ephemeral.public_key())
+        key_encryption_key = _key_encryption_key(ephemeral.exchange(public_key), ephemeral_key, _raw(public_key))
+        # Key encryption key is used once, so the nonce can be constant
+        (key_type, wrapped) = ('x25519', ephemeral_key + AESGCM(key_encryption_key).encrypt(bytes(12), key, None))
+    else:
+        (key_type, wrapped) = ('rsa', public_key.encrypt(key, _rsa_padding()))
+    return recipientRecord.pack(keyTypes[key_type], _key_id(public_key), len(wrapped)) + wrapped
+
+
+def _unwrap(private_key, recipients: List[Tuple[int, bytes, bytes]]) -> bytes:
+    """ :returns: Key of the stream, unwrapped by the private key of one of its recipients """
+    public_key = private_key.public_key()
+    for (key_type, key_id, wrapped) in recipients:
+        if key_id != _key_id(public_key):
+            continue
+        try:
+            if key_type == keyTypes['x25519']:
+                (ephemeral_key, wrapped_key) = (wrapped[:32], wrapped[32:])
+                key_encryption_key = _key_encryption_key(
+                    private_key.exchange(X25519PublicKey.from_public_bytes(ephemeral_key)), ephemeral_key,
+                    _raw(public_key))
+                return AESGCM(key_encryption_key).decrypt(bytes(12), wrapped_key, None)
+            if key_type == keyTypes['rsa']:
+                return private_key.decrypt(wrapped, _rsa_padding())
+        except (InvalidTag, ValueError):
+            raise AeadError('Key of the stream can not be unwrapped, the header is corrupted') from None
+    raise AeadError('Private key is not a recipient of the stream')
+
+
+class _Header:
+    """ Header of a stream, read from the start of the stream """
+
+    def __init__(self, read: Callable[[int], bytes]):
+        self.data = b''
+        stream_magic = self._read(read, len(magic))
+        if stream_magic == magic:
+            (self.cipher, self.chunk_size, self.iterations, self.salt, self.prefix) = \
+                header.unpack(self._read(read, header.size))
+            self.recipients = None
+        elif stream_magic == recipientsMagic:
+            (self.cipher, self.chunk_size, count, self.prefix) = \
+                recipientsHeader.unpack(self._read(read, recipientsHeader.size))
+            self.recipients = []
+            for _ in range(count):
+                (key_type, key_id, size) = recipientRecord.unpack(self._read(read, recipientRecord.size))
+                self.recipients.append((key_type, key_id, self._read(read, size)))
+        else:
+            raise AeadError('Stream is not encrypted by aead')
+        if not minimumChunkSize <= self.chunk_size <= maximumChunkSize:
+            raise AeadError(f'Chunk size [{self.chunk_size}] of the stream is invalid')
+
+    def _read(self, read: Callable[[int], bytes], size: int) -> bytes:
+        data = read(size)
+        if len(data) != size:
+            raise AeadError('Stream is not encrypted by aead, or its header is truncated')
+        self.data += data
+        return data
+
+    def cipher_of(self, password: bytes or None, private_key) -> object:
+        """ :returns: Cipher of the chunks, with the key of the stream """
+        if self.recipients is None:
+            if password is None:
+                raise AeadError('Stream is encrypted with a password')
+            key = hashlib.pbkdf2_hmac('sha256', password, self.salt, self.iterations, keySize)
+        else:
+            if private_key is None:
+                raise AeadError('Stream is encrypted with public keys, a private key is needed')
+            key = _unwrap(private_key, self.recipients)
+        return _cipher(self.cipher, key)
+
+
+def _cipher(cipher_id: int, key: bytes):
+    if cipher_id == ciphers['aes-256-gcm']:
+        return AESGCM(key)
+    if cipher_id == ciphers['chacha20-poly1305']:
+        return ChaCha20Poly1305(key)
+    raise AeadError(f'Cipher [{cipher_id}] is unknown')
+
+
+def _nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    if index > 0xffffffff:
+        raise AeadError('Stream has too many chunks, use a bigger chunk size')
+    return prefix + nonceSuffix.pack(index, last)
+
+
+def _read_exactly(fd: int, size: int) -> bytes:
+    """ :returns: size bytes, fewer only at the end of the stream """
+    pieces = []
+    while size != 0:
+        data = os.read(fd, size)
+        if len(data) == 0:
+            break
+        pieces.append(data)
+        size -= len(data)
+    return b''.join(pieces)
+
+
+def _decrypt(cipher, nonce: bytes, chunk: bytes, associated_data: bytes, index: int) -> bytes:
+    try:
+        return cipher.decrypt(nonce, chunk, associated_data)
+    except InvalidTag:
+        raise AeadError(f'Chunk [{index}] is corrupted or truncated, or the password is wrong') from None
+
+
+def _write_ordered(pending: collections.deque, out_fd: int, threads: int) -> None:
+    """ Writes chunks processed on other threads, in order, keeping at most threads * 2 chunks in progress """
+    while len(pending) > threads * 2 or (len(pending) != 0 and pending[0].done()):
+        native.write_all(out_fd, pending.popleft().result())
+
+
+def encrypt(in_fd: int, out_fd: int, password: bytes or None, cipher: str = defaultCipher,
+            chunk_size: int = defaultChunkSize, threads: int = 1, iterations: int = defaultIterations,
+            public_keys: list = None) -> dict:
+    """
+    :param password: Password the key is derived from, None when the key is wrapped for public_keys
+    :param public_keys: X25519 or RSA public keys of the recipients of the stream
+    :returns: Metrics of the encryption
+    """
+    prefix = os.urandom(7)
+    if public_keys is None:
+        salt = os.urandom(16)
+        stream_header = magic + header.pack(ciphers[cipher], chunk_size, iterations, salt, prefix)
+        key = hashlib.pbkdf2_hmac('sha256', password, salt, iterations, keySize)
+    else:
+        key = os.urandom(keySize)
+        stream_header = recipientsMagic + recipientsHeader.pack(ciphers[cipher], chunk_size, len(public_keys), prefix) \
+            + b''.join(_wrap(public_key, key) for public_key in public_keys)
+    stream_cipher = _cipher(ciphers[cipher], key)
+    native.write_all(out_fd, stream_header)
+    index = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()  # Chunks are encrypted ahead, on several threads
+        chunk = _read_exactly(in_fd, chunk_size)
+        while True:
+            # Last chunk is known once the next read is empty, an empty stream has one empty chunk
+            next_chunk = _read_exactly(in_fd, chunk_size) if len(chunk) == chunk_size else b''
+            last = len(next_chunk) == 0
+            pending.append(executor.submit(stream_cipher.encrypt, _nonce(prefix, index, last), chunk, stream_header))
+            _write_ordered(pending, out_fd, threads)
+            if last:
+                break
+            (chunk, index) = (next_chunk, index + 1)
+        _write_ordered(pending, out_fd, 0)
+    return {'chunks': index + 1}
+
+
+def decrypt(in_fd: int, out_fd: int, password: bytes or None, threads: int = 1, private_key=None) -> dict:
+    """
+    :param password: Password of streams encrypted with a password
+    :param private_key: Private key of a recipient of streams encrypted with public keys
+    :returns: Metrics of the decryption
+    """
+    stream_header = _Header(lambda size: _read_exactly(in_fd, size))
+    stream_cipher = stream_header.cipher_of(password, private_key)
+    sealed_size = stream_header.chunk_size + tagSize
+    index = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()  # Chunks are decrypted ahead, on several threads
+        chunk = _read_exactly(in_fd, sealed_size)
+        while True:
+            if len(chunk) < tagSize:
+                raise AeadError(f'Chunk [{index}] is truncated')
+            next_chunk = _read_exactly(in_fd, sealed_size) if len(chunk) == sealed_size else b''
+            last = len(next_chunk) == 0
+            pending.append(executor.submit(_decrypt, stream_cipher, _nonce(stream_header.prefix, index, last), chunk,
+                                           stream_header.data, index))
+            _write_ordered(pending, out_fd, threads)
+            if last:
+                break
+            (chunk, index) = (next_chunk, index + 1)
+        _write_ordered(pending, out_fd, 0)
+    return {'chunks': index + 1}
+
+
+def read_chunk(fd: int, password: bytes or None, index: int, private_key=None) -> bytes:
+    """ :returns: Data of a chunk of an encrypted file, read without reading the other chunks """
+    position = 0
+
+    def read(size: int) -> bytes:
+        nonlocal position
+        data = os.pread(fd, size, position)
+        position += len(data)
+        return data
+
+    stream_header = _Header(read)
+    stream_cipher = stream_header.cipher_of(password, private_key)
+    offset = len(stream_header.data) + index * (stream_header.chunk_size + tagSize)
+    chunk = os.pread(fd, stream_header.chunk_size + tagSize, offset)
+    if len(chunk) < tagSize:
+        raise AeadError(f'Chunk [{index}] does not exist')
+    last = offset + len(chunk) == os.fstat(fd).st_size
+    return _decrypt(stream_cipher, _nonce(stream_header.prefix, index, last), chunk, stream_header.data, index)
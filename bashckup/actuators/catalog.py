@@ -0,0 +1,163 @@
+import fcntl
+import json
+import os
+import re
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Iterator, Set, Tuple
+
+from bashckup.actuators import delta, writers
+from bashckup.report import write_atomically
+
+"""
+Catalog of backups of an output directory: writers add an entry for each backup, cleaners read it instead of scanning
+the directory, and remove entries of the backups they delete. So cleaning costs O(kept backups), whatever the number of
+files of the directory.
+
+An entry is a dict:
+- datetime: Date time of the backup (timestamp prefix of its files)
+- name: File name of the backup, backups with the same name are a series (GFS rules are applied by series)
+- files: Files of the backup, relative to the directory
+- depends-on: Date times of the backups of the series needed to restore this one (full backup of a delta or level 0
+  of an incremental backup)
+- success: False if an error appeared during the backup
+"""
+
+catalogFileName = '.bashckup-catalog.json'
+catalogVersion = 1
+# Period of each GFS rule, 2 backups are in the same period when their keys are equal
+gfsPeriods = {'daily': '%Y-%m-%d', 'weekly': '%G-%V', 'monthly': '%Y-%m', 'yearly': '%Y'}
+
+
+class CatalogError(Exception):
+    pass
+
+
+def _scan(directory: Path, file_name: str = None) -> List[dict]:
+    """
+    Builds entries of backups written before the catalog existed: files with the same timestamp prefix are a backup
+    (e.g. a level 0 backup and its incremental metadata file). Dependencies of deltas are read from their header.
+    :param file_name: File name of the backups of the writer, used to name the series of entries
+    """
+    backups: Dict[str, List[str]] = {}
+    with os.scandir(directory) as it:
+        entry: os.DirEntry
+        for entry in it:
+            matches = writers.outputFileRegex.search(entry.name)
+            if matches is not None and entry.is_file():
+                backups.setdefault(matches.group(1), []).append(entry.name)
+    entries = []
+    for (backup_datetime, files) in sorted(backups.items()):
+        names = sorted(writers.outputFileRegex.search(f).group(2) for f in files)
+        if file_name is not None and (file_name in names or file_name + delta.deltaSuffix in names):
+            name = file_name
+        else:
+            name = re.sub(f'({re.escape(delta.deltaSuffix)}|{re.escape(delta.signatureSuffix)})$', '', names[0])
+        bases = [delta.base_name(directory / f) for f in files if f.endswith(delta.deltaSuffix)]
+        depends_on = [writers.datetimeOutputFileRegex.search(b).group(1) for b in bases
+                      if b is not None and writers.datetimeOutputFileRegex.search(b) is not None]
+        entries.append({'datetime': backup_datetime, 'name': name, 'files': sorted(files), 'depends-on': depends_on,
+                        'success': True})
+    return entries
+
+
+class Catalog:
+    """ Backups of an output directory, see the description of the module """
+
+    def __init__(self, directory: Path, file_name: str = None):
+        """ :param file_name: File name of the backups of the writer, used when the catalog is built """
+        self.directory = Path(directory)
+        self.path = self.directory / catalogFileName
+        self.entries: List[dict] = []
+        self._file_name = file_name
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    def load(self) -> 'Catalog':
+        """ Reads the catalog, the directory is scanned only when the catalog does not exist yet """
+        try:
+            with open(self.path, 'r') as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            self.entries = _scan(self.directory, self._file_name) if self.directory.is_dir() else []
+            return self
+        except (OSError, ValueError) as e:
+            raise CatalogError(f'Catalog [{self.path}] is unreadable, remove it to rebuild it from the '
+                               f'directory.\nReason: {e}') from e
+        if not isinstance(content, dict) or content.get('version') != catalogVersion:
+            raise CatalogError(f'Catalog [{self.path}] has an unknown format')
+        self.entries = content['backups']
+        return self
+
+    def save(self) -> None:
+        write_atomically(self.path, json.dumps({'version': catalogVersion, 'backups': self.entries}, indent=1))
+
+    @contextmanager
+    def update(self) -> Iterator['Catalog']:
+        """ Loads then saves the catalog, plans sharing the directory wait for each other """
+        # The directory is locked, a lock on the catalog would be lost when it is replaced
+        lock = os.open(self.directory, os.O_RDONLY)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield self.load()
+            self.save()
+        finally:
+            os.close(lock)
+
+    def add(self, entry: dict) -> None:
+        # Files of the entry can already be in entries when the catalog has just been built from the directory
+        files = set(entry['files'])
+        for other in self.entries:
+            other['files'] = [f for f in other['files'] if f not in files]
+            if (other['datetime'], other['name']) == (entry['datetime'], entry['name']):
+                entry['files'] = entry['files'] + other['files']
+                other['files'] = []
+        self.entries = [e for e in self.entries if len(e['files']) != 0]
+        self.entries.append(entry)
+
+    def remove(self, removed: List[dict]) -> None:
+        keys = {(e['datetime'], e['name']) for e in removed}
+        self.entries = [e for e in self.entries if (e['datetime'], e['name']) not in keys]
+
+
+def backups_to_keep(entries: List[dict], today: datetime, retention: int = None,
+                    keep: Dict[str, int] = None) -> List[dict]:
+    """
+    :param retention: Backups younger than this number of days are kept
+    :param keep: Number of periods to keep by GFS rule (e.g. {'daily': 7, 'monthly': 12}): the latest successful backup
+    of each of the last N periods having a backup is kept, by series
+    :returns: Kept entries, with the backups they depend on
+    """
+    keep = keep if keep is not None else {}
+    kept: Set[Tuple[str, str]] = set()
+    by_key = {(e['datetime'], e['name']): e for e in entries}
+    if retention is not None:
+        limit = today - timedelta(days=retention)
+        kept.update(k for (k, e) in by_key.items() if datetime.fromisoformat(e['datetime']) > limit)
+    series: Dict[str, List[dict]] = {}
+    for entry in entries:
+        if entry.get('success', True):
+            series.setdefault(entry['name'], []).append(entry)
+    for backups in series.values():
+        backups.sort(key=lambda e: e['datetime'], reverse=True)
+        for (rule, count) in keep.items():
+            periods = set()
+            for entry in backups:
+                period = datetime.fromisoformat(entry['datetime']).strftime(gfsPeriods[rule])
+                if period in periods:
+                    continue
+                if len(periods) == count:
+                    break
+                periods.add(period)
+                kept.add((entry['datetime'], entry['name']))
+    # Backups needed to restore kept ones are kept too, dependencies of dependencies included
+    pending = list(kept)
+    while len(pending) != 0:
+        (_, name) = key = pending.pop()
+        for dependency in by_key[key].get('depends-on', []):
+            if (dependency, name) in by_key and (dependency, name) not in kept:
+                kept.add((dependency, name))
+                pending.append((dependency, name))
+    return [e for e in entries if (e['datetime'], e['name']) in kept]
@@ -0,0 +1,336 @@
+import collections
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, IO, Iterator, Tuple
+
+from bashckup.actuators import native
+
+"""
+Deduplicating store: a stream is split in content-defined chunks, each unique chunk is stored once in a folder keyed by
+its sha256, and a manifest lists chunks of each backup.
+
+A boundary is placed after a byte when the sum of pseudo-random values (gear) of the last windowSize bytes matches a
+condition, so boundaries only depend on the content around them and an insertion only changes chunks around it.
+Sums are computed for all positions of a segment at once with big integer arithmetic, which runs at C speed:
+gear values are written in 24 bits lanes of an integer X, and X * (1 + z + ... + z^(windowSize - 1)) with z = 2^24 gives
+the sum of each window in each lane. This product is computed as (X * z^windowSize - X) // (z - 1), which is linear.
+"""
+
+manifestHeader = b'bashckup-dedup 1\n'
+storeFolderName = 'chunks'
+windowSize = 16
+laneBytes = 3  # 16 gear values of 20 bits fit in a lane without carry
+gearBits = 20
+segmentSize = 4 * 1024 * 1024  # Data searched for boundaries by a worker at once
+defaultAverageChunkSize = 1024 * 1024
+minimumAverageChunkSize = 64 * 1024  # Boundary condition needs the second byte of sums to be null
+maximumAverageChunkSize = 1024 * 1024  # Boundary condition uses the gearBits low bits of sums
+defaultCompressionLevel = 6
+lockFileName = '.lock'
+temporaryFilesMaxAge = 24 * 3600  # Seconds after which a temporary chunk is left by an interrupted backup
+
+
+class DedupError(Exception):
+    pass
+
+
+def _gear_values() -> List[int]:
+    """
+    Pseudo-random value of each byte, they are fixed so boundaries are the same between runs.
+    Values where a run of the same byte would pass the first filter of find_boundaries are skipped, so long runs
+    (e.g. zeros of tar padding) do not slow down the search.
+    """
+    values = []
+    for byte in range(256):
+        counter = 0
+        while True:
+            value = int.from_bytes(hashlib.sha256(f'bashckup-gear-{byte}-{counter}'.encode()).digest()[:4],
+                                   'little') & ((1 << gearBits) - 1)
+            if ((value * windowSize) >> 8) & 0xFF != 0:
+                break
+            counter += 1
+        values.append(value)
+    return values
+
+
+gearValues = _gear_values()
+# Byte k of the gear value of each byte, so lanes are filled with bytes.translate
+gearTables = [bytes((value >> (8 * k)) & 0xFF for value in gearValues) for k in range(laneBytes)]
+
+
+def boundary_threshold(average_size: int) -> int:
+    """ Threshold of sums (modulo 2^gearBits), so a boundary appears on average every average_size bytes """
+    minimum = average_size // 4
+    return max(1, round((1 << gearBits) / (average_size - minimum)))
+
+
+def find_boundaries(data: bytes, prefix: bytes, threshold: int) -> List[int]:
+    """
+    :param prefix: Last bytes before data (windowSize - 1 bytes), to compute sums of the first positions of data
+    :param threshold: Lower than 256
+    :returns: Positions in data of bytes after which a boundary can be placed
+    """
+    window = prefix + data
+    count = len(window)
+    lanes = bytearray(laneBytes * count)
+    for k in range(laneBytes):
+        lanes[k::laneBytes] = window.translate(gearTables[k])
+    values = int.from_bytes(lanes, 'little')
+    lane = 8 * laneBytes
+    sums = (((values << (lane * windowSize)) - values) // ((1 << lane) - 1)).to_bytes(
+        laneBytes * (count + windowSize), 'little')
+    low = sums[0:laneBytes * count:laneBytes]
+    middle = sums[1:laneBytes * count:laneBytes]
+    high = sums[2:laneBytes * count:laneBytes]
+    high_mask = ((1 << (gearBits - 16)) - 1)
+    boundaries = []
+    # sum < threshold, with threshold < 256, means that the second byte is null: it is searched at C speed first
+    position = middle.find(0, len(prefix))
+    while position != -1:
+        if high[position] & high_mask == 0 and low[position] < threshold:
+            boundaries.append(position - len(prefix))
+        position = middle.find(0, position + 1)
+    return boundaries
+
+
+def _read_segment(in_fd: int, size: int) -> bytes:
+    """ Reads size bytes, less only at the end of the stream """
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = os.read(in_fd, remaining)
+        if len(data) == 0:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+@contextmanager
+def lock_store(store: Path, exclusive: bool) -> Iterator[None]:
+    """
+    Backups writing chunks hold a shared lock until their manifest is written, garbage collection holds an exclusive
+    one: chunks of a backup are not listed by a manifest before it ends
+    """
+    os.makedirs(store, exist_ok=True)
+    with open(store / lockFileName, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def chunk_path(store: Path, digest: str) -> Path:
+    return store / digest[:2] / digest
+
+
+def _store_chunk(store: Path, chunk: bytes, level: int) -> Tuple[str, int, int]:
+    """
+    Writes the chunk in the store if it is not already there
+    :returns: Digest, size and bytes written on disk (0 if the chunk already exists)
+    """
+    digest = hashlib.sha256(chunk).hexdigest()
+    path = chunk_path(store, digest)
+    if path.exists():
+        return digest, len(chunk), 0
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    content = compressor.compress(chunk) + compressor.flush()
+    os.makedirs(path.parent, exist_ok=True)
+    # Written under a temporary name, so an interrupted backup cannot leave a truncated chunk that others would use
+    temporary_path = path.parent / f'.{digest}.{uuid.uuid4().hex}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+    return digest, len(chunk), len(content)
+
+
+def _boundaries_executor(threads: int) -> Executor:
+    if threads == 1:
+        return ThreadPoolExecutor(max_workers=1)
+    # Search of boundaries holds the GIL, so it is run in processes. forkserver, because forking a process with threads
+    # can copy locks held by other threads.
+    return ProcessPoolExecutor(max_workers=threads, mp_context=multiprocessing.get_context('forkserver'))
+
+
+def split_stream(in_fd: int, average_size: int = defaultAverageChunkSize, threads: int = 1) -> Iterator[bytes]:
+    """ Reads in_fd until EOF and yields its content-defined chunks, in the order of the stream """
+    minimum = average_size // 4
+    maximum = average_size * 4
+    threshold = boundary_threshold(average_size)
+    with _boundaries_executor(threads) as boundaries_executor:
+        segments = collections.deque()  # Segments read, with their boundaries being searched
+        prefix = b''
+        end_of_stream = False
+        buffer = bytearray()  # Data not yet in a chunk
+        buffer_offset = 0  # Position in the stream of the buffer
+        cuts = collections.deque()  # Positions in the stream where a chunk can end
+        while True:
+            while not end_of_stream and len(segments) < threads * 2:
+                data = _read_segment(in_fd, segmentSize)
+                if len(data) == 0:
+                    end_of_stream = True
+                    break
+                segments.append((data, boundaries_executor.submit(find_boundaries, data, prefix, threshold)))
+                prefix = data[-(windowSize - 1):] if len(data) >= windowSize - 1 else \
+                    (prefix + data)[-(windowSize - 1):]
+            if len(segments) == 0:
+                return
+            (data, boundaries) = segments.popleft()
+            data_offset = buffer_offset + len(buffer)
+            cuts.extend(data_offset + boundary + 1 for boundary in boundaries.result())
+            buffer += data
+            last_segment = end_of_stream and len(segments) == 0
+
+            start = 0
+            while True:
+                while len(cuts) != 0 and cuts[0] - buffer_offset - start < minimum:
+                    cuts.popleft()
+                if len(cuts) != 0 and cuts[0] - buffer_offset - start <= maximum:
+                    end = cuts.popleft() - buffer_offset
+                elif len(buffer) - start >= maximum:
+                    end = start + maximum
+                elif last_segment and len(buffer) > start:
+                    end = len(buffer)
+                else:
+                    break
+                yield bytes(memoryview(buffer)[start:end])
+                start = end
+            del buffer[:start]
+            buffer_offset += start
+
+
+def store_stream(in_fd: int, manifest: IO[bytes], store: Path, average_size: int = defaultAverageChunkSize,
+                 level: int = defaultCompressionLevel, threads: int = 1) -> dict:
+    """
+    Splits in_fd in chunks, stores new ones and writes the manifest.
+    :returns: Metrics of deduplication
+    """
+    metrics = {'chunks': 0, 'new-chunks': 0, 'bytes': 0, 'stored-bytes': 0}
+    checksum = hashlib.sha256()
+    manifest.write(manifestHeader)
+
+    with ThreadPoolExecutor(max_workers=threads) as store_executor:
+        stored = collections.deque()  # Chunks being stored, in the order of the stream
+
+        def write_stored(wait_all: bool) -> None:
+            # sha256 and zlib release the GIL, chunks are stored on several threads while the manifest keeps the order
+            while len(stored) != 0 and (wait_all or stored[0].done() or len(stored) > threads * 4):
+                (digest, size, written) = stored.popleft().result()
+                manifest.write(f'{digest} {size}\n'.encode())
+                metrics['chunks'] += 1
+                metrics['bytes'] += size
+                if written != 0:
+                    metrics['new-chunks'] += 1
+                    metrics['stored-bytes'] += written
+
+        for chunk in split_stream(in_fd, average_size, threads):
+            checksum.update(chunk)
+            stored.append(store_executor.submit(_store_chunk, store, chunk, level))
+            write_stored(False)
+        write_stored(True)
+    manifest.write(f'end {metrics["bytes"]} {checksum.hexdigest()}\n'.encode())
+    return metrics
+
+
+class Manifest:
+    """ List of chunks of a backup, size and checksum of the whole stream are known once all chunks are read """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.size = None
+        self.checksum = None
+
+    def chunks(self) -> Iterator[Tuple[str, int]]:
+        """ :returns: Digest and size of each chunk """
+        with open(self.path, 'rb') as manifest:
+            if manifest.readline() != manifestHeader:
+                raise DedupError(f'[{self.path}] is not a manifest of a deduplicating store')
+            for line in manifest:
+                fields = line.split()
+                if fields[0] == b'end':
+                    self.size = int(fields[1])
+                    self.checksum = fields[2].decode()
+                    return
+                yield fields[0].decode(), int(fields[1])
+        raise DedupError(f'Manifest [{self.path}] is truncated, its backup did not end')
+
+
+def _load_chunk(store: Path, digest: str, size: int) -> bytes:
+    path = chunk_path(store, digest)
+    try:
+        with open(path, 'rb') as f:
+            chunk = zlib.decompress(f.read(), 16 + zlib.MAX_WBITS)
+    except FileNotFoundError:
+        raise DedupError(f'Chunk [{digest}] is missing from the store') from None
+    if len(chunk) != size or hashlib.sha256(chunk).hexdigest() != digest:
+        raise DedupError(f'Chunk [{digest}] is corrupted')
+    return chunk
+
+
+def restore_stream(manifest_path: Path, store: Path, out_fd: int, threads: int = 1) -> None:
+    """ Writes chunks listed by the manifest to out_fd, and verifies the whole stream """
+    manifest = Manifest(manifest_path)
+    checksum = hashlib.sha256()
+    size = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        loading = collections.deque()  # Chunks are read and decompressed ahead, on several threads
+        for (digest, chunk_size) in manifest.chunks():
+            loading.append(executor.submit(_load_chunk, store, digest, chunk_size))
+            while len(loading) > threads * 2 or (len(loading) != 0 and loading[0].done()):
+                chunk = loading.popleft().result()
+                checksum.update(chunk)
+                size += len(chunk)
+                native.write_all(out_fd, chunk)
+        while len(loading) != 0:
+            chunk = loading.popleft().result()
+            checksum.update(chunk)
+            size += len(chunk)
+            native.write_all(out_fd, chunk)
+    if manifest.size != size or manifest.checksum != checksum.hexdigest():
+        raise DedupError(f'Restored data does not match manifest [{manifest_path}]')
+
+
+def collect_garbage(directory: Path, store: Path) -> int:
+    """
+    Removes chunks that are not listed by any manifest of the directory (e.g. manifests removed by cleanFolder). Backups
+    writing in the store are waited for, see lock_store.
+    :returns: Number of removed chunks
+    """
+    if not store.is_dir():
+        return 0
+    with lock_store(store, exclusive=True):
+        referenced = set()
+        with os.scandir(directory) as it:
+            entry: os.DirEntry
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                with open(entry.path, 'rb') as f:
+                    if f.read(len(manifestHeader)) != manifestHeader:
+                        continue
+                    f.seek(0)
+                    for line in f.readlines()[1:]:
+                        referenced.add(line.split()[0].decode())
+        removed = 0
+        with os.scandir(store) as folders:
+            for folder in folders:
+                if not folder.is_dir():
+                    continue
+                with os.scandir(folder.path) as it:
+                    for entry in it:
+                        if entry.name in referenced:
+                            continue
+                        # Temporary files may be written by a process which does not lock the store, only the ones
+                        # left by interrupted backups are removed
+                        if entry.name.endswith('.tmp') and \
+                                time.time() - entry.stat().st_mtime < temporaryFilesMaxAge:
+                            continue
+                        os.remove(entry.path)
+                        removed += 1
+        return removed
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import struct
+import uuid
+from pathlib import Path
+from typing import IO, Dict, Tuple
+
+from bashckup.actuators import native, dedup
+
+"""
+Delta backups: a full backup (base) is written with a signature listing digests of its blocks, then next backups only
+write a delta: blocks found in the signature are copied from the base, other blocks are written as literals.
+Blocks are the content-defined chunks of the dedup module, so an insertion or a deletion does not shift all following
+blocks, as rsync's rolling checksum, but boundaries are found at C speed.
+Each delta refers to the base, not to the previous delta, so a backup is restored by reading its delta and its base
+in one pass, and deltas between the base and the latest one can be removed.
+"""
+
+signatureHeader = b'bashckup-signature 1\n'
+deltaHeader = b'bashckup-delta 1\n'
+signatureSuffix = '.signature'
+deltaSuffix = '.delta'
+defaultAverageBlockSize = dedup.minimumAverageChunkSize
+copyRecord = struct.Struct('>cQQ')  # Offset and length in the base
+literalRecord = struct.Struct('>cQ')  # Length of the data following the record
+endRecord = struct.Struct('>cQ32s')  # Size and sha256 of the restored stream
+
+
+class DeltaError(Exception):
+    pass
+
+
+def write_base(in_fd: int, out_fd: int, signature_path: Path, average_size: int = defaultAverageBlockSize,
+               threads: int = 1) -> dict:
+    """
+    Copies in_fd into out_fd and writes the signature of the data
+    :returns: Metrics of the backup
+    """
+    size = 0
+    checksum = hashlib.sha256()
+    # Written under a temporary name, so a signature exists only for complete bases
+    temporary_path = signature_path.parent / f'.{signature_path.name}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(temporary_path, 'wb') as signature:
+            signature.write(signatureHeader)
+            for block in dedup.split_stream(in_fd, average_size, threads):
+                native.write_all(out_fd, block)
+                checksum.update(block)
+                size += len(block)
+                signature.write(f'{hashlib.sha256(block).hexdigest()} {len(block)}\n'.encode())
+            signature.write(f'end {size} {checksum.hexdigest()}\n'.encode())
+        os.replace(temporary_path, signature_path)
+    except BaseException:
+        if temporary_path.exists():
+            temporary_path.unlink()
+        raise
+    return {'bytes': size, 'copied-bytes': 0, 'stored-bytes': size}
+
+
+def read_signature(signature_path: Path) -> Dict[str, Tuple[int, int]]:
+    """ :returns: Offset and size in the base of each block, by digest """
+    blocks = {}
+    offset = 0
+    with open(signature_path, 'rb') as signature:
+        if signature.readline() != signatureHeader:
+            raise DeltaError(f'[{signature_path}] is not a signature of a delta backup')
+        for line in signature:
+            fields = line.split()
+            if fields[0] == b'end':
+                return blocks
+            size = int(fields[1])
+            blocks.setdefault(fields[0].decode(), (offset, size))
+            offset += size
+    raise DeltaError(f'Signature [{signature_path}] is truncated')
+
+
+def write_delta(in_fd: int, out_fd: int, base_path: Path, average_size: int = defaultAverageBlockSize,
+                threads: int = 1) -> dict:
+    """
+    Writes the delta of in_fd against the base, its signature must exist
+    :returns: Metrics of the backup
+    """
+    blocks = read_signature(base_path.parent / (base_path.name + signatureSuffix))
+    metrics = {'bytes': 0, 'copied-bytes': 0, 'stored-bytes': 0}
+    checksum = hashlib.sha256()
+    native.write_all(out_fd, deltaHeader + f'base {base_path.name}\n'.encode())
+    copy_offset, copy_size = 0, 0  # Contiguous blocks of the base are copied by a single record
+
+    for block in dedup.split_stream(in_fd, average_size, threads):
+        checksum.update(block)
+        metrics['bytes'] += len(block)
+        found = blocks.get(hashlib.sha256(block).hexdigest())
+        if found is not None and found[1] == len(block):
+            metrics['copied-bytes'] += len(block)
+            if copy_size != 0 and copy_offset + copy_size == found[0]:
+                copy_size += len(block)
+                continue
+            if copy_size != 0:
+                native.write_all(out_fd, copyRecord.pack(b'C', copy_offset, copy_size))
+            copy_offset, copy_size = found
+            continue
+        if copy_size != 0:
+            native.write_all(out_fd, copyRecord.pack(b'C', copy_offset, copy_size))
+            copy_size = 0
+        native.write_all(out_fd, literalRecord.pack(b'L', len(block)))
+        native.write_all(out_fd, block)
+        metrics['stored-bytes'] += len(block)
+    if copy_size != 0:
+        native.write_all(out_fd, copyRecord.pack(b'C', copy_offset, copy_size))
+    native.write_all(out_fd, endRecord.pack(b'E', metrics['bytes'], checksum.digest()))
+    return metrics
+
+
+def base_name(path: Path) -> str or None:
+    """ :returns: File name of the base of a delta backup, None if the file is not a delta backup """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(deltaHeader)) != deltaHeader:
+                return None
+            line = f.readline()
+    except OSError:
+        return None
+    if not line.startswith(b'base ') or not line.endswith(b'\n'):
+        raise DeltaError(f'Delta [{path}] has no base')
+    return line[len(b'base '):-1].decode()
+
+
+def _read_exactly(f: IO[bytes], size: int, delta_path: Path) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise DeltaError(f'Delta [{delta_path}] is truncated, its backup did not end')
+    return data
+
+
+def restore_delta(delta_path: Path, out_fd: int, buffer_size: int = native.defaultBufferSize) -> None:
+    """ Writes the stream of a delta backup to out_fd, reading the delta and its base in one pass """
+    name = base_name(delta_path)
+    if name is None:
+        raise DeltaError(f'[{delta_path}] is not a delta backup')
+    base_path = delta_path.parent / name
+    checksum = hashlib.sha256()
+    size = 0
+    try:
+        base_fd = os.open(base_path, os.O_RDONLY)
+    except FileNotFoundError:
+        raise DeltaError(f'Base [{base_path}] of delta [{delta_path}] is missing') from None
+    try:
+        with open(delta_path, 'rb') as delta:
+            delta.readline()
+            delta.readline()
+            while True:
+                record_type = _read_exactly(delta, 1, delta_path)
+                if record_type == b'C':
+                    (_, offset, length) = copyRecord.unpack(record_type + _read_exactly(delta, copyRecord.size - 1,
+                                                                                          delta_path))
+                    while length != 0:
+                        data = os.pread(base_fd, min(length, buffer_size), offset)
+                        if len(data) == 0:
+                            raise DeltaError(f'Base [{base_path}] is shorter than expected by [{delta_path}]')
+                        checksum.update(data)
+                        native.write_all(out_fd, data)
+                        offset += len(data)
+                        length -= len(data)
+                        size += len(data)
+                elif record_type == b'L':
+                    (_, length) = literalRecord.unpack(record_type + _read_exactly(delta, literalRecord.size - 1,
+                                                                                     delta_path))
+                    while length != 0:
+                        data = _read_exactly(delta, min(length, buffer_size), delta_path)
+                        checksum.update(data)
+                        native.write_all(out_fd, data)
+                        length -= len(data)
+                        size += len(data)
+                elif record_type == b'E':
+                    (_, expected_size, expected_checksum) = endRecord.unpack(
+                        record_type + _read_exactly(delta, endRecord.size - 1, delta_path))
+                    break
+                else:
+                    raise DeltaError(f'Delta [{delta_path}] is corrupted')
+    finally:
+        os.close(base_fd)
+    if expected_size != size or expected_checksum != checksum.digest():
+        raise DeltaError(f'Restored data does not match delta [{delta_path}], its base may have been modified')
@@ -0,0 +1,218 @@
+import collections
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from bashckup.actuators import native
+
+"""
+Seekable gzip streams: the input is cut in frames of frame-size bytes, each one compressed alone in its own gzip member,
+as BGZF does. The extra field of the header of each frame gives the size of the member, so frames are split without
+decompressing them, and decompressed on several threads.
+The stream ends with a frame table, so a frame can be read without reading the stream from its start:
+- table members: empty gzip members whose extra field lists the compressed and uncompressed size of each frame
+- locator: empty gzip member of fixed size, last bytes of the stream, giving the offset of the table and the number of
+  frames
+gzip -d reads the whole stream as usual: it is a sequence of gzip members, and empty members write nothing.
+"""
+
+maximumFrameSize = 64 * 1024 * 1024
+gzipMagic = b'\x1f\x8b'
+gzipExtraFlag = 4
+memberHeader = struct.Struct('<2sBBIBBH')  # Magic, method, flags, mtime, extra flags, OS and length of the extra field
+subfieldHeader = struct.Struct('<2sH')  # Identifier and length of a subfield of the extra field
+frameSubfield = b'BK'
+frameSize = struct.Struct('<I')  # Size of the whole gzip member of the frame
+tableSubfield = b'BT'
+tableEntry = struct.Struct('<II')  # Compressed size and uncompressed size of a frame
+tableEntriesByMember = (0xffff - subfieldHeader.size) // tableEntry.size
+locatorSubfield = b'BL'
+locator = struct.Struct('<QQ')  # Offset of the table and number of frames
+emptyDeflate = b'\x03\x00'
+memberTrailer = struct.Struct('<II')  # CRC32 and size modulo 2^32 of the uncompressed data
+locatorSize = memberHeader.size + subfieldHeader.size + locator.size + len(emptyDeflate) + memberTrailer.size
+frameHeaderSize = memberHeader.size + subfieldHeader.size + frameSize.size
+
+
+class FramesError(Exception):
+    pass
+
+
+def _empty_member(subfield: bytes, data: bytes) -> bytes:
+    return memberHeader.pack(gzipMagic, zlib.DEFLATED, gzipExtraFlag, 0, 0, 255, subfieldHeader.size + len(data)) + \
+        subfieldHeader.pack(subfield, len(data)) + data + emptyDeflate + memberTrailer.pack(0, 0)
+
+
+class FrameWriter:
+    """ Compresses data written into out_fd in frames, the frame table is written by close """
+
+    def __init__(self, out_fd: int, level: int, frame_size: int):
+        self._out_fd = out_fd
+        self._level = level
+        self._frame_size = frame_size
+        self._compressor = None
+        self._pieces = []
+        self._crc = 0
+        self._current_size = 0
+        self.frames: List[Tuple[int, int]] = []  # Compressed and uncompressed size of each frame
+        self.size = 0
+        self.compressed_size = 0
+
+    def write(self, data: bytes or memoryview) -> None:
+        view = memoryview(data)
+        while len(view) != 0:
+            if self._compressor is None:  # Frame starts with its first byte, so there is no empty frame at the end
+                self._compressor = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            chunk = view[:self._frame_size - self._current_size]
+            self._pieces.append(self._compressor.compress(chunk))
+            self._crc = zlib.crc32(chunk, self._crc)
+            self._current_size += len(chunk)
+            view = view[len(chunk):]
+            if self._current_size == self._frame_size:
+                self._end_frame()
+
+    def _end_frame(self) -> None:
+        self._pieces.append(self._compressor.flush())
+        deflated = b''.join(self._pieces)
+        member_size = frameHeaderSize + len(deflated) + memberTrailer.size
+        self._write(memberHeader.pack(gzipMagic, zlib.DEFLATED, gzipExtraFlag, 0, 0, 255,
+                                      subfieldHeader.size + frameSize.size) +
+                    subfieldHeader.pack(frameSubfield, frameSize.size) + frameSize.pack(member_size))
+        self._write(deflated)
+        self._write(memberTrailer.pack(self._crc, self._current_size & 0xffffffff))
+        self.frames.append((member_size, self._current_size))
+        self.size += self._current_size
+        (self._compressor, self._pieces, self._crc, self._current_size) = (None, [], 0, 0)
+
+    def _write(self, data: bytes) -> None:
+        native.write_all(self._out_fd, data)
+        self.compressed_size += len(data)
+
+    def close(self) -> None:
+        if self._compressor is not None:
+            self._end_frame()
+        table_offset = self.compressed_size
+        for start in range(0, len(self.frames), tableEntriesByMember):
+            entries = self.frames[start:start + tableEntriesByMember]
+            self._write(_empty_member(tableSubfield, b''.join(tableEntry.pack(*entry) for entry in entries)))
+        self._write(_empty_member(locatorSubfield, locator.pack(table_offset, len(self.frames))))
+
+
+def compress(in_fd: int, out_fd: int, level: int, frame_size: int) -> dict:
+    """ :returns: Metrics of the compression """
+    writer = FrameWriter(out_fd, level, frame_size)
+    while True:
+        data = os.read(in_fd, native.defaultBufferSize)
+        if len(data) == 0:
+            break
+        writer.write(data)
+    writer.close()
+    return {'frames': len(writer.frames)}
+
+
+def _parse_member(data: bytes, subfield: bytes, offset: int = 0) -> bytes:
+    """ :returns: Data of the subfield of the empty member at offset, FramesError if there is no such member """
+    if len(data) - offset < memberHeader.size + subfieldHeader.size:
+        raise FramesError('Stream has no frame table')
+    (magic, _, flags, _, _, _, extra_size) = memberHeader.unpack_from(data, offset)
+    (identifier, size) = subfieldHeader.unpack_from(data, offset + memberHeader.size)
+    start = offset + memberHeader.size + subfieldHeader.size
+    if magic != gzipMagic or flags != gzipExtraFlag or identifier != subfield or \
+            extra_size != subfieldHeader.size + size or len(data) < start + size:
+        raise FramesError('Stream has no frame table')
+    return data[start:start + size]
+
+
+def read_table(fd: int) -> List[Tuple[int, int, int]]:
+    """ :returns: Uncompressed offset, compressed offset and compressed size of each frame of a seekable file """
+    file_size = os.fstat(fd).st_size
+    if file_size < locatorSize:
+        raise FramesError('Stream has no frame table')
+    (table_offset, frame_count) = locator.unpack(
+        _parse_member(os.pread(fd, locatorSize, file_size - locatorSize), locatorSubfield))
+    if table_offset > file_size - locatorSize:
+        raise FramesError('Frame table does not match the stream')
+    table = os.pread(fd, file_size - locatorSize - table_offset, table_offset)
+    frames = []
+    (uncompressed_offset, compressed_offset, position) = (0, 0, 0)
+    while position < len(table):
+        entries = _parse_member(table, tableSubfield, position)
+        position += memberHeader.size + subfieldHeader.size + len(entries) + len(emptyDeflate) + memberTrailer.size
+        for (compressed_size, size) in tableEntry.iter_unpack(entries):
+            frames.append((uncompressed_offset, compressed_offset, compressed_size))
+            uncompressed_offset += size
+            compressed_offset += compressed_size
+    if len(frames) != frame_count or compressed_offset != table_offset:
+        raise FramesError('Frame table does not match the stream')
+    return frames
+
+
+def read_frame(fd: int, frame: Tuple[int, int, int]) -> bytes:
+    """ :returns: Uncompressed data of a frame given by read_table """
+    (_, compressed_offset, compressed_size) = frame
+    return zlib.decompress(os.pread(fd, compressed_size, compressed_offset), 16 + zlib.MAX_WBITS)
+
+
+def _read_exactly(fd: int, size: int) -> bytes:
+    """ :returns: size bytes, fewer only at the end of the stream """
+    pieces = []
+    while size != 0:
+        data = os.read(fd, size)
+        if len(data) == 0:
+            break
+        pieces.append(data)
+        size -= len(data)
+    return b''.join(pieces)
+
+
+def _read_member(in_fd: int, header: bytes) -> (bytes or None, bytes):
+    """
+    :returns: Identifier of the subfield of the member starting by header, None if it is not a member of a seekable
+    stream, and data read: the whole member, or only its start when it is not a member of a seekable stream
+    """
+    if len(header) != memberHeader.size or header[:2] != gzipMagic or header[3] != gzipExtraFlag:
+        return None, header
+    extra = _read_exactly(in_fd, memberHeader.unpack(header)[6])
+    identifier = extra[:2]
+    if len(extra) < subfieldHeader.size or identifier not in [frameSubfield, tableSubfield, locatorSubfield]:
+        return None, header + extra
+    if identifier == frameSubfield:
+        rest_size = frameSize.unpack_from(extra, subfieldHeader.size)[0] - len(header) - len(extra)
+    else:  # Members of the frame table are empty
+        rest_size = len(emptyDeflate) + memberTrailer.size
+    rest = _read_exactly(in_fd, rest_size)
+    if len(rest) != rest_size:
+        raise FramesError('Stream ended in the middle of a frame')
+    return identifier, header + extra + rest
+
+
+def decompress(in_fd: int, out_fd: int, threads: int = 1) -> dict:
+    """
+    Decompresses in_fd into out_fd, frames are decompressed on several threads. Streams which are not seekable are
+    decompressed as gzip -d does.
+    :returns: Metrics of the decompression
+    """
+    (identifier, member) = _read_member(in_fd, _read_exactly(in_fd, memberHeader.size))
+    if identifier is None:
+        native.gzip_decompress(in_fd, out_fd, initial_data=member)
+        return {'frames': None}
+    frames = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        decompressing = collections.deque()  # Frames are decompressed ahead, on several threads
+        while True:
+            if identifier is None:
+                raise FramesError(f'Stream is corrupted after frame [{frames}]')
+            if identifier == frameSubfield:
+                decompressing.append(executor.submit(zlib.decompress, member, 16 + zlib.MAX_WBITS))
+                frames += 1
+            while len(decompressing) > threads * 2 or (len(decompressing) != 0 and decompressing[0].done()):
+                native.write_all(out_fd, decompressing.popleft().result())
+            header = _read_exactly(in_fd, memberHeader.size)
+            if len(header) == 0:
+                break
+            (identifier, member) = _read_member(in_fd, header)
+        while len(decompressing) != 0:
+            native.write_all(out_fd, decompressing.popleft().result())
+    return {'frames': frames}
@@ -0,0 +1,415 @@
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import queue
+import shutil
+import stat
+import struct
+import tarfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Iterator, Tuple, Callable, IO
+
+from bashckup.actuators import native
+
+"""
+Incremental backups of a tree of files without tar: an index of the tree (path, inode, size, mtime, ctime and content
+hash of each entry) is kept for each level, and a backup of level N only contains entries which changed since the index
+of the latest backup of a lower level, followed by the list of deleted entries.
+
+An index is a file of fixed-size records sorted by key, followed by the keys. The key of an entry is its path relative
+to the root with '\\0' as separator, so keys are sorted in the order of a depth-first walk with sorted names: the tree
+is compared with the index in a single pass, and the index is mapped in memory and searched without being loaded.
+"""
+
+indexMagic = b'BCKIDX01'
+indexHeader = struct.Struct('>8sIQQ20s20s')  # Magic, level, count, offset of keys, backup date time, reference
+indexRecord = struct.Struct('>QIIQQqq32s')  # Offset and size of the key, mode, inode, size, mtime, ctime, sha256
+noDigest = bytes(32)
+metadataPrefix = '.bashckup/'
+backupMember = metadataPrefix + 'backup.json'  # First member of archives: level and reference of the backup
+deletedMember = metadataPrefix + 'deleted'  # Last member of archives: NUL separated paths of deleted entries
+# Checks of paths are done before extraction, members are trusted as tar --same-owner --same-permissions does
+extractOptions = {'filter': 'fully_trusted'} if hasattr(tarfile, 'fully_trusted_filter') else {}
+
+IndexEntry = namedtuple('IndexEntry', ['key', 'mode', 'inode', 'size', 'mtime', 'ctime', 'digest'])
+
+
+class IncrementalError(Exception):
+    pass
+
+
+def key_of(relative_path: bytes) -> bytes:
+    return relative_path.replace(b'/', b'\0')
+
+
+def path_of(key: bytes) -> bytes:
+    return key.replace(b'\0', b'/')
+
+
+def _sorted_children(path: bytes, key: bytes) -> Iterator[Tuple[bytes, bytes, os.stat_result]]:
+    try:
+        with os.scandir(path) as it:
+            children = sorted((entry.name, entry.path) for entry in it)
+    except FileNotFoundError:  # Removed during the walk
+        return
+    for (name, child_path) in children:
+        try:
+            child_stat = os.lstat(child_path)
+        except FileNotFoundError:
+            continue
+        yield key + b'\0' + name if key != b'' else name, child_path, child_stat
+
+
+def walk_tree(root: bytes, threads: int = 1) -> Iterator[Tuple[bytes, os.stat_result]]:
+    """
+    :param threads: Number of threads listing directories ahead of the walk
+    :returns: Key and lstat of each entry under root (root excluded), in the order of keys. Symbolic links are not
+    followed, entries removed during the walk are skipped.
+    """
+    walker = _ParallelWalker(threads) if threads > 1 else None
+    try:
+        stack = [walker.children(root, b'') if walker else _sorted_children(root, b'')]
+        while len(stack) != 0:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            (key, path, child_stat) = child
+            yield key, child_stat
+            if stat.S_ISDIR(child_stat.st_mode):
+                stack.append(walker.children(path, key) if walker else _sorted_children(path, key))
+    finally:
+        if walker is not None:
+            walker.close()
+
+
+class _ParallelWalker:
+    """
+    Lists directories (scandir and lstat of their children) in threads, ahead of the walk which stays ordered.
+    Listing a directory queues its sub-directories: the queue is LIFO, so threads list the deepest directories first,
+    as the walk needs them. At most prefetchedDirectories listings per thread are waiting for the walk, other
+    directories are listed by the walk itself.
+    """
+    prefetchedDirectories = 64
+
+    def __init__(self, threads: int):
+        self._tasks = queue.LifoQueue()
+        self._listings = {}  # Path of a directory -> Future of its children
+        self._lock = threading.Lock()
+        self._max_listings = threads * self.prefetchedDirectories
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, name='bashckup-walk', daemon=True)
+                         for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self) -> None:
+        for (path, key, listing) in iter(self._tasks.get, None):
+            if not listing.set_running_or_notify_cancel():
+                continue
+            try:
+                listing.set_result(self._list(path, key))
+            except BaseException as e:
+                listing.set_exception(e)
+
+    def _list(self, path: bytes, key: bytes) -> list:
+        children = list(_sorted_children(path, key))
+        # Pushed in reverse order, so the first sub-directory is listed first
+        for (child_key, child_path, child_stat) in reversed(children):
+            if stat.S_ISDIR(child_stat.st_mode):
+                self._prefetch(child_path, child_key)
+        return children
+
+    def _prefetch(self, path: bytes, key: bytes) -> None:
+        with self._lock:
+            if self._closed or len(self._listings) >= self._max_listings:
+                return
+            listing = Future()
+            self._listings[path] = listing
+        self._tasks.put((path, key, listing))
+
+    def children(self, path: bytes, key: bytes) -> Iterator[Tuple[bytes, bytes, os.stat_result]]:
+        with self._lock:
+            listing = self._listings.pop(path, None)
+        return iter(listing.result() if listing is not None else self._list(path, key))
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for listing in self._listings.values():
+                listing.cancel()
+        for _ in self._threads:
+            self._tasks.put(None)
+
+
+class IndexWriter:
+    """ Writes an index, entries must be added in the order of keys """
+
+    def __init__(self, path: Path, level: int, backup_datetime: str, reference: str or None):
+        self._file = open(path, 'wb')
+        self._file.write(bytes(indexHeader.size))
+        self._keys = bytearray()
+        self._count = 0
+        self._level = level
+        self._backup_datetime = backup_datetime
+        self._reference = reference
+
+    def add(self, key: bytes, mode: int, inode: int, size: int, mtime: int, ctime: int, digest: bytes) -> None:
+        self._file.write(indexRecord.pack(len(self._keys), len(key), mode, inode, size, mtime, ctime, digest))
+        self._keys += key
+        self._count += 1
+
+    def close(self) -> None:
+        self._file.write(self._keys)
+        self._file.seek(0)
+        self._file.write(indexHeader.pack(indexMagic, self._level, self._count,
+                                          indexHeader.size + self._count * indexRecord.size,
+                                          self._backup_datetime.encode(), (self._reference or '').encode()))
+        self._file.close()
+
+
+class TreeIndex:
+    """ Index of a tree mapped in memory, see the description of the module """
+
+    def __init__(self, path: Path):
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                raise IncrementalError(f'[{path}] is not an index of incremental backups') from None
+        if len(self._map) < indexHeader.size:
+            raise IncrementalError(f'[{path}] is not an index of incremental backups')
+        (magic, self.level, self._count, self._keys_offset, backup_datetime, reference) = \
+            indexHeader.unpack_from(self._map)
+        if magic != indexMagic or self._keys_offset > len(self._map):
+            raise IncrementalError(f'[{path}] is not an index of incremental backups')
+        self.backup_datetime = backup_datetime.rstrip(b'\0').decode()
+        self.reference = reference.rstrip(b'\0').decode() or None
+
+    def __enter__(self) -> 'TreeIndex':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def entry(self, position: int) -> IndexEntry:
+        (key_offset, key_size, *fields) = indexRecord.unpack_from(self._map,
+                                                                  indexHeader.size + position * indexRecord.size)
+        start = self._keys_offset + key_offset
+        return IndexEntry(self._map[start:start + key_size], *fields)
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        return (self.entry(position) for position in range(self._count))
+
+    def find(self, key: bytes) -> IndexEntry or None:
+        """ Binary search, only the visited records are read """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self.entry(middle)
+            if entry.key < key:
+                low = middle + 1
+            elif entry.key > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+
+def _unchanged(entry: IndexEntry, entry_stat: os.stat_result) -> bool:
+    return (entry.mode, entry.inode, entry.size, entry.mtime, entry.ctime) == \
+        (entry_stat.st_mode, entry_stat.st_ino, entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ctime_ns)
+
+
+class _HashingReader:
+    """ Reads exactly size bytes of a file which can change while it is read, and computes their sha256 """
+
+    def __init__(self, f: IO[bytes], size: int):
+        self._f = f
+        self._remaining = size
+        self.checksum = hashlib.sha256()
+        self.changed = False
+
+    def read(self, size: int) -> bytes:
+        data = self._f.read(min(size, self._remaining))
+        if len(data) == 0 and self._remaining != 0:
+            # File has been truncated, it is padded as tar does
+            self.changed = True
+            data = bytes(min(size, self._remaining))
+        self.checksum.update(data)
+        self._remaining -= len(data)
+        return data
+
+
+def _add_to_archive(tar: tarfile.TarFile, root: bytes, key: bytes) -> Tuple[bytes, bool] or None:
+    """
+    :returns: sha256 of the content (noDigest if the entry is not a regular file) and False if the file changed while it
+    was read. None if the entry can not be archived (socket) or has been removed.
+    """
+    path = os.path.join(root, path_of(key))
+    try:
+        tar_info = tar.gettarinfo(os.fsdecode(path), os.fsdecode(path_of(key)))
+        if tar_info is None:
+            return None
+        if not tar_info.isreg():
+            tar.addfile(tar_info)
+            return noDigest, True
+        with open(path, 'rb') as f:
+            reader = _HashingReader(f, tar_info.size)
+            tar.addfile(tar_info, reader)
+            changed = reader.changed or len(f.read(1)) != 0
+    except FileNotFoundError:
+        return None
+    if changed:
+        logging.warning('WARNING: File [%s] changed as we read it', os.fsdecode(path))
+    return reader.checksum.digest(), not changed
+
+
+def backup_tree(root: Path, out_fd: int, index_path: Path, level: int, backup_datetime: str,
+                reference: TreeIndex or None, threads: int = 1) -> dict:
+    """
+    Writes a tar archive of entries which changed since the reference index (all entries without reference), and the
+    index of the tree to index_path
+    :param threads: Number of threads walking the tree, the archive is written by the calling thread
+    :returns: Metrics of the backup
+    """
+    metrics = {'scanned-files': 0, 'changed-files': 0, 'deleted-files': 0}
+    progress = _Progress()
+    root_path = os.fsencode(root)
+    previous_entries = iter(reference) if reference is not None else iter(())
+    previous = next(previous_entries, None)
+    deleted = []
+    index = IndexWriter(index_path, level, backup_datetime, reference.backup_datetime if reference else None)
+    with os.fdopen(out_fd, 'wb', closefd=False) as out, \
+            tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT, bufsize=native.defaultBufferSize) as tar:
+        backup = json.dumps({'level': level, 'datetime': backup_datetime,
+                             'reference': reference.backup_datetime if reference else None}).encode()
+        _add_bytes(tar, backupMember, backup)
+
+        for (key, entry_stat) in walk_tree(root_path, threads):
+            metrics['scanned-files'] += 1
+            progress.update(metrics['scanned-files'])
+            # Entries of the index before the current key are not in the tree anymore
+            while previous is not None and previous.key < key:
+                _add_deleted(deleted, previous.key)
+                previous = next(previous_entries, None)
+            if previous is not None and previous.key == key:
+                (entry, previous) = (previous, next(previous_entries, None))
+                if _unchanged(entry, entry_stat):
+                    index.add(key, *entry[1:])
+                    continue
+            archived = _add_to_archive(tar, root_path, key)
+            if archived is None:
+                continue
+            metrics['changed-files'] += 1
+            (digest, complete) = archived
+            # A file changed while it was read is saved again by the next backup
+            index.add(key, entry_stat.st_mode, entry_stat.st_ino, entry_stat.st_size,
+                      entry_stat.st_mtime_ns if complete else -1, entry_stat.st_ctime_ns, digest)
+        while previous is not None:
+            _add_deleted(deleted, previous.key)
+            previous = next(previous_entries, None)
+
+        metrics['deleted-files'] = len(deleted)
+        _add_bytes(tar, deletedMember, b'\0'.join(path_of(key) for key in deleted))
+    index.close()
+    metrics['scanned-files-per-second'] = progress.rate(metrics['scanned-files'])
+    return metrics
+
+
+class _Progress:
+    """ Logs the number of walked entries every progressInterval seconds """
+    progressInterval = 10
+
+    def __init__(self):
+        self._start = time.monotonic()
+        self._next_log = self._start + self.progressInterval
+
+    def rate(self, entries: int) -> float:
+        return round(entries / max(time.monotonic() - self._start, 1e-6), 1)
+
+    def update(self, entries: int) -> None:
+        if entries % 1024 != 0 or time.monotonic() < self._next_log:
+            return
+        self._next_log = time.monotonic() + self.progressInterval
+        logging.info('%d entries walked (%.1f entries/s)', entries, self.rate(entries))
+
+
+def _add_deleted(deleted: list, key: bytes) -> None:
+    # Children of a deleted directory are removed with it
+    if len(deleted) == 0 or not key.startswith(deleted[-1] + b'\0'):
+        deleted.append(key)
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, content: bytes) -> None:
+    tar_info = tarfile.TarInfo(name)
+    tar_info.size = len(content)
+    tar.addfile(tar_info, io.BytesIO(content))
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def restore_tree(in_fd: int, root: Path, full_backup_started: Callable[[], None]) -> None:
+    """
+    Applies an archive written by backup_tree on root: changed entries are extracted and deleted entries are removed
+    :param full_backup_started: Called before extracting an archive which contains all entries (level 0)
+    """
+    root = Path(os.path.abspath(root))
+    deleted = []
+
+    def members(tar: tarfile.TarFile) -> Iterator[tarfile.TarInfo]:
+        # Iterating the archive would start again from its first member, which can not be read twice from a stream
+        for member in iter(tar.next, None):
+            if member.name == deletedMember:
+                content = tar.extractfile(member).read()
+                deleted.extend(content.split(b'\0') if len(content) != 0 else [])
+                continue
+            target = os.path.abspath(os.path.join(root, member.name))
+            if not target.startswith(str(root) + os.sep):
+                raise IncrementalError(f'Member [{member.name}] is outside of [{root}]')
+            # An entry can replace an entry of another type (e.g. a directory replaced by a file)
+            if os.path.lexists(target) and (not member.isdir() or not os.path.isdir(target) or
+                                            os.path.islink(target)):
+                _remove(target)
+            yield member
+
+    with os.fdopen(in_fd, 'rb', closefd=False) as stream, \
+            tarfile.open(fileobj=stream, mode='r|', bufsize=native.defaultBufferSize) as tar:
+        first = tar.next()
+        if first is None or first.name != backupMember:
+            raise IncrementalError('Stream is not an archive of incremental backups')
+        backup = json.loads(tar.extractfile(first).read())
+        if backup['reference'] is None:
+            full_backup_started()
+        tar.extractall(str(root), members=members(tar), numeric_owner=True, **extractOptions)
+    # All paths are checked before removing any, a parent can be a link extracted by this archive
+    encoded_root = os.fsencode(root)
+    real_root = os.path.realpath(encoded_root)
+    targets = []
+    for path in deleted:
+        target = os.path.abspath(os.path.join(encoded_root, path))
+        parent = os.path.realpath(os.path.dirname(target))
+        if not target.startswith(encoded_root + os.fsencode(os.sep)) or \
+                (parent != real_root and not parent.startswith(real_root + os.fsencode(os.sep))):
+            raise IncrementalError(f'Deleted entry [{os.fsdecode(path)}] is outside of [{root}]')
+        targets.append(target)
+    for target in targets:
+        _remove(target)
@@ -0,0 +1,444 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Iterator, Dict, IO, Callable
+
+from bashckup.actuators import native
+
+"""
+Dump and load of a MariaDB database on several connections at the same time, as mydumper does.
+Connections share the same snapshot: they start their transaction while a global read lock is held.
+Schema and data of each table are dumped in their own gzip chunks, big tables are split by ranges of their primary
+key. Chunks are sent in a tar stream followed by a manifest.
+"""
+
+manifestName = 'manifest.json'
+manifestFormat = 2
+schemaDirectory = 'schema/'
+chunkChecksumHeader = 'BASHCKUP.sha256'  # PAX header of each chunk, so it can be verified before the manifest is read
+insertStatementSize = 1024 * 1024  # Like mysqldump --net-buffer-length, lower than max_allowed_packet
+defaultCompressionLevel = 6
+integerTypes = [b'tinyint', b'smallint', b'mediumint', b'int', b'bigint']
+batchEscapeRegex = re.compile(rb'\\(.)', re.DOTALL)
+batchEscapes = {b'n': b'\n', b't': b'\t', b'0': b'\0', b'\\': b'\\'}
+chunkHeader = (b'SET NAMES utf8mb4;\n'
+               b"SET TIME_ZONE='+00:00';\n"
+               b'SET FOREIGN_KEY_CHECKS=0;\n'
+               b'SET UNIQUE_CHECKS=0;\n'
+               b"SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n")
+
+
+class MariaDBError(Exception):
+    pass
+
+
+def unescape_field(field: bytes) -> bytes:
+    """ Reverts escaping of special characters done by mysql in batch mode (newline, tab, NUL and backslash) """
+    return batchEscapeRegex.sub(lambda m: batchEscapes.get(m.group(1), m.group(0)), field)
+
+
+def quote_identifier(identifier: bytes) -> bytes:
+    return b'`' + identifier.replace(b'`', b'``') + b'`'
+
+
+def insert_statements(table: bytes, columns: List[bytes], values: Iterator[bytes],
+                      statement_size: int = insertStatementSize) -> Iterator[bytes]:
+    """
+    Groups values of rows (e.g.: "(1,'a')") in extended INSERT statements of about statement_size bytes
+    """
+    prefix = (b'INSERT INTO ' + quote_identifier(table) + b' (' + b','.join(quote_identifier(c) for c in columns) +
+              b') VALUES ')
+    batch = []
+    size = 0
+    for value in values:
+        batch.append(value)
+        size += len(value) + 1
+        if size >= statement_size:
+            yield prefix + b','.join(batch) + b';\n'
+            batch = []
+            size = 0
+    if len(batch) != 0:
+        yield prefix + b','.join(batch) + b';\n'
+
+
+class MariaDBSession:
+    """
+    A mysql client connected to the database: queries are written to its input and results read from its output.
+    A marker is selected after each query to know where its result ends.
+    """
+
+    def __init__(self, database: str):
+        self._marker = f'bashckup-{uuid.uuid4().hex}'.encode()
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(['mysql', '--batch', '--skip-column-names', '--unbuffered',
+                                          '--default-character-set=utf8mb4', database], shell=False,
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._stderr)
+
+    def rows(self, query: bytes) -> Iterator[List[bytes]]:
+        """ Runs a query and yields fields of each row of its result """
+        try:
+            self._process.stdin.write(query + b";\nSELECT '" + self._marker + b"';\n")
+            self._process.stdin.flush()
+        except BrokenPipeError:  # mysql already exited, e.g. it could not connect
+            raise MariaDBError(f'Connection to MariaDB ended unexpectedly: {self._error_output()}') from None
+        while True:
+            line = self._process.stdout.readline()
+            if line == b'':
+                # mysql stops at the first error when its input is not a terminal
+                raise MariaDBError(f'Connection to MariaDB ended unexpectedly: {self._error_output()}')
+            line = line[:-1]
+            if line == self._marker:
+                return
+            yield [unescape_field(field) for field in line.split(b'\t')]
+
+    def execute(self, query: bytes) -> None:
+        for _ in self.rows(query):
+            pass
+
+    def _error_output(self) -> str:
+        self._process.wait()
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace').strip()
+
+    def close(self) -> None:
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._process.stdout.close()
+        if self._process.wait() != 0:
+            raise MariaDBError(f'mysql exited with code {self._process.returncode}: {self._error_output()}')
+        self._stderr.close()
+
+    def kill(self) -> None:
+        """ Ends the connection without waiting for the running query """
+        self._process.kill()
+        self._process.wait()
+        self._stderr.close()
+
+
+class _ChunkFile:
+    """ Compressed chunk written on disk, with the checksum of its compressed content """
+
+    def __init__(self, path: str, level: int):
+        self.path = path
+        self.size = 0
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._checksum = hashlib.sha256()
+
+    def _write_compressed(self, data: bytes) -> None:
+        self._checksum.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def write(self, data: bytes) -> None:
+        self._write_compressed(self._compressor.compress(data))
+
+    def close(self) -> str:
+        """ :returns: Checksum of the chunk """
+        self._write_compressed(self._compressor.flush())
+        self._file.close()
+        return self._checksum.hexdigest()
+
+
+class Table:
+    """ A table to dump, with statistics of information_schema used to split it """
+
+    def __init__(self, name: bytes, size: int, rows: int):
+        self.name = name
+        self.size = size  # Estimated, in bytes
+        self.rows = rows  # Estimated
+        self.columns: List[bytes] = []  # Generated columns are excluded, they cannot be inserted
+        self.primary_key: List[bytes] = []
+        self.integer_key = False
+
+
+def _statistic(field: bytes) -> int:
+    return 0 if field == b'NULL' else int(field)
+
+
+def _list_tables(session: MariaDBSession) -> Dict[bytes, Table]:
+    """ :returns: Tables of the database, biggest tables first """
+    tables = {row[0]: Table(row[0], _statistic(row[1]), _statistic(row[2])) for row in session.rows(
+        b"SELECT TABLE_NAME, DATA_LENGTH, TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+        b"AND TABLE_TYPE = 'BASE TABLE' ORDER BY DATA_LENGTH + INDEX_LENGTH DESC, TABLE_NAME")}
+    for (table, column, key, data_type, generated) in session.rows(
+            b"SELECT TABLE_NAME, COLUMN_NAME, COLUMN_KEY, DATA_TYPE, IS_GENERATED FROM information_schema.COLUMNS "
+            b"WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, ORDINAL_POSITION"):
+        if table not in tables:
+            continue  # View
+        if generated == b'NEVER':
+            tables[table].columns.append(column)
+        if key == b'PRI':
+            tables[table].primary_key.append(column)
+            tables[table].integer_key = data_type in integerTypes
+    return tables
+
+
+def key_ranges(minimum: int, maximum: int, count: int) -> List[List[int or None]]:
+    """
+    Splits [minimum, maximum] in count ranges [start, end[ of the same length, the last one has no end
+    """
+    step = max(1, -(-(maximum - minimum + 1) // count))
+    starts = range(minimum, maximum + 1, step)
+    return [[start, start + step if start + step <= maximum else None] for start in starts]
+
+
+def _split_table(session: MariaDBSession, table: Table, chunk_size: int or None,
+                 chunk_rows: int or None) -> List[List[int or None]] or None:
+    """
+    Ranges of primary key of each data chunk of the table, sized with estimated statistics of the table.
+    :returns: None when the table is dumped in a single chunk (small table, or primary key that is not one integer)
+    """
+    if len(table.primary_key) != 1 or not table.integer_key:
+        return None
+    count = max(-(-table.size // chunk_size) if chunk_size is not None else 1,
+                -(-table.rows // chunk_rows) if chunk_rows is not None else 1)
+    if count <= 1:
+        return None
+    key = quote_identifier(table.primary_key[0])
+    (minimum, maximum) = list(session.rows(b'SELECT MIN(' + key + b'), MAX(' + key + b') FROM ' +
+                                           quote_identifier(table.name)))[0]
+    if minimum == b'NULL':
+        return None  # Empty table
+    return key_ranges(int(minimum), int(maximum), count)
+
+
+def _dump_schema(session: MariaDBSession, table: Table, path: str, level: int) -> dict:
+    chunk = _ChunkFile(path, level)
+    try:
+        chunk.write(chunkHeader)
+        create_statement = list(session.rows(b'SHOW CREATE TABLE ' + quote_identifier(table.name)))[0][1]
+        chunk.write(b'DROP TABLE IF EXISTS ' + quote_identifier(table.name) + b';\n' + create_statement + b';\n')
+    finally:
+        checksum = chunk.close()
+    return {'kind': 'schema', 'table': table.name.decode(), 'size': chunk.size, 'sha256': checksum}
+
+
+def _dump_data(session: MariaDBSession, table: Table, key_range: List[int or None] or None, path: str,
+               level: int) -> dict:
+    query = (b"SELECT CONCAT('(', CONCAT_WS(',', " +
+             b','.join(b'QUOTE(' + quote_identifier(c) + b')' for c in table.columns) + b"), ')') FROM " +
+             quote_identifier(table.name))
+    if key_range is not None:
+        key = quote_identifier(table.primary_key[0])
+        query += b' WHERE ' + key + b' >= ' + str(key_range[0]).encode()
+        if key_range[1] is not None:
+            query += b' AND ' + key + b' < ' + str(key_range[1]).encode()
+    rows = 0
+
+    def values() -> Iterator[bytes]:
+        nonlocal rows
+        for row in session.rows(query):
+            rows += 1
+            yield row[0]
+
+    chunk = _ChunkFile(path, level)
+    try:
+        chunk.write(chunkHeader)
+        for statement in insert_statements(table.name, table.columns, values()):
+            chunk.write(statement)
+    finally:
+        checksum = chunk.close()
+    return {'kind': 'data', 'table': table.name.decode(), 'range': key_range, 'rows': rows, 'size': chunk.size,
+            'sha256': checksum}
+
+
+def _add_to_archive(archive: tarfile.TarFile, name: str, file: IO[bytes], size: int, checksum: str = None) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o600
+    if checksum is not None:
+        info.pax_headers = {chunkChecksumHeader: checksum}
+    archive.addfile(info, file)
+
+
+def _archive_chunks(executor: ThreadPoolExecutor, dumps: Dict[str, Callable[[str], dict]], directory: str,
+                    archive: tarfile.TarFile, manifest: dict) -> None:
+    """
+    Runs dumps of chunks and adds each chunk to the archive as soon as it is dumped
+    :param dumps: Function dumping each chunk in the given path, by name of chunk
+    """
+    futures: Dict[Future, str] = {}
+    completed = queue.Queue()
+    try:
+        for (name, dump) in dumps.items():
+            future = executor.submit(dump, os.path.join(directory, name.replace('/', '-')))
+            futures[future] = name
+            future.add_done_callback(completed.put)
+        for _ in range(len(futures)):
+            future = completed.get()
+            chunk = future.result()
+            path = os.path.join(directory, futures[future].replace('/', '-'))
+            with open(path, 'rb') as f:
+                _add_to_archive(archive, futures[future], f, chunk['size'], chunk['sha256'])
+            os.remove(path)
+            manifest['chunks'].append(dict(chunk, name=futures[future]))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def dump_database(database: str, connections: int, out_fd: int, level: int = defaultCompressionLevel,
+                  chunk_size: int = None, chunk_rows: int = None) -> None:
+    """
+    Dumps tables of the database on several connections sharing the same snapshot, and writes them in a tar stream
+    to out_fd. Chunks are sent as soon as they are dumped, so only chunks being dumped are kept in temporary files.
+    Schemas of all tables are sent first, so they can be loaded before data.
+    :param chunk_size: Bytes of a data chunk, bigger tables are split by ranges of their primary key
+    :param chunk_rows: Rows of a data chunk, bigger tables are split by ranges of their primary key
+    """
+    lock_session = MariaDBSession(database)
+    sessions: List[MariaDBSession] = []
+    try:
+        # Connections have to start their transaction while writes are blocked, to see the same snapshot
+        lock_session.execute(b'FLUSH TABLES WITH READ LOCK')
+        tables = _list_tables(lock_session)
+        for _ in range(max(1, connections)):
+            session = MariaDBSession(database)
+            sessions.append(session)
+            session.execute(b"SET SESSION TIME_ZONE = '+00:00'")
+            session.execute(b'SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            session.execute(b'START TRANSACTION WITH CONSISTENT SNAPSHOT')
+        lock_session.execute(b'UNLOCK TABLES')
+        lock_session.close()
+        # Bounds of primary keys are read in the snapshot
+        ranges = {table.name: _split_table(sessions[0], table, chunk_size, chunk_rows) for table in tables.values()}
+    except BaseException:
+        for session in [lock_session] + sessions:
+            session.kill()
+        raise
+
+    idle_sessions = queue.Queue()
+    for session in sessions:
+        idle_sessions.put(session)
+
+    def on_session(dump: Callable[..., dict], *args) -> Callable[[str], dict]:
+        def run(path: str) -> dict:
+            session = idle_sessions.get()
+            try:
+                return dump(session, *args, path, level)
+            finally:
+                idle_sessions.put(session)
+        return run
+
+    schema_dumps = {}
+    data_dumps = {}
+    for (index, table) in enumerate(tables.values()):
+        schema_dumps[f'{schemaDirectory}{index:05d}.sql.gz'] = on_session(_dump_schema, table)
+        for (part, key_range) in enumerate(ranges[table.name] or [None]):
+            data_dumps[f'data/{index:05d}-{part:05d}.sql.gz'] = on_session(_dump_data, table, key_range)
+
+    manifest = {'format': manifestFormat, 'database': database, 'chunks': []}
+    with tempfile.TemporaryDirectory(prefix='bashckup-mariadb-') as directory, \
+            os.fdopen(out_fd, 'wb', closefd=False) as output, \
+            tarfile.open(fileobj=output, mode='w|', format=tarfile.PAX_FORMAT) as archive, \
+            ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix='bashckup-mariadb') as executor:
+        try:
+            _archive_chunks(executor, schema_dumps, directory, archive, manifest)
+            _archive_chunks(executor, data_dumps, directory, archive, manifest)
+        except BaseException:
+            for session in sessions:
+                session.kill()  # Interrupts dumps in progress
+            raise
+        for session in sessions:
+            session.execute(b'COMMIT')
+            session.close()
+        content = json.dumps(manifest, indent=2).encode()
+        _add_to_archive(archive, manifestName, io.BytesIO(content), len(content))
+
+
+def _load_chunk(database: str, path: str) -> None:
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(['mysql', '--default-character-set=utf8mb4', database], shell=False,
+                                   stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+        try:
+            with open(path, 'rb') as f:
+                native.gzip_decompress(f.fileno(), process.stdin.fileno())
+        except BrokenPipeError:
+            pass  # mysql stopped on an error, it is reported below
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            os.remove(path)
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise MariaDBError(f'Unable to load chunk [{os.path.basename(path)}]: '
+                               f'{stderr.read().decode(errors="replace").strip()}')
+
+
+def load_database(database: str, connections: int, in_fd: int) -> None:
+    """
+    Loads a stream written by dump_database, chunks are loaded on several connections as soon as they are received.
+    Each chunk is verified with its checksum before being loaded, and data chunks are loaded once all schemas are.
+    """
+    # Limits chunks waiting on disk when loading is slower than reading
+    slots = threading.BoundedSemaphore(connections * 2)
+    futures: List[Future] = []
+    schema_futures: List[Future] = []
+    received: Dict[str, str] = {}
+    manifest = None
+    with tempfile.TemporaryDirectory(prefix='bashckup-mariadb-') as directory, \
+            os.fdopen(in_fd, 'rb', closefd=False) as stream, \
+            tarfile.open(fileobj=stream, mode='r|') as archive, \
+            ThreadPoolExecutor(max_workers=connections, thread_name_prefix='bashckup-mariadb') as executor:
+        try:
+            for member in archive:
+                if member.name == manifestName:
+                    manifest = json.load(archive.extractfile(member))
+                    continue
+                for future in [f for f in futures if f.done()]:
+                    future.result()  # Stops at the first error
+                slots.acquire()
+                path = os.path.join(directory, f'{len(received):05d}.sql.gz')
+                checksum = hashlib.sha256()
+                with open(path, 'wb') as f:
+                    content = archive.extractfile(member)
+                    while True:
+                        data = content.read(native.defaultBufferSize)
+                        if len(data) == 0:
+                            break
+                        checksum.update(data)
+                        f.write(data)
+                if checksum.hexdigest() != member.pax_headers.get(chunkChecksumHeader):
+                    os.remove(path)
+                    slots.release()
+                    raise MariaDBError(f'Chunk [{member.name}] is corrupted: checksum does not match')
+                received[member.name] = checksum.hexdigest()
+                is_schema = member.name.startswith(schemaDirectory)
+                if not is_schema:
+                    for future in schema_futures:
+                        future.result()  # Tables have to be created before their data is loaded
+                    schema_futures = []
+                future = executor.submit(_load_chunk, database, path)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+                if is_schema:
+                    schema_futures.append(future)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        for future in futures:
+            future.result()
+    if manifest is None:
+        raise MariaDBError('Manifest is missing, the backup is truncated')
+    missing = [chunk['name'] for chunk in manifest['chunks'] if received.get(chunk['name']) != chunk['sha256']]
+    if len(missing) != 0:
+        raise MariaDBError(f'''Chunks are missing: {', '.join(missing)}''')
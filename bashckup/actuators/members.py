@@ -0,0 +1,153 @@
+import bisect
+import gzip
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import zlib
+from pathlib import Path
+from typing import List, Tuple
+
+from bashckup.actuators import native, frames
+
+"""
+Compression by blocks of a tar stream, with an index of its members, so some members can be restored without reading
+the whole backup.
+
+Each block of block-size bytes of the stream is compressed in its own frame (see frames): the output is still a gzip
+stream, but each block can be decompressed alone, thanks to the frame table at the end of the stream. The index is a
+sidecar file of the output file (gzip compressed JSON):
+- compressed-size: size of the output file, used to check the index describes the file (e.g. not encrypted after)
+- members: name, start (first header) and end (end of data) of each member of the tar stream, None when the stream is
+  not a tar stream
+"""
+
+indexSuffix = '.members'
+indexVersion = 2
+defaultBlockSize = 1024 * 1024
+minimumBlockSize = 64 * 1024
+maximumBlockSize = frames.maximumFrameSize
+endOfArchive = bytes(2 * tarfile.BLOCKSIZE)
+
+
+class MembersError(Exception):
+    pass
+
+
+class _BlockCompressor:
+    """ Reads the input stream for tarfile, and compresses what it reads by blocks """
+
+    def __init__(self, in_fd: int, out_fd: int, level: int, block_size: int):
+        self._in_fd = in_fd
+        self.writer = frames.FrameWriter(out_fd, level, block_size)
+
+    def read(self, size: int) -> bytes:
+        data = os.read(self._in_fd, size)
+        self.writer.write(data)
+        return data
+
+    def drain(self) -> None:
+        while len(self.read(native.defaultBufferSize)) != 0:
+            pass
+
+
+def _index_members(source: _BlockCompressor) -> List[Tuple[str, int, int]] or None:
+    """ :returns: Name, start and end of each member, None if the stream is not a tar stream """
+    members = []
+    try:
+        with tarfile.open(fileobj=source, mode='r|', bufsize=native.defaultBufferSize) as tar:
+            for member in iter(tar.next, None):
+                if len(members) != 0:
+                    members[-1][2] = member.offset
+                members.append([member.name, member.offset,
+                                member.offset_data + -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE])
+                tar.members.clear()  # Members are not kept by tarfile, their number is not bounded
+    except tarfile.TarError as e:
+        logging.warning('WARNING: Stream is not a tar stream, members are not indexed: %s', e)
+        return None
+    return members
+
+
+def compress_blocks(in_fd: int, out_fd: int, level: int, block_size: int, index_path: Path or None) -> dict:
+    """
+    Compresses in_fd into out_fd by blocks, and writes the index of the members of the tar stream
+    :returns: Metrics of the compression
+    """
+    source = _BlockCompressor(in_fd, out_fd, level, block_size)
+    members = _index_members(source) if index_path is not None else None
+    source.drain()
+    source.writer.close()
+    if index_path is not None:
+        index = {'version': indexVersion, 'block-size': block_size, 'size': source.writer.size,
+                 'compressed-size': source.writer.compressed_size, 'members': members}
+        index_path = Path(index_path)
+        # Runs writing the same index have their own temporary file, as write_atomically
+        (fd, tmp_file) = tempfile.mkstemp(dir=index_path.parent, prefix=index_path.name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', compresslevel=1) as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(tmp_file, index_path)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+    return {'blocks': len(source.writer.frames), 'indexed-members': len(members) if members is not None else None}
+
+
+def read_index(index_path: Path) -> dict:
+    try:
+        with gzip.open(index_path, 'rt') as f:
+            index = json.load(f)
+    except (OSError, ValueError) as e:
+        raise MembersError(f'Index [{index_path}] is unreadable: {e}') from e
+    if not isinstance(index, dict) or index.get('version') != indexVersion:
+        raise MembersError(f'Index [{index_path}] has an unknown format')
+    return index
+
+
+def member_ranges(index: dict, names: List[str]) -> List[Tuple[int, int]]:
+    """ :returns: Ranges of the stream of members named names, or under directories named names, in stream order """
+    prefixes = tuple(name.rstrip('/') + '/' for name in names)
+    ranges = []
+    for (name, start, end) in index['members']:
+        if name in names or name.startswith(prefixes):
+            if len(ranges) != 0 and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+    return ranges
+
+
+def extract_members(file_path: Path, index: dict, names: List[str], out_fd: int, level: int = 1) -> dict:
+    """
+    Writes into out_fd a gzip stream of a tar stream containing only members named names: only blocks of these members
+    are read and decompressed
+    :returns: Metrics of the extraction
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    read_blocks = 0
+    (block, data) = (None, b'')
+    file_descriptor = os.open(file_path, os.O_RDONLY)
+    try:
+        try:
+            blocks = frames.read_table(file_descriptor)
+        except frames.FramesError as e:
+            raise MembersError(f'[{file_path}]: {e}') from e
+        block_starts = [start for (start, _, _) in blocks]
+        for (start, end) in member_ranges(index, names):
+            position = start
+            while position < end:
+                current = bisect.bisect_right(block_starts, position) - 1
+                if current != block:
+                    (block, data) = (current, frames.read_frame(file_descriptor, blocks[current]))
+                    read_blocks += 1
+                piece = data[position - block_starts[block]:end - block_starts[block]]
+                if len(piece) == 0:
+                    raise MembersError(f'Index does not match [{file_path}]')
+                native.write_all(out_fd, compressor.compress(piece))
+                position += len(piece)
+    finally:
+        os.close(file_descriptor)
+    native.write_all(out_fd, compressor.compress(endOfArchive) + compressor.flush())
+    return {'read-blocks': read_blocks, 'blocks': len(blocks)}
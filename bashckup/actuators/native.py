@@ -0,0 +1,247 @@
+import errno
+import fcntl
+import io
+import os
+import stat
+import select
+import subprocess
+import threading
+import time
+import zlib
+from typing import Callable, IO, AnyStr
+
+defaultBufferSize = 1024 * 1024  # 1 MiB
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)  # Constant available in fcntl since python 3.10
+
+
+class NativeProcess:
+    """
+    Runs a stage of a backup plan in a thread of bashckup instead of a command.
+    It exposes the subset of subprocess.Popen interface used to chain processes (args, stdin, stdout, stderr,
+    returncode, wait), so native stages and commands can be mixed freely.
+    Like Popen, file descriptors given as stdin and stdout are duplicated, so the caller can close its own copy.
+    """
+
+    def __init__(self, args: [str], target: Callable[[int or None, int or None], None],
+                 stdin: IO[AnyStr] or int = None, stdout: IO[AnyStr] or int = None):
+        """
+        :param target: Function called with input and output file descriptors, that raises an exception on failure
+        """
+        self.args = args
+        self.pid = None
+        self.returncode = None
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+        self.result = None  # Value returned by target
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.cpu_time = None  # CPU time used by the thread, in seconds
+        self._target = target
+        self._stdin_fd = self._input_fd(stdin)
+        self._stdout_fd = self._output_fd(stdout)
+        self._thread = threading.Thread(target=self._run, name=f'''bashckup-{args[0]}''', daemon=True)
+        self._thread.start()
+
+    def _input_fd(self, stdin) -> int or None:
+        if stdin is None:
+            return None
+        if stdin == subprocess.PIPE:
+            read_fd, write_fd = os.pipe()
+            self.stdin = open(write_fd, 'wb')
+            return read_fd
+        if stdin == subprocess.DEVNULL:
+            return os.open(os.devnull, os.O_RDONLY)
+        return os.dup(stdin if isinstance(stdin, int) else stdin.fileno())
+
+    def _output_fd(self, stdout) -> int or None:
+        if stdout is None:
+            return os.dup(1)
+        if stdout == subprocess.PIPE:
+            read_fd, write_fd = os.pipe()
+            self.stdout = open(read_fd, 'rb')
+            return write_fd
+        if stdout == subprocess.DEVNULL:
+            return os.open(os.devnull, os.O_WRONLY)
+        return os.dup(stdout if isinstance(stdout, int) else stdout.fileno())
+
+    def _run(self) -> None:
+        error = b''
+        try:
+            self.result = self._target(self._stdin_fd, self._stdout_fd)
+            self.returncode = 0
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'.encode()
+            self.returncode = 1
+        finally:
+            # Closing output sends EOF to the next stage, closing input allows previous stage to receive a SIGPIPE
+            for fd in [self._stdin_fd, self._stdout_fd]:
+                if fd is not None:
+                    os.close(fd)
+            self.stderr = io.BytesIO(error)
+            self.cpu_time = time.thread_time()
+            self.end_time = time.monotonic()
+
+    def poll(self) -> int or None:
+        return self.returncode
+
+    def wait(self, timeout: float = None) -> int:
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+
+def write_all(fd: int, data: bytes or memoryview) -> None:
+    view = memoryview(data)
+    while len(view) != 0:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def copy_stream(in_fd: int, out_fd: int, buffer_size: int = defaultBufferSize) -> int:
+    """
+    Copies in_fd into out_fd until EOF, reusing the same buffer for each read
+    :returns: Number of bytes copied
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        size = os.readv(in_fd, [buffer])
+        if size == 0:
+            return total
+        write_all(out_fd, view[:size])
+        total += size
+
+
+def enlarge_pipe(fd: int, size: int = defaultBufferSize) -> None:
+    """ Increases capacity of a pipe (64 KiB by default) to move bigger blocks, fd is left unchanged on failure """
+    try:
+        if stat.S_ISFIFO(os.fstat(fd).st_mode):
+            fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+    except OSError:
+        pass  # Not supported by the system or size greater than /proc/sys/fs/pipe-max-size
+
+
+def transfer_stream(in_fd: int, out_fd: int, buffer_size: int = defaultBufferSize) -> int:
+    """
+    Moves in_fd into out_fd until EOF, without copying data in user space when the system allows it:
+    splice when one of them is a pipe, then sendfile when in_fd is a regular file, otherwise copy_stream
+    :returns: Number of bytes moved
+    """
+    total = 0
+    if hasattr(os, 'splice'):  # Linux, python >= 3.10
+        try:
+            while True:
+                size = os.splice(in_fd, out_fd, buffer_size)
+                if size == 0:
+                    return total
+                total += size
+        except OSError as e:
+            # Unsupported by file descriptors, nothing has been moved yet so another method can be used
+            if e.errno not in (errno.EINVAL, errno.ENOSYS) or total != 0:
+                raise
+    if stat.S_ISREG(os.fstat(in_fd).st_mode):
+        try:
+            while True:
+                size = os.sendfile(out_fd, in_fd, None, buffer_size)
+                if size == 0:
+                    return total
+                total += size
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS) or total != 0:
+                raise
+    return total + copy_stream(in_fd, out_fd, buffer_size)
+
+
+class StreamMeter:
+    """ Counters of meter_stream """
+
+    def __init__(self):
+        self.bytes = 0
+        self.blocked_reading = 0.0  # Seconds waiting for data from the upstream stage
+        self.blocked_writing = 0.0  # Seconds waiting for the downstream stage to accept data
+
+
+def meter_stream(in_fd: int, out_fd: int, meter: StreamMeter, buffer_size: int = defaultBufferSize) -> None:
+    """
+    Moves in_fd into out_fd until EOF (zero copy with splice when available), measuring the amount of data and how
+    long each side made the other wait. It is interposed between 2 stages to find which one is the bottleneck.
+    """
+    poller_in = select.poll()
+    poller_in.register(in_fd, select.POLLIN)
+    poller_out = select.poll()
+    poller_out.register(out_fd, select.POLLOUT)
+    use_splice = hasattr(os, 'splice')
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        started = time.monotonic()
+        poller_in.poll()
+        meter.blocked_reading += time.monotonic() - started
+        if use_splice:
+            started = time.monotonic()
+            poller_out.poll()
+            meter.blocked_writing += time.monotonic() - started
+            try:
+                # Non-blocking, so that time is spent only in polls where it is measured
+                size = os.splice(in_fd, out_fd, buffer_size, flags=os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS) or meter.bytes != 0:
+                    raise
+                use_splice = False
+                continue
+            if size == 0:
+                return
+        else:
+            size = os.readv(in_fd, [buffer])
+            if size == 0:
+                return
+            remaining = view[:size]
+            while len(remaining) != 0:
+                started = time.monotonic()
+                poller_out.poll()
+                meter.blocked_writing += time.monotonic() - started
+                remaining = remaining[os.write(out_fd, remaining):]
+        meter.bytes += size
+
+
+def gzip_compress(in_fd: int, out_fd: int, level: int, buffer_size: int = defaultBufferSize) -> None:
+    """ Compresses in_fd into out_fd with gzip format. zlib releases the GIL, so it does not block other stages """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    while True:
+        data = os.read(in_fd, buffer_size)
+        if len(data) == 0:
+            break
+        write_all(out_fd, compressor.compress(data))
+    write_all(out_fd, compressor.flush())
+
+
+def gzip_decompress(in_fd: int, out_fd: int, buffer_size: int = defaultBufferSize, initial_data: bytes = b'') -> None:
+    """
+    Decompresses in_fd into out_fd, concatenated gzip members are supported (as gzip -d)
+    :param initial_data: Start of the stream, already read from in_fd
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    member_started = False
+    data = initial_data
+    while True:
+        if len(data) == 0:
+            data = os.read(in_fd, buffer_size)
+        if len(data) == 0:
+            break
+        while len(data) != 0:
+            member_started = True
+            write_all(out_fd, decompressor.decompress(data))
+            if not decompressor.eof:
+                break
+            # End of the current gzip member, remaining data belongs to the next one
+            member_started = False
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = b''  # Given to the decompressor
+    if member_started:
+        raise EOFError('Compressed stream ended before the end-of-stream marker was reached')
@@ -1,37 +1,96 @@
 import logging
 import os
+import re
+import shlex
 import subprocess
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Tuple
 
 from jsonschema.validators import validate
 
-from bashckup.actuators import writers
+from bashckup.actuators import catalog, ssh, sync
 from bashckup.actuators.actuators import PythonActuator, ActuatorMetadata
 from bashckup.actuators.exceptions import RunningException, ParameterException
 
 
+rsyncBytesSentRegex = re.compile(r'^Total bytes sent: ([\d,.]+)', re.MULTILINE)
+# Paths relative to the output folder, never synchronized: the state of synchronizations is the one of this host
+rsyncExcludes = ['--exclude=/lost+found/', f'--exclude=/{sync.stateFileName}']
+
+
 class AbstractPostBackup(PythonActuator, ABC):
 
     def _actuator_type(self) -> str:
         return 'post-backup'
 
+    def _check_output_directory(self) -> None:
+        """ Post backups working on the output directory can not follow remote writers (e.g. sshFile) """
+        output_directories = [v.get('output-directory') for v in self._metadata['writer'].values()
+                              if v.get('output-directory') is not None]
+        if len(output_directories) != 1:
+            raise ParameterException(f'{self.module_name()} needs a writer with an output directory (e.g. outputFile)',
+                                     'writer', self._backup_id, self.module_name())
+
+    def batched(self) -> bool:
+        """ True if this post backup is run with the ones of other plans by the run (see SyncStage) """
+        return False
+
+    def batch_key(self) -> tuple:
+        """ :returns: Key of the batch: post backups of the same class and key are run together """
+        return ()
+
+    def prepare_batch(self) -> dict:
+        """ :returns: Arguments of the run of this post backup in its batch, computed at the end of its plan """
+        return self._prepare_run_backup()
+
+    @classmethod
+    def run_batch(cls, batch: List[Tuple['AbstractPostBackup', dict]]) -> List[dict or Exception]:
+        """ :returns: Metrics of each post backup of the batch, or the exception raised by its run """
+        results = []
+        for (post_backup, args) in batch:
+            try:
+                results.append(post_backup._run_backup(args) or {})
+            except RunningException as e:
+                results.append(e)
+        return results
+
 
 class CleanFolderPostBackup(AbstractPostBackup):
     validation_schema = {'type': 'object', 'properties': {
         'retention': {
             'type': 'integer',
             'minimum': 1,
-            'description': 'Retention duration in days'}},
-                         'required': ['retention'],
+            'description': 'Retention duration in days'},
+        'keep-daily': {
+            'type': 'integer',
+            'minimum': 1,
+            'description': 'Number of days for which the latest backup is kept'},
+        'keep-weekly': {
+            'type': 'integer',
+            'minimum': 1,
+            'description': 'Number of weeks for which the latest backup is kept'},
+        'keep-monthly': {
+            'type': 'integer',
+            'minimum': 1,
+            'description': 'Number of months for which the latest backup is kept'},
+        'keep-yearly': {
+            'type': 'integer',
+            'minimum': 1,
+            'description': 'Number of years for which the latest backup is kept'}},
+                         'anyOf': [{'required': ['retention']}, {'required': ['keep-daily']},
+                                   {'required': ['keep-weekly']}, {'required': ['keep-monthly']},
+                                   {'required': ['keep-yearly']}],
                          'additionalProperties': False}
 
     def __init__(self, global_context: dict, args: dict, metadata: Dict[str, Dict[str, ActuatorMetadata]] = None):
         super().__init__(global_context, args, metadata)
         self.retention = None
+        self.keep = {}
         self._output_directory = None
+        self._file_name = None
 
     @staticmethod
     def module_name() -> str:
@@ -40,44 +99,74 @@ class CleanFolderPostBackup(AbstractPostBackup):
     def _get_params(self) -> None:
         validate(self._args, self.validation_schema)
 
-        self.retention = self._args['retention']
-
-    def _prepare_run_backup(self) -> dict:
-        # Validate metadata
+        self._check_output_directory()
+        self.retention = self._args.get('retention')
+        self.keep = {rule: self._args[f'keep-{rule}'] for rule in catalog.gfsPeriods if f'keep-{rule}' in self._args}
+
+    def _pre_run_tasks(self) -> None:
+        # Catalog is created before the backup, so the writer records it with the backups it depends on
+        if self._isBackup and self._dry_run is False:
+            self._validate_register_metadata()
+            output_catalog = catalog.Catalog(Path(self._output_directory), self._file_name)
+            if not output_catalog.exists():
+                try:
+                    with output_catalog.update() as backups:
+                        logging.info('Catalog [%s] created with %d backups', str(backups.path), len(backups.entries))
+                except catalog.CatalogError as e:
+                    raise RunningException(str(e)) from e
+
+    def _validate_register_metadata(self) -> None:
+        """
+        Validates metadata and register attributes with it
+        """
         output_directories = [v.get('output-directory') for (i, v) in self._metadata['writer'].items()]
         if len(output_directories) != 1:  # Because we need at least one, and it can not be greater than 1
             raise ValueError('output-directory must be defined in writer module')
         self._output_directory = output_directories[0]
+        self._file_name = next(iter(self._metadata['writer'].values())).get('file-name')
+
+    def _prepare_run_backup(self) -> dict:
+        # Validate metadata
+        self._validate_register_metadata()
 
         file_preservation_window = max(
             [v.get('file-preservation-window') for (i, v) in self._metadata['reader'].items()])
-        if file_preservation_window is not None and self.retention < file_preservation_window:
+        # The window applies to keep-* rules too: backups it protects are kept whatever rules select
+        if file_preservation_window is not None and self.retention is None and file_preservation_window > 0:
+            logging.info(f'Backups younger than [{file_preservation_window}] days are kept, as needed by the reader')
+            self.retention = file_preservation_window
+        elif file_preservation_window is not None and self.retention is not None and \
+                self.retention < file_preservation_window:
             logging.warning(
                 f'WARNING: retention [{self.retention}] is lower than the minimum possible '
                 f'[{file_preservation_window}]. Retention value is override by the minimum')
             self.retention = file_preservation_window
 
-        files_to_remove = []
-        today = datetime.today()
-        with os.scandir(self._output_directory) as it:
-            entry: os.DirEntry
-            for entry in it:
-                matches = writers.datetimeOutputFileRegex.search(entry.name)
-                if matches is None or len(matches.groups()) != 1:
-                    continue
-                creation_date = datetime.fromisoformat(matches.group(1))
-                diff_days = (today - creation_date).days
-                if diff_days >= self.retention:
-                    files_to_remove.append(entry.path)
-        return {'files-to-remove': files_to_remove}
-
-    def _run_backup(self, args: dict) -> None:
+        # Backups are listed by the catalog updated by the writer, backups needed by kept ones are kept
+        try:
+            backups = catalog.Catalog(Path(self._output_directory), self._file_name).load()
+        except catalog.CatalogError as e:
+            raise RunningException(str(e)) from e
+        kept = catalog.backups_to_keep(backups.entries, datetime.today(), self.retention, self.keep)
+        backups_to_remove = [e for e in backups.entries if e not in kept]
+        files_to_remove = [os.path.join(self._output_directory, f) for e in backups_to_remove for f in e['files']]
+        return {'backups-to-remove': backups_to_remove, 'files-to-remove': files_to_remove}
+
+    def _run_backup(self, args: dict) -> dict:
         for file_path in args['files-to-remove']:
             try:
                 os.remove(file_path)
                 logging.info('File [%s] removed', file_path)
+            except FileNotFoundError:
+                logging.info('File [%s] already removed', file_path)
             except OSError as e:
                 raise RunningException(f'Unable to remove file [{file_path}].\nReason: {e}') from e
+        try:
+            with catalog.Catalog(Path(self._output_directory)).update() as backups:
+                backups.remove(args['backups-to-remove'])
+        except catalog.CatalogError as e:
+            raise RunningException(str(e)) from e
+        return {'deleted-files': len(args['files-to-remove'])}
 
     def _dry_run_backup(self, args: dict) -> None:
         for file_path in args['files-to-remove']:
@@ -109,7 +198,23 @@ class RsyncPostBackup(AbstractPostBackup):
             'description': 'Username to use to log in'},
         'password-file': {
             'type': 'string',
-            'description': 'Path to the file that contains the password'}},
+            'description': 'Path to the file that contains the password'},
+        'mode': {
+            'type': 'string',
+            'enum': ['full', 'new-files'],
+            'default': 'full',
+            'description': 'full: rsync compares the whole output folder with the remote one. new-files: only files '
+                           'created, changed or removed since the previous synchronization are sent or deleted'},
+        'streams': {
+            'type': 'integer',
+            'minimum': 1,
+            'default': 4,
+            'description': 'Number of rsync run at the same time to send files, in new-files mode or with batch'},
+        'batch': {
+            'type': 'boolean',
+            'default': False,
+            'description': 'Synchronization is run by the run, with the ones of other plans to the same host, while '
+                           'next plans are backed up'}},
                          'required': ['ip-addr', 'dest-folder', 'user'],
                          'additionalProperties': False}
 
@@ -124,11 +229,19 @@ class RsyncPostBackup(AbstractPostBackup):
     def _get_params(self) -> None:
         validate(self._args, self.validation_schema)
 
+        self._check_output_directory()
         self.ip_addr = self._args['ip-addr']
         self.dest_module = self._args.get('dest-module')
         self.dest_folder = self._args['dest-folder']
         self.user = self._args['user']
         self.password_file = self._args.get('password-file')
+        self.mode = self._args.get('mode', 'full')
+        self.streams = self._args.get('streams', 4)
+        self.batch = self._args.get('batch', False)
+        self._remote_shell = None  # Remote shell of rsync, when it goes through the SSH master connection
+        if self._args.get('streams') is not None and self.mode != 'new-files' and not self.batch:
+            raise ParameterException('streams can be used only in new-files mode or with batch', 'streams',
+                                     self._backup_id, self.module_name())
         if self.password_file is not None:
             password_file = Path(self._args['password-file'])
             if not password_file.is_file():
@@ -149,60 +262,159 @@ class RsyncPostBackup(AbstractPostBackup):
                     'password-file', self._backup_id,
                     self.module_name())
 
-    def _prepare_run_backup(self) -> dict:
-        # Validate metadata
-        self._validate_register_metadata()
+    def _remote_path(self) -> str:
+        remote_path = self.user + '@' + self.ip_addr
+        if self.dest_module is not None:
+            remote_path += '::' + self.dest_module + '/'
+        else:
+            remote_path += ':/'
+        if self.dest_folder[0] == '/':  # Remove first slash if exists
+            remote_path += self.dest_folder[1:]
+        else:
+            remote_path += self.dest_folder
+        return remote_path
 
+    def _rsync_cmd(self, options: List[str]) -> [str]:
         cmd = ['rsync']
         if self._verbose:
             cmd.append('--progress')
-        cmd.extend('--archive --no-inc-recursive --exclude={"lost+found/"} --delete-after'.split(' '))
+        cmd.extend(options)
+        if self._remote_shell is not None:
+            cmd.extend(['--rsh', self._remote_shell])
         if self.password_file is not None:
             cmd.extend(['--password-file', self.password_file])
+        return cmd
+
+    def batched(self) -> bool:
+        return self.batch
+
+    def batch_key(self) -> tuple:
+        return self.user, self.ip_addr, self.dest_module, self.password_file
+
+    def prepare_batch(self) -> dict:
+        # rsync of all plans to the host goes through one SSH connection, rsync daemons are reached without SSH
+        if self.dest_module is None:
+            destination = self.user + '@' + self.ip_addr
+            try:
+                if ssh.open_master(['ssh'], destination, ssh.defaultControlPersist):
+                    logging.info('SSH connection to [%s] opened', destination)
+                self._remote_shell = ' '.join(shlex.quote(option) for option in ['ssh'] + ssh.control_options())
+            except ssh.SshError as e:
+                logging.warning('WARNING: rsync opens its own connection: %s', e)
+        return self._prepare_run_backup()
+
+    @classmethod
+    def run_batch(cls, batch: List[Tuple['RsyncPostBackup', dict]]) -> List[dict or Exception]:
+        """
+        Synchronizations of several plans to the same host share one pool of 'streams' rsync: the biggest number of
+        streams of the batch
+        """
+        sent: Dict[int, List[int or None]] = {}
+        errors: Dict[int, RunningException] = {}
+        with ThreadPoolExecutor(max_workers=max(post_backup.streams for (post_backup, _) in batch)) as executor:
+            runs = []
+            for (index, (post_backup, args)) in enumerate(batch):
+                if args.get('cmd') is not None:
+                    runs.append((index, executor.submit(post_backup._run_rsync, args['cmd'])))
+                else:
+                    runs.extend((index, executor.submit(post_backup._run_rsync, transfer['cmd'], transfer['paths']))
+                                for transfer in args['transfers'])
+            for (index, future) in runs:
+                try:
+                    sent.setdefault(index, []).append(future.result())
+                except RunningException as e:
+                    errors[index] = e
+        results = []
+        for (index, (post_backup, args)) in enumerate(batch):
+            if index in errors:
+                results.append(errors[index])
+                continue
+            try:
+                results.append(post_backup._end_run(args, sent.get(index, [])))
+            except RunningException as e:
+                results.append(e)
+        return results
+
+    def _prepare_run_backup(self) -> dict:
+        # Validate metadata
+        self._validate_register_metadata()
+
+        destination = self._remote_path()
+        args = {}
+        if self.mode == 'new-files':
+            files = sync.list_files(Path(self._output_directory))
+            try:
+                previous = sync.read_state(Path(self._output_directory), destination)
+            except sync.SyncError as e:
+                raise RunningException(str(e)) from e
+            args = {'files': files, 'destination': destination}
+            # Without state of the previous synchronization, the whole folder is synchronized
+            if previous is not None:
+                (changed, deleted) = sync.changes(previous, files)
+                transfer_cmd = self._rsync_cmd(['--archive', '--stats', '--from0', '--files-from=-'])
+                args['transfers'] = [{'cmd': transfer_cmd + [self._output_directory, destination], 'paths': paths}
+                                     for paths in sync.split(files, changed, self.streams)]
+                # Files missing in the output folder are deleted from the remote one, all by the same rsync
+                delete_cmd = self._rsync_cmd(['--archive', '--delete-missing-args', '--from0', '--files-from=-'])
+                args['deletions'] = [{'cmd': delete_cmd + [self._output_directory, destination], 'paths': deleted}
+                                     ] if len(deleted) != 0 else []
+                return args
+
+        cmd = self._rsync_cmd(['--archive', '--no-inc-recursive'] + rsyncExcludes + ['--delete-after', '--stats'])
         cmd.append(self._output_directory)
-        destination = self.user + '@' + self.ip_addr
-        if self.dest_module is not None:
-            destination += '::' + self.dest_module + '/'
-        else:
-            destination += ':/'
-        if self.dest_folder[0] == '/':  # Remove first slash if exists
-            destination += self.dest_folder[1:]
-        else:
-            destination += self.dest_folder
         cmd.append(destination)
+        args['cmd'] = cmd
+        return args
 
-        return {'cmd': cmd}
-
-    def _run_backup(self, args: dict) -> None:
-        process = subprocess.run(args['cmd'], capture_output=True, shell=False, text=True)
+    def _run_rsync(self, cmd: [str], paths: List[str] = None) -> int or None:
+        """ :returns: Bytes sent by rsync, None if they are unknown """
+        process = subprocess.run(cmd, capture_output=True, shell=False, text=True,
+                                 input='\0'.join(paths) if paths is not None else None)
         if process.returncode != 0:
             raise RunningException('Error during execution of rsync\n'
                                    f'Rsync output: {process.stderr}\n'
                                    f'''Command executed: {' '.join(process.args)}''')
+        if self._verbose:
+            logging.debug(process.stdout)
+        matches = rsyncBytesSentRegex.search(process.stdout)
+        return int(re.sub(r'[,.]', '', matches.group(1))) if matches is not None else None
+
+    def _run_backup(self, args: dict) -> dict:
+        result = self.run_batch([(self, args)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _end_run(self, args: dict, sent: List[int or None]) -> dict:
+        """ Deletes files removed from the output folder, once files are sent, and records the state of the folder """
+        if args.get('cmd') is not None:
+            metrics = {'transferred-bytes': sent[0]}
+        else:
+            for deletion in args['deletions']:
+                self._run_rsync(deletion['cmd'], deletion['paths'])
+            metrics = {'transferred-bytes': sum(s for s in sent if s is not None),
+                       'transferred-files': sum(len(t['paths']) for t in args['transfers']),
+                       'deleted-files': sum(len(d['paths']) for d in args['deletions'])}
+        if args.get('files') is not None:
+            sync.write_state(Path(self._output_directory), args['destination'], args['files'])
+        return metrics
 
     def _dry_run_backup(self, args: dict) -> None:
-        logging.info(f'''Command [{' '.join(args['cmd'])}] would have been ran.''')
+        if args.get('cmd') is not None:
+            logging.info(f'''Command [{' '.join(args['cmd'])}] would have been ran.''')
+            return
+        for run in args['transfers'] + args['deletions']:
+            logging.info(f'''Command [{' '.join(run['cmd'])}] would have been ran with {len(run['paths'])} '''
+                         'files.')
+        if len(args['transfers']) + len(args['deletions']) == 0:
+            logging.info('Nothing changed since the previous synchronization.')
 
     def _prepare_run_restore(self) -> dict:
         # Validate metadata
         self._validate_register_metadata()
 
-        cmd = ['rsync']
-        if self._verbose:
-            cmd.append('--progress')
-        cmd.extend('--archive --no-inc-recursive --exclude={"lost+found/"} --delete-after'.split(' '))
-        if self.password_file is not None:
-            cmd.extend(['--password-file', self.password_file])
-        remote_src = self.user + '@' + self.ip_addr
-        if self.dest_module is not None:
-            remote_src += '::' + self.dest_module + '/'
-        else:
-            remote_src += ':/'
-        if self.dest_folder[0] == '/':  # Remove first slash if exists
-            remote_src += self.dest_folder[1:]
-        else:
-            remote_src += self.dest_folder
-        cmd.append(remote_src)
+        cmd = self._rsync_cmd(['--archive', '--no-inc-recursive'] + rsyncExcludes + ['--delete-after'])
+        cmd.append(self._remote_path())
         cmd.append(self._output_directory)
 
         return {'cmd': cmd}
@@ -220,11 +432,7 @@ class RsyncPostBackup(AbstractPostBackup):
             self._output_directory = self._output_directory + '/'
 
     def _run_restore(self, args: dict) -> None:
-        process = subprocess.run(args['cmd'], capture_output=True, shell=False, text=True)
-        if process.returncode != 0:
-            raise RunningException('Error during execution of rsync\n'
-                                   f'Rsync output: {process.stderr}\n'
-                                   f'''Command executed: {' '.join(process.args)}''')
+        self._run_rsync(args['cmd'])
 
     def _dry_run_restore(self, args: dict) -> None:
         logging.info(f'''Command [{' '.join(args['cmd'])}] would have been ran.''')
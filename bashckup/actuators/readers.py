@@ -1,30 +1,79 @@
 import os
+import re
 import shutil
+import stat
 import subprocess
 from abc import ABC
 from datetime import datetime
 from pathlib import Path
-from typing import IO, AnyStr, Dict
+from typing import IO, AnyStr, Dict, Callable, List
 
 from jsonschema.validators import validate
 
-from bashckup.actuators import writers
+from bashckup.actuators import catalog, writers, mariadb, incremental
 from bashckup.actuators.actuators import ActuatorMetadata, CommandActuator
-from bashckup.actuators.exceptions import ParameterException
+from bashckup.actuators.exceptions import ParameterException, RunningException
+
+
+def _move_aside(src_path: Path) -> None:
+    """ Moves files of src_path to a sibling folder suffixed by the current date time, before a restoration """
+    files = os.listdir(src_path)
+    if len(files) != 0:  # Not Empty
+        backup_path = src_path.parents[0] / (
+                src_path.name + '-bck-' + datetime.today().isoformat(timespec='seconds'))
+
+        metadata = os.stat(src_path)
+        os.mkdir(backup_path, metadata.st_mode)
+        for file in files:
+            shutil.move(os.path.join(src_path, file), backup_path)
 
 
 class AbstractReader(CommandActuator, ABC):
+    # Whether some paths can be restored instead of the whole backup (restore --path)
+    selectablePaths = False
 
     def _actuator_type(self) -> str:
         return 'reader'
 
+    def _validate_parameters(self) -> None:
+        super()._validate_parameters()
+        if self._isRestore and self._restore_paths is not None and not self.selectablePaths:
+            raise ParameterException('--path can not be used with this reader', 'path', self._backup_id,
+                                     self.module_name())
+
     def generate_backup_process(self, stdin: IO[AnyStr] = None, stdout: IO[AnyStr] = subprocess.PIPE) \
             -> subprocess.Popen:
         return super().generate_backup_process(stdin, stdout)
 
+    def shards(self) -> List[List[str] or None] or None:
+        """
+        :returns: Entries of each shard when this reader splits the plan in several pipelines (one by shard, with their
+        own transformers and writer), None when the plan is not split
+        """
+        return None
+
+
+def _tree_size(path: str) -> int:
+    """ Size of the files of a tree, symbolic links are not followed """
+    size = 0
+    paths = [path]
+    while len(paths) != 0:
+        current = paths.pop()
+        try:
+            current_stat = os.lstat(current)
+        except FileNotFoundError:
+            continue
+        size += current_stat.st_size
+        if stat.S_ISDIR(current_stat.st_mode):
+            with os.scandir(current) as it:
+                paths.extend(entry.path for entry in it)
+    return size
+
 
 class FileReader(AbstractReader):
+    selectablePaths = True
     defaultLevel0frequency = 'weekly'
+    defaultShardBy = 'size'
     validation_schema = {'type': 'object',
                          'properties': {
                              'path': {
@@ -39,7 +88,20 @@ class FileReader(AbstractReader):
                                  'enum': ['weekly', 'monthly'],
                                  'default': defaultLevel0frequency,
                                  'description': 'When a full backup have to be done ? You have to choose in ['
-                                                '\'weekly\', \'monthly\']'}
+                                                '\'weekly\', \'monthly\']'},
+                             'shards': {
+                                 'type': 'integer',
+                                 'minimum': 2,
+                                 'description': 'Number of archives the folder is split in, by its top-level entries. '
+                                                'Each archive has its own transformers and output file, they are '
+                                                'written and restored at the same time'},
+                             'shard-by': {
+                                 'type': 'string',
+                                 'enum': ['size', 'subdirectory'],
+                                 'default': defaultShardBy,
+                                 'description': 'How top-level entries are split: \'size\' balances the size of '
+                                                'archives (the folder is walked to get sizes), \'subdirectory\' '
+                                                'deals entries in turn'}
                          },
                          'required': ['path'],
                          'additionalProperties': False}
@@ -48,6 +110,7 @@ class FileReader(AbstractReader):
         super().__init__(global_context, args, metadata)
         self._file_prefix = None
         self._output_directory = None
+        self._incremental_metadata_file = None
 
     @staticmethod
     def module_name() -> str:
@@ -60,9 +123,63 @@ class FileReader(AbstractReader):
             raise ParameterException('level-0-frequency can be used only with incremental-metadata-file-prefix',
                                      'level-0-frequency', self._backup_id, self.module_name())
 
+        if self._args.get('shard-by') is not None and self._args.get('shards') is None:
+            raise ParameterException('shard-by can be used only with shards', 'shard-by', self._backup_id,
+                                     self.module_name())
+        if self._args.get('shards') is not None and self._args.get('incremental-metadata-file-prefix') is not None:
+            raise ParameterException('shards can not be used with incremental-metadata-file-prefix', 'shards',
+                                     self._backup_id, self.module_name())
+
         self.incrementalMetadataFilePrefix = self._args.get('incremental-metadata-file-prefix')
         self.path = self._args['path']
         self.level0Frequency = self._args.get('level-0-frequency', self.defaultLevel0frequency)
+        self.shardCount = self._args.get('shards')
+        self.shardBy = self._args.get('shard-by', self.defaultShardBy)
+        if self._isRestore and self._restore_paths is not None:
+            self._validate_restore_paths()
+
+    def _validate_restore_paths(self) -> None:
+        if self.shardCount is not None:
+            raise ParameterException('--path can not be used with shards', 'shards', self._backup_id,
+                                     self.module_name())
+        for path in self._restore_paths:
+            if os.path.isabs(path) or os.path.normpath(path).split(os.sep)[0] in ['..', '.']:
+                raise ParameterException(f'--path [{path}] must be a relative path inside [{self.path}]', 'path',
+                                         self._backup_id, self.module_name())
+
+    def _restore_members(self) -> List[str]:
+        """ :returns: Names of the members of the archive to restore, as tar writes them """
+        return [os.path.normpath(os.path.join(self.path, path)).lstrip('/') for path in self._restore_paths]
+
+    def _pre_run_tasks(self) -> None:
+        # Readers of other shards receive the split done by the reader of the first shard
+        if self.shardCount is None or self._shards is not None:
+            return
+        if self._isRestore:
+            self._shards = [None] * self.shardCount  # Entries of shards are in their archives
+            return
+        if not os.path.isdir(self.path):
+            raise ParameterException(f'Directory [{self.path}] does not exist', 'path', self._backup_id,
+                                     self.module_name())
+        self._shards = self._split_shards(sorted(os.listdir(self.path)))
+
+    def _split_shards(self, entries: List[str]) -> List[List[str]]:
+        shards = [[] for _ in range(self.shardCount)]
+        if self.shardBy == 'subdirectory':
+            for (i, entry) in enumerate(entries):
+                shards[i % self.shardCount].append(entry)
+            return shards
+        # Biggest entries first, each one in the smallest shard
+        sizes = {entry: _tree_size(os.path.join(self.path, entry)) for entry in entries}
+        shard_sizes = [0] * self.shardCount
+        for entry in sorted(entries, key=lambda e: sizes[e], reverse=True):
+            smallest = shard_sizes.index(min(shard_sizes))
+            shards[smallest].append(entry)
+            shard_sizes[smallest] += sizes[entry]
+        return [sorted(shard) for shard in shards]
+
+    def shards(self) -> List[List[str] or None] or None:
+        return self._shards
 
     def _generate_backup_cmd(self) -> [str]:
         # Validate metadata
@@ -72,18 +189,26 @@ class FileReader(AbstractReader):
         if self._verbose:
             cmd.append('--verbose')
         if self.incrementalMetadataFilePrefix is not None:
-            cmd.extend(['--listed-incremental', str(self._generate_incremental_metadata_file_name())])
-        cmd.extend(['--create', self.path])
+            self._incremental_metadata_file = self._generate_incremental_metadata_file_name()
+            cmd.extend(['--listed-incremental', str(self._incremental_metadata_file)])
+        if self._shards is None:
+            cmd.extend(['--create', self.path])
+        elif len(self._shards[self._shard_index]) == 0:  # More shards than entries
+            cmd.extend(['--create', '--files-from=/dev/null'])
+        else:
+            cmd.extend(['--create'] + [os.path.join(self.path, entry) for entry in self._shards[self._shard_index]])
         return cmd
 
     def _validate_register_metadata(self):
         """
         Validates metadata and register attributes with it
         """
-        output_directories = [v.get('output-directory') for (i, v) in self._metadata['writer'].items()]
-        if len(output_directories) != 1:  # Because we need at least one, and it can not be greater than 1
+        output_directories = [v.get('output-directory') for (i, v) in self._metadata['writer'].items()
+                              if v.get('output-directory') is not None]
+        # Incremental metadata file is kept in the output directory, remote writers have none
+        if len(output_directories) != 1 and self.incrementalMetadataFilePrefix is not None:
             raise ValueError('output-directory must be defined in writer module')
-        self._output_directory = output_directories[0]
+        self._output_directory = output_directories[0] if len(output_directories) != 0 else None
         file_prefixes = [v.get('file-prefix') for (i, v) in self._metadata['writer'].items()]
         if len(file_prefixes) != 1:  # Because we need at least one, and it can not be greater than 1
             raise ValueError('file-prefix must be defined in writer module')
@@ -138,7 +263,42 @@ class FileReader(AbstractReader):
                 # +1 because we want to protect all the day, not actual time of the first day of the month
             else:
                 raise ValueError(f'Frequency {self.level0Frequency} is not managed')
-        return {'file-preservation-window': days}
+        metadata = {'file-preservation-window': days}
+        if self.incrementalMetadataFilePrefix is not None:  # Metadata file is kept in the output directory
+            metadata['output-directory-files'] = 'incremental-metadata-file-prefix'
+        if self._shards is not None:
+            metadata['shards'] = self._shards
+        if self._isRestore and self._restore_paths is not None:
+            metadata['members'] = self._restore_members()
+        return metadata
+
+    def catalog_entry(self) -> dict:
+        if self._incremental_metadata_file is None:
+            return {}
+        # Metadata file belongs to the level 0 backup, which is needed by next incremental backups
+        name = self._incremental_metadata_file.name
+        if name.startswith(self._file_prefix):
+            return {'files': [name]}
+        return {'depends-on': [self._previous_backup(writers.datetimeOutputFileRegex.search(name).group(1))]}
+
+    def _previous_backup(self, level_0_datetime: str) -> str:
+        """
+        tar updates the metadata file at each backup, so an incremental backup holds changes since the previous backup
+        of its chain, not since the level 0 one
+        :returns: Datetime of the latest successful backup of the chain, the level 0 one if the catalog does not exist
+        """
+        output_catalog = catalog.Catalog(Path(self._output_directory))
+        if not output_catalog.exists():
+            return level_0_datetime
+        file_name = next(iter(self._metadata['writer'].values())).get('file-name')
+        backup_datetime = self._backup_datetime.isoformat(timespec='seconds')
+        try:
+            entries = output_catalog.load().entries
+        except catalog.CatalogError as e:
+            raise RunningException(str(e)) from e
+        chain = [e['datetime'] for e in entries if e['name'] == file_name and e.get('success', True)
+                 and level_0_datetime <= e['datetime'] < backup_datetime]
+        return max(chain, default=level_0_datetime)
 
     def _generate_restore_cmd(self) -> [str]:
         # Validate metadata
@@ -150,32 +310,183 @@ class FileReader(AbstractReader):
             cmd.extend(['--listed-incremental', str(self._generate_incremental_metadata_file_name())])
         cmd.extend(
             ['--extract', '--same-owner', '--same-permissions', '--strip-components=1', '--directory', self.path])
-
+        if self._restore_paths is not None:
+            cmd.extend(['--'] + self._restore_members())
         return cmd
 
     # Override because we need to back up files before the restoration
     def generate_restore_process(self, stdin: IO[AnyStr] = subprocess.PIPE,
                                  stdout: IO[AnyStr] = None) -> subprocess.Popen:
-        # Back up src files before restoration
-        src_path = Path(self.path)
-        files = os.listdir(src_path)
-        if len(files) != 0:  # Not Empty
-            backup_path = src_path.parents[0] / (
-                    src_path.name + '-bck-' + datetime.today().isoformat(timespec='seconds'))
-
-            metadata = os.stat(src_path)
-            os.mkdir(backup_path, metadata.st_mode)
-            for file in files:
-                shutil.move(os.path.join(src_path, file), backup_path)
+        # Back up src files before restoration, shards are restored after the first one started. Files not selected by
+        # --path are kept in place
+        if self._shard_index == 0 and self._restore_paths is None:
+            _move_aside(Path(self.path))
         return super().generate_restore_process(stdin, stdout)
 
 
+class IncrementalFileReader(AbstractReader):
+    defaultLevels = [0, 1, 2, 3, 4, 5, 6]
+    validation_schema = {'type': 'object',
+                         'properties': {
+                             'path': {
+                                 'type': 'string',
+                                 'description': 'Folder path for the backup'},
+                             'index-name': {
+                                 'type': 'string',
+                                 'description': 'Name of index files of the tree, stored in the output directory. '
+                                                'Backup id by default'},
+                             'levels': {
+                                 'type': 'array',
+                                 'items': {'type': 'integer', 'minimum': 0},
+                                 'minItems': 7,
+                                 'maxItems': 7,
+                                 'default': defaultLevels,
+                                 'description': 'Level of the backup for each day of the week, from monday to sunday. '
+                                                'A backup of level N contains changes since the latest backup of a '
+                                                'lower level, level 0 is a full backup'},
+                             'threads': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'description': 'Number of threads walking the tree. By default, CPUs are shared '
+                                                'between backups run at the same time (see --jobs)'}
+                         },
+                         'required': ['path'],
+                         'additionalProperties': False}
+
+    def __init__(self, global_context: dict, args: dict, metadata: Dict[str, Dict[str, ActuatorMetadata]] = None):
+        super().__init__(global_context, args, metadata)
+        self._output_directory = None
+        self._backup_datetime = None
+        self._level = None
+        self._reference = None
+        self._pending_index = None
+
+    @staticmethod
+    def module_name() -> str:
+        return 'incrementalFiles'
+
+    def _get_params(self) -> None:
+        validate(self._args, self.validation_schema)
+        self.path = self._args['path']
+        self.indexName = self._args.get('index-name', self._backup_id)
+        self.levels = self._args.get('levels', self.defaultLevels)
+        self.threads = self._args.get('threads', self._threads)
+
+    def _run_in_process(self) -> bool:
+        # Only implemented by bashckup
+        return True
+
+    def _generate_metadata(self) -> dict:
+        # Indexes of the tree are kept in the output directory
+        return {'output-directory-files': 'index-name'}
+
+    def _validate_register_metadata(self) -> None:
+        """
+        Validates metadata and register attributes with it
+        """
+        output_directories = [v.get('output-directory') for (i, v) in self._metadata['writer'].items()]
+        if len(output_directories) != 1:  # Because we need at least one, and it can not be greater than 1
+            raise ValueError('output-directory must be defined in writer module')
+        self._output_directory = Path(output_directories[0])
+        backups_datetime = [v.get('backup-datetime') for (i, v) in self._metadata['writer'].items()]
+        if len(backups_datetime) != 1:  # Because we need at least one, and it can not be greater than 1
+            raise ValueError('backup-datetime must be defined in writer module')
+        self._backup_datetime = backups_datetime[0]
+
+    def _index_path(self, level: int) -> Path:
+        return self._output_directory / f'{self.indexName}-L{level}.index'
+
+    def _prepare_backup(self) -> None:
+        """ Chooses the level of the backup and its reference: the index of the highest lower level """
+        if self._level is not None:
+            return
+        self._validate_register_metadata()
+        self._level = self.levels[datetime.fromisoformat(self._backup_datetime).weekday()]
+        for level in range(self._level - 1, -1, -1):
+            if self._index_path(level).is_file():
+                self._reference = self._index_path(level)
+                break
+        self._pending_index = self._output_directory / f'.{self.indexName}-L{self._level}.index.pending'
+
+    def _generate_backup_cmd(self) -> [str]:
+        self._prepare_backup()
+        cmd = ['bashckup-files', f'--level={self._level}', f'--threads={self.threads}',
+               f'--index={self._pending_index}']
+        if self._reference is not None:
+            cmd.append(f'--reference={self._reference}')
+        cmd.append(self.path)
+        return cmd
+
+    def _native_backup_target(self) -> Callable[[int, int], dict]:
+        self._prepare_backup()
+
+        def backup(in_fd: int, out_fd: int) -> dict:
+            if self._reference is None:
+                return incremental.backup_tree(Path(self.path), out_fd, self._pending_index, self._level,
+                                               self._backup_datetime, None, self.threads)
+            with incremental.TreeIndex(self._reference) as reference:
+                return incremental.backup_tree(Path(self.path), out_fd, self._pending_index, self._level,
+                                               self._backup_datetime, reference, self.threads)
+
+        return backup
+
+    def end_backup(self, success: bool) -> None:
+        if self._pending_index is None or not self._pending_index.is_file():
+            return
+        if not success:
+            os.remove(self._pending_index)
+            return
+        os.replace(self._pending_index, self._index_path(self._level))
+        # Next backups of higher levels are done against this one
+        with os.scandir(self._output_directory) as it:
+            for entry in it:
+                match = re.fullmatch(re.escape(self.indexName) + r'-L(\d+)\.index', entry.name)
+                if match is not None and int(match.group(1)) > self._level:
+                    os.remove(entry.path)
+
+    def catalog_entry(self) -> dict:
+        if self._reference is None:
+            return {}
+        with incremental.TreeIndex(self._reference) as reference:
+            return {'depends-on': [reference.backup_datetime]}
+
+    def _generate_restore_cmd(self) -> [str]:
+        return ['bashckup-files-extract', f'--directory={self.path}']
+
+    def _native_restore_target(self) -> Callable[[int, int], None]:
+        return lambda in_fd, out_fd: incremental.restore_tree(in_fd, Path(self.path),
+                                                              lambda: _move_aside(Path(self.path)))
+
+
 class MariaDBReader(AbstractReader):
     validation_schema = {'type': 'object',
                          'properties': {
                              'database-name': {
                                  'type': 'string',
-                                 'description': 'Name of mariadb database'}
+                                 'description': 'Name of mariadb database'},
+                             'connections': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'description': 'Number of connections dumping (and restoring) tables at the same '
+                                                'time. When it is defined, bashckup dumps each table in its own '
+                                                'compressed chunk instead of using mysqldump'},
+                             'compression-level': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'maximum': 9,
+                                 'default': mariadb.defaultCompressionLevel,
+                                 'description': 'Gzip compression level of chunks, from 1 (fastest) to 9 (best '
+                                                'compression)'},
+                             'chunk-size': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'description': 'Size in bytes of data chunks: bigger tables are split by ranges of '
+                                                'their primary key, dumped and restored at the same time'},
+                             'chunk-rows': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'description': 'Number of rows of data chunks: bigger tables are split by ranges of '
+                                                'their primary key, dumped and restored at the same time'}
                          },
                          'required': ['database-name'],
                          'additionalProperties': False}
@@ -186,19 +497,53 @@ class MariaDBReader(AbstractReader):
 
     def _get_params(self) -> None:
         validate(self._args, self.validation_schema)
+        for parameter in ['compression-level', 'chunk-size', 'chunk-rows']:
+            if self._args.get(parameter) is not None and self._args.get('connections') is None:
+                raise ParameterException(f'{parameter} can be used only with connections', parameter,
+                                         self._backup_id, self.module_name())
 
         self.databaseName = self._args['database-name']
+        self.connections = self._args.get('connections')
+        self.compressionLevel = self._args.get('compression-level', mariadb.defaultCompressionLevel)
+        self.chunkSize = self._args.get('chunk-size')
+        self.chunkRows = self._args.get('chunk-rows')
+
+    def _run_in_process(self) -> bool:
+        # Parallel dump is only implemented by bashckup
+        return self.connections is not None or super()._run_in_process()
 
     def _generate_backup_cmd(self) -> [str]:
+        if self.connections is not None:
+            cmd = ['bashckup-mariadb-dump', f'--connections={self.connections}',
+                   f'--compression-level={self.compressionLevel}']
+            if self.chunkSize is not None:
+                cmd.append(f'--chunk-size={self.chunkSize}')
+            if self.chunkRows is not None:
+                cmd.append(f'--chunk-rows={self.chunkRows}')
+            cmd.append(self.databaseName)
+            return cmd
         cmd = ['mysqldump']
         if self._verbose:
             cmd.append('--verbose')
         cmd.append(self.databaseName)
         return cmd
 
+    def _native_backup_target(self) -> Callable[[int, int], None] or None:
+        if self.connections is None:
+            return None
+        return lambda in_fd, out_fd: mariadb.dump_database(self.databaseName, self.connections, out_fd,
+                                                           self.compressionLevel, self.chunkSize, self.chunkRows)
+
     def _generate_restore_cmd(self) -> [str]:
+        if self.connections is not None:
+            return ['bashckup-mariadb-load', f'--connections={self.connections}', self.databaseName]
         cmd = ['mysql']
         if self._verbose:
             cmd.append('--verbose')
         cmd.append(self.databaseName)
         return cmd
+
+    def _native_restore_target(self) -> Callable[[int, int], None] or None:
+        if self.connections is None:
+            return None
+        return lambda in_fd, out_fd: mariadb.load_database(self.databaseName, self.connections, in_fd)
@@ -0,0 +1,56 @@
+import fcntl
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import List
+
+"""
+SSH master connections (ControlMaster), shared by the commands run on the same host by all plans of a run: the
+authentication is done once, and next commands open a session on the existing connection.
+"""
+
+defaultControlPersist = 60
+
+
+class SshError(Exception):
+    pass
+
+
+def control_folder() -> Path:
+    """ :returns: Folder of the sockets of SSH master connections, shared by the plans of the current user """
+    folder = Path(tempfile.gettempdir()) / f'bashckup-ssh-{os.getuid()}'
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    folder_stat = os.stat(folder)
+    if folder_stat.st_uid != os.getuid() or folder_stat.st_mode & 0o077 != 0:
+        raise SshError(f'Folder [{folder}] must be owned by current user and not accessible by others')
+    return folder
+
+
+def control_options() -> List[str]:
+    """ :returns: Options of ssh to run a command through the master connection of the host, if it is open """
+    return ['-o', f'''ControlPath={control_folder() / '%C'}''', '-o', 'ControlMaster=no']
+
+
+def open_master(ssh_cmd: List[str], destination: str, control_persist: int) -> bool:
+    """
+    Opens the master connection to destination, unless it is already open. It is opened in background by ssh, so it
+    does not hold the outputs of the commands run through it.
+    :param ssh_cmd: ssh and its options (port, identity...) without destination
+    :returns: True if the connection has been opened, False if it was already open
+    """
+    control_path = ['-o', f'''ControlPath={control_folder() / '%C'}''']
+    # Plans run at the same time would open several connections
+    with open(control_folder() / 'lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        check = subprocess.run(ssh_cmd + control_path + ['-O', 'check', destination], stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if check.returncode == 0:
+            return False
+        process = subprocess.run(ssh_cmd + control_path + ['-o', 'BatchMode=yes', '-f', '-N', '-o', 'ControlMaster=yes',
+                                                           '-o', f'ControlPersist={control_persist}', destination],
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                 text=True)
+        if process.returncode != 0:
+            raise SshError(f'Unable to connect to [{destination}]\nSSH output: {process.stderr}')
+        return True
@@ -0,0 +1,72 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from bashckup.report import write_atomically
+
+"""
+Incremental synchronization of an output directory: the state of the directory (size and modification time of each
+file) is recorded once it is synchronized, so the next synchronization sends only files created or changed since, and
+deletes only files removed since (e.g. by cleanFolder), without rsync building and comparing the list of the whole
+directory.
+"""
+
+stateFileName = '.bashckup-sync.json'
+stateVersion = 1
+excludedNames = {stateFileName, 'lost+found'}
+
+
+class SyncError(Exception):
+    pass
+
+
+def list_files(directory: Path) -> Dict[str, Tuple[int, int]]:
+    """ :returns: Size and modification time (ns) of each file of the directory, by path relative to it """
+    files = {}
+    for (root, dirs, names) in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in excludedNames)
+        for name in names:
+            if name in excludedNames or name.endswith('.tmp'):  # Files being written atomically
+                continue
+            path = os.path.join(root, name)
+            stat = os.lstat(path)
+            files[os.path.relpath(path, directory)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def read_state(directory: Path, destination: str) -> Dict[str, Tuple[int, int]] or None:
+    """ :returns: Files of the directory at its latest synchronization to destination, None if it is unknown """
+    try:
+        with open(directory / stateFileName, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        raise SyncError(f'State of synchronization [{directory / stateFileName}] is unreadable: {e}') from e
+    if state.get('version') != stateVersion or state.get('destination') != destination:
+        return None
+    return {path: tuple(file) for (path, file) in state['files'].items()}
+
+
+def write_state(directory: Path, destination: str, files: Dict[str, Tuple[int, int]]) -> None:
+    write_atomically(directory / stateFileName,
+                     json.dumps({'version': stateVersion, 'destination': destination, 'files': files}))
+
+
+def changes(previous: Dict[str, Tuple[int, int]], current: Dict[str, Tuple[int, int]]) -> (List[str], List[str]):
+    """ :returns: Files created or changed since the previous state, and files removed since """
+    changed = sorted(path for (path, file) in current.items() if previous.get(path) != file)
+    deleted = sorted(path for path in previous if path not in current)
+    return changed, deleted
+
+
+def split(files: Dict[str, Tuple[int, int]], paths: List[str], streams: int) -> List[List[str]]:
+    """ :returns: Paths split in up to 'streams' lists of about the same size, biggest files first """
+    lists = [[] for _ in range(min(streams, len(paths)))]
+    sizes = [0] * len(lists)
+    for path in sorted(paths, key=lambda p: files[p][0], reverse=True):
+        smallest = sizes.index(min(sizes))
+        lists[smallest].append(path)
+        sizes[smallest] += files[path][0]
+    return lists
@@ -1,12 +1,14 @@
 import os
+import shutil
 import subprocess
 from abc import ABC
 from pathlib import Path
-from typing import IO, AnyStr
+from typing import IO, AnyStr, Callable, Dict
 
 from jsonschema.validators import validate
 
-from bashckup.actuators.actuators import CommandActuator
+from bashckup.actuators import native, members, frames, aead
+from bashckup.actuators.actuators import CommandActuator, ActuatorMetadata
 from bashckup.actuators.exceptions import ParameterException
 
 
@@ -19,6 +21,10 @@ class AbstractTransformer(CommandActuator, ABC):
             -> subprocess.Popen:
         return super().generate_backup_process(stdin, stdout)
 
+    def generate_restore_process(self, stdin: IO[AnyStr], stdout: IO[AnyStr] = subprocess.PIPE) \
+            -> subprocess.Popen:
+        return super().generate_restore_process(stdin, stdout)
+
 
 class GzipTransformer(AbstractTransformer):
     defaultLevel = 6
@@ -33,10 +39,23 @@ class GzipTransformer(AbstractTransformer):
                                                 'where 1 indicates the fastest compression method (less compression) '
                                                 'and 9 indicates the slowest compression method (best compression). '
                                                 'The default compression level is ' + str(defaultLevel) +
-                                                ' (that is, biased towards high compression at expense of speed).'}
+                                                ' (that is, biased towards high compression at expense of speed).'},
+                             'block-size': {
+                                 'type': 'integer',
+                                 'minimum': members.minimumBlockSize,
+                                 'maximum': members.maximumBlockSize,
+                                 'description': 'Compresses each block of this size in bytes in its own gzip member, '
+                                                'followed by a table of the blocks, and writes an index of the '
+                                                'members of the tar stream next to the output file. Blocks are '
+                                                'decompressed on several threads, and some files can be restored '
+                                                'without reading the whole backup (see restore --path)'}
                          },
                          'additionalProperties': False}
 
+    def __init__(self, global_context: dict, args: dict, metadata: Dict[str, Dict[str, ActuatorMetadata]] = None):
+        super().__init__(global_context, args, metadata)
+        self._index_path = None
+
     @staticmethod
     def module_name() -> str:
         return 'gzip'
@@ -45,51 +64,220 @@ class GzipTransformer(AbstractTransformer):
         validate(self._args, self.validation_schema)
 
         self.level = self._args.get('level', self.defaultLevel)
+        self.blockSize = self._args.get('block-size')
+
+    def _run_in_process(self) -> bool:
+        # Compression by blocks and their parallel decompression are only implemented by bashckup
+        return self.blockSize is not None or super()._run_in_process()
+
+    def _generate_metadata(self) -> dict:
+        # Writers without a local output file reject the transformer, see AbstractWriter
+        return {'output-file-index': 'block-size'} if self.blockSize is not None else {}
+
+    def _get_index_path(self) -> Path:
+        output_files = [v.get('output-file') for (i, v) in self._metadata['writer'].items()]
+        if len(output_files) != 1 or output_files[0] is None:
+            raise ParameterException('block-size needs a writer of a local output file (e.g. outputFile)',
+                                     'block-size', self._backup_id, self.module_name())
+        return Path(output_files[0] + members.indexSuffix)
 
     def _generate_backup_cmd(self) -> [str]:
+        if self.blockSize is not None:
+            self._index_path = self._get_index_path()
+            return ['bashckup-gzip-blocks', '-' + str(self.level), f'--block-size={self.blockSize}',
+                    f'--index={self._index_path}']
         cmd = ['gzip', '-' + str(self.level)]
         return cmd
 
     def _generate_restore_cmd(self) -> [str]:
-        cmd = ['unzip']
+        if self.blockSize is not None:
+            return ['bashckup-gzip-blocks', '-d', f'--threads={self._threads}']
+        if shutil.which('pigz') is not None:  # Same format, reading, writing and checking are done on other threads
+            return ['pigz', '-d', '--processes', str(self._threads)]
+        cmd = ['gzip', '-d']
         return cmd
 
+    def _native_backup_target(self) -> Callable[[int, int], dict or None]:
+        if self.blockSize is not None:
+            return lambda in_fd, out_fd: members.compress_blocks(in_fd, out_fd, self.level, self.blockSize,
+                                                                 self._get_index_path())
+        return lambda in_fd, out_fd: native.gzip_compress(in_fd, out_fd, self.level)
+
+    def catalog_entry(self) -> dict:
+        if self._index_path is None:
+            return {}
+        return {'files': [self._index_path.name]}
 
-class OpenSSLTransformer(AbstractTransformer):
+    def _native_restore_target(self) -> Callable[[int, int], dict or None]:
+        if self.blockSize is not None:
+            return lambda in_fd, out_fd: frames.decompress(in_fd, out_fd, self._threads)
+        return native.gzip_decompress
+
+
+class AbstractMultiThreadTransformer(AbstractTransformer, ABC):
+    threads_schema = {'type': 'integer',
+                      'minimum': 1,
+                      'description': 'Number of threads used. By default, CPUs are shared between backups run at the '
+                                     'same time (see --jobs)'}
+
+    def _get_threads(self) -> int:
+        return self._args.get('threads', self._threads)
+
+
+class PigzTransformer(AbstractMultiThreadTransformer):
     defaultLevel = 6
     validation_schema = {'type': 'object',
                          'properties': {
-                             'password-file': {
-                                 'type': 'string',
-                                 'description': 'Path to the file that contains the password'}
+                             'level': GzipTransformer.validation_schema['properties']['level'],
+                             'threads': AbstractMultiThreadTransformer.threads_schema
                          },
-                         'required': ['password-file'],
                          'additionalProperties': False}
 
     @staticmethod
     def module_name() -> str:
-        return 'crypt'
+        return 'pigz'
 
     def _get_params(self) -> None:
         validate(self._args, self.validation_schema)
 
-        password_file = Path(self._args['password-file'])
+        self.level = self._args.get('level', self.defaultLevel)
+        self.threads = self._get_threads()
+
+    def _generate_backup_cmd(self) -> [str]:
+        cmd = ['pigz', '-' + str(self.level), '--processes', str(self.threads)]
+        return cmd
+
+    def _generate_restore_cmd(self) -> [str]:
+        cmd = ['pigz', '-d', '--processes', str(self.threads)]
+        return cmd
+
+
+class ZstdTransformer(AbstractMultiThreadTransformer):
+    defaultLevel = 3
+    validation_schema = {'type': 'object',
+                         'properties': {
+                             'level': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'maximum': 19,
+                                 'default': defaultLevel,
+                                 'description': 'Compression level, from 1 (fastest) to 19 (best compression). The '
+                                                'default compression level is ' + str(defaultLevel)},
+                             'threads': AbstractMultiThreadTransformer.threads_schema,
+                             'long': {
+                                 'type': 'integer',
+                                 'minimum': 10,
+                                 'maximum': 31,
+                                 'description': 'Enables long distance matching with a window of 2^long bytes. It '
+                                                'improves compression of big backups with far duplicates, but uses '
+                                                'as much memory to compress and to restore'}
+                         },
+                         'additionalProperties': False}
+
+    @staticmethod
+    def module_name() -> str:
+        return 'zstd'
+
+    def _get_params(self) -> None:
+        validate(self._args, self.validation_schema)
+
+        self.level = self._args.get('level', self.defaultLevel)
+        self.threads = self._get_threads()
+        self.long = self._args.get('long')
+
+    def _generate_backup_cmd(self) -> [str]:
+        cmd = ['zstd', '-' + str(self.level), '-T' + str(self.threads), '--stdout']
+        if self.long is not None:
+            cmd.append('--long=' + str(self.long))
+        if not self._verbose:
+            cmd.append('--quiet')
+        return cmd
+
+    def _generate_restore_cmd(self) -> [str]:
+        cmd = ['zstd', '-d', '-T' + str(self.threads), '--stdout']
+        if self.long is not None:  # Decompression refuses windows greater than 2^27 without this option
+            cmd.append('--long=' + str(self.long))
+        if not self._verbose:
+            cmd.append('--quiet')
+        return cmd
+
+
+class XzTransformer(AbstractMultiThreadTransformer):
+    defaultLevel = 6
+    validation_schema = {'type': 'object',
+                         'properties': {
+                             'level': {
+                                 'type': 'integer',
+                                 'minimum': 0,
+                                 'maximum': 9,
+                                 'default': defaultLevel,
+                                 'description': 'Compression level, from 0 (fastest) to 9 (best compression). The '
+                                                'default compression level is ' + str(defaultLevel)},
+                             'threads': AbstractMultiThreadTransformer.threads_schema
+                         },
+                         'additionalProperties': False}
+
+    @staticmethod
+    def module_name() -> str:
+        return 'xz'
+
+    def _get_params(self) -> None:
+        validate(self._args, self.validation_schema)
+
+        self.level = self._args.get('level', self.defaultLevel)
+        self.threads = self._get_threads()
+
+    def _generate_backup_cmd(self) -> [str]:
+        cmd = ['xz', '-' + str(self.level), '--threads=' + str(self.threads), '--stdout']
+        return cmd
+
+    def _generate_restore_cmd(self) -> [str]:
+        cmd = ['xz', '-d', '--threads=' + str(self.threads), '--stdout']
+        return cmd
+
+
+class AbstractPasswordTransformer(AbstractTransformer, ABC):
+    password_file_schema = {'type': 'string',
+                            'description': 'Path to the file that contains the password'}
+
+    def _get_password_file(self, parameter: str = 'password-file') -> Path:
+        """ :returns: Path of a secret file given by parameter, which must be readable only by the current user """
+        password_file = Path(self._args[parameter])
         if not password_file.is_file():
-            raise ParameterException(f'''File [{self._args['password-file']}] doesn't exists''',
-                                     'password-file', self._backup_id, self.module_name())
+            raise ParameterException(f'''File [{self._args[parameter]}] doesn't exists''',
+                                     parameter, self._backup_id, self.module_name())
         if not os.access(password_file, os.R_OK):
-            raise ParameterException(f'''File [{self._args['password-file']}] is not readable''', 'password-file',
+            raise ParameterException(f'''File [{self._args[parameter]}] is not readable''', parameter,
                                      self._backup_id, self.module_name())
         password_file_stat = os.stat(password_file)
         if password_file_stat.st_mode & 0o077 != 0o0:
-            raise ParameterException(f'''File [{self._args['password-file']}] must not be readable from group and '''
-                                     'from others', 'password-file',
+            raise ParameterException(f'''File [{self._args[parameter]}] must not be readable from group and '''
+                                     'from others', parameter,
                                      self._backup_id, self.module_name())
         if password_file_stat.st_uid != os.getuid():
             raise ParameterException(
-                'File [' + self._args['password-file'] + '] is not owned by current user', 'password-file',
+                'File [' + self._args[parameter] + '] is not owned by current user', parameter,
                 self._backup_id, self.module_name())
-        self.password_file = password_file
+        return password_file
+
+
+class OpenSSLTransformer(AbstractPasswordTransformer):
+    defaultLevel = 6
+    validation_schema = {'type': 'object',
+                         'properties': {
+                             'password-file': AbstractPasswordTransformer.password_file_schema
+                         },
+                         'required': ['password-file'],
+                         'additionalProperties': False}
+
+    @staticmethod
+    def module_name() -> str:
+        return 'crypt'
+
+    def _get_params(self) -> None:
+        validate(self._args, self.validation_schema)
+
+        self.password_file = self._get_password_file()
 
     def _generate_backup_cmd(self) -> [str]:
         cmd = ['openssl', 'enc', '-e', '-aes-256-cbc', '-pbkdf2', '-kfile', str(self.password_file)]
@@ -98,3 +286,108 @@ class OpenSSLTransformer(AbstractTransformer):
     def _generate_restore_cmd(self) -> [str]:
         cmd = ['openssl', 'enc', '-d', '-aes-256-cbc', '-pbkdf2', '-kfile', str(self.password_file)]
         return cmd
+
+
+class AeadTransformer(AbstractPasswordTransformer, AbstractMultiThreadTransformer):
+    validation_schema = {'type': 'object',
+                         'properties': {
+                             'password-file': AbstractPasswordTransformer.password_file_schema,
+                             'public-key-files': {
+                                 'type': 'array',
+                                 'items': {'type': 'string'},
+                                 'minItems': 1,
+                                 'description': 'PEM files of the X25519 or RSA public keys the backup is encrypted '
+                                                'for, instead of a password. Any of their private keys restores it'},
+                             'private-key-file': {
+                                 'type': 'string',
+                                 'description': 'PEM file of the private key of one of the public keys, needed only '
+                                                'by the restoration'},
+                             'cipher': {
+                                 'type': 'string',
+                                 'enum': list(aead.ciphers),
+                                 'default': aead.defaultCipher,
+                                 'description': 'Authenticated cipher used, AES-256-GCM is the fastest with AES-NI, '
+                                                'ChaCha20-Poly1305 without'},
+                             'chunk-size': {
+                                 'type': 'integer',
+                                 'minimum': aead.minimumChunkSize,
+                                 'maximum': aead.maximumChunkSize,
+                                 'default': aead.defaultChunkSize,
+                                 'description': 'Size in bytes of chunks encrypted and authenticated alone'},
+                             'threads': AbstractMultiThreadTransformer.threads_schema
+                         },
+                         'additionalProperties': False}
+
+    @staticmethod
+    def module_name() -> str:
+        return 'aead'
+
+    def _get_params(self) -> None:
+        validate(self._args, self.validation_schema)
+        if not aead.is_available():
+            raise ParameterException('aead needs the cryptography package (pip install bashckup[aead])',
+                                     'cipher', self._backup_id, self.module_name())
+        if (self._args.get('password-file') is None) == (self._args.get('public-key-files') is None):
+            raise ParameterException('Either password-file or public-key-files must be set', 'password-file',
+                                     self._backup_id, self.module_name())
+        if self._args.get('private-key-file') is not None and self._args.get('public-key-files') is None:
+            raise ParameterException('private-key-file can be used only with public-key-files', 'private-key-file',
+                                     self._backup_id, self.module_name())
+
+        self.password_file = None
+        self.public_keys = None
+        self.private_key_file = None
+        if self._args.get('password-file') is not None:
+            self.password_file = self._get_password_file()
+        elif self._isBackup:
+            self.public_keys = [self._load_key(aead.load_public_key, 'public-key-files', Path(path))
+                                for path in self._args['public-key-files']]
+        elif self._args.get('private-key-file') is None:
+            raise ParameterException('private-key-file is needed to restore a backup encrypted for public keys',
+                                     'private-key-file', self._backup_id, self.module_name())
+        else:
+            self.private_key_file = self._get_password_file('private-key-file')
+        self.cipher = self._args.get('cipher', aead.defaultCipher)
+        self.chunkSize = self._args.get('chunk-size', aead.defaultChunkSize)
+        self.threads = self._get_threads()
+
+    def _load_key(self, load: Callable[[Path], object], parameter: str, path: Path) -> object:
+        if not path.is_file():
+            raise ParameterException(f'File [{path}] doesn\'t exists', parameter, self._backup_id, self.module_name())
+        try:
+            return load(path)
+        except aead.AeadError as e:
+            raise ParameterException(str(e), parameter, self._backup_id, self.module_name()) from None
+
+    def _run_in_process(self) -> bool:
+        # Only implemented by bashckup
+        return True
+
+    def _key_args(self) -> [str]:
+        if self.password_file is not None:
+            return [f'--kfile={self.password_file}']
+        if self.private_key_file is not None:
+            return [f'--private-key={self.private_key_file}']
+        return [f'--public-key={path}' for path in self._args['public-key-files']]
+
+    def _generate_backup_cmd(self) -> [str]:
+        return ['bashckup-aead', '-e', f'--cipher={self.cipher}', f'--chunk-size={self.chunkSize}',
+                f'--threads={self.threads}'] + self._key_args()
+
+    def _generate_restore_cmd(self) -> [str]:
+        return ['bashckup-aead', '-d', f'--threads={self.threads}'] + self._key_args()
+
+    def _password(self) -> bytes or None:
+        return aead.read_password(self.password_file) if self.password_file is not None else None
+
+    def _native_backup_target(self) -> Callable[[int, int], dict]:
+        return lambda in_fd, out_fd: aead.encrypt(in_fd, out_fd, self._password(), self.cipher, self.chunkSize,
+                                                  self.threads, public_keys=self.public_keys)
+
+    def _native_restore_target(self) -> Callable[[int, int], dict]:
+        def restore(in_fd: int, out_fd: int) -> dict:
+            private_key = self._load_key(aead.load_private_key, 'private-key-file', self.private_key_file) \
+                if self.private_key_file is not None else None
+            return aead.decrypt(in_fd, out_fd, self._password(), self.threads, private_key)
+
+        return restore
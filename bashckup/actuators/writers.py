@@ -1,19 +1,26 @@
+import json
 import logging
 import os
 import re
+import shlex
 import subprocess
 from abc import ABC
 from datetime import datetime
 from pathlib import Path
-from typing import IO, AnyStr, Any
+from typing import IO, AnyStr, Any, Callable, List
 
 from jsonschema.validators import validate
 
+from bashckup.actuators import native, dedup, delta, catalog, members, ssh
 from bashckup.actuators.actuators import CommandActuator
-from bashckup.actuators.exceptions import ParameterException, ModuleException
+from bashckup.actuators.exceptions import ParameterException, ModuleException, RunningException
+from bashckup.report import write_atomically
 
 datetimeOutputFileRegex = re.compile(r'^(\d+-\d+-\d+T\d+:\d+:\d+)')
 outputFileRegex = re.compile(r'^(\d+-\d+-\d+T\d+:\d+:\d+)-(.*)')
+shardSuffix = '.shard{}'  # Output file of each shard of a plan split by its reader, numbered from 1
+shardsManifestSuffix = '.shards'  # Output files and entries of the shards of a backup
+partialSuffix = '.part'  # Remote file being written, renamed once the backup succeeded
 
 
 class AbstractWriter(CommandActuator, ABC):
@@ -29,6 +36,33 @@ class AbstractWriter(CommandActuator, ABC):
             -> subprocess.Popen:
         return super().generate_restore_process(stdin, stdout)
 
+    def register_backup(self, success: bool, entries: List[dict]) -> None:
+        """
+        Records the backup, once it has run, for modules cleaning backups
+        :param entries: Parts of the catalog entry given by other actuators of the plan
+        """
+        pass
+
+    def end_run(self) -> None:
+        """ Called once post backups of the plan ran, even when they failed """
+        pass
+
+    def _check_no_output_file_index(self) -> None:
+        """ For writers without a local output file, rejects transformers writing an index next to it """
+        for (module, metadata) in self._metadata.get('transformer', {}).items():
+            if metadata.get('output-file-index') is not None:
+                raise ParameterException(f'''{metadata.get('output-file-index')} needs a writer of a local output '''
+                                         f'file (e.g. outputFile), not {self.module_name()}',
+                                         metadata.get('output-file-index'), self._backup_id, module)
+
+    def _check_no_output_directory_files(self) -> None:
+        """ For writers without a local output directory, rejects readers keeping files in it """
+        for (module, metadata) in self._metadata.get('reader', {}).items():
+            if metadata.get('output-directory-files') is not None:
+                raise ParameterException(f'''{module} with {metadata.get('output-directory-files')} needs a writer '''
+                                         f'with a local output directory (e.g. outputFile), not {self.module_name()}',
+                                         metadata.get('output-directory-files'), self._backup_id, module)
+
 
 class FileWriter(AbstractWriter):
     validation_schema = {'type': 'object',
@@ -38,7 +72,18 @@ class FileWriter(AbstractWriter):
                                  'description': 'Path to the output folder'},
                              'file-name': {
                                  'type': 'string',
-                                 'description': 'File name of the backup file'}
+                                 'description': 'File name of the backup file'},
+                             'full-backup-interval': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'description': 'Enables delta backups: only changes since the latest full backup are '
+                                                'written, and a full backup is written every N backups'},
+                             'delta-block-size': {
+                                 'type': 'integer',
+                                 'minimum': dedup.minimumAverageChunkSize,
+                                 'maximum': dedup.maximumAverageChunkSize,
+                                 'default': delta.defaultAverageBlockSize,
+                                 'description': 'Average size in bytes of blocks compared with the full backup'}
                          },
                          'required': ['path', 'file-name'],
                          'additionalProperties': False}
@@ -52,7 +97,21 @@ class FileWriter(AbstractWriter):
 
         self.path = Path(self._args['path'])
         self.file_name = self._args['file-name']
+        self.fullBackupInterval = self._args.get('full-backup-interval')
+        self.deltaBlockSize = self._args.get('delta-block-size', delta.defaultAverageBlockSize)
+        if self.fullBackupInterval is None and self._args.get('delta-block-size') is not None:
+            raise ParameterException('delta-block-size can be used only with full-backup-interval',
+                                     'delta-block-size', self._backup_id, self.module_name())
         self._output_folder = self.path
+        self._delta_base_path = None  # Full backup the delta is computed against, None when a full backup is written
+        self._shards_manifest_path = None
+        self._members_index = None  # Index of the members of the output file, when only some of them are restored
+        reader_shards = [v.get('shards') for (i, v) in self._metadata.get('reader', {}).items()
+                         if v.get('shards') is not None]
+        self._shards = reader_shards[0] if len(reader_shards) != 0 else None
+        if self._shards is not None and self.fullBackupInterval is not None:
+            raise ParameterException('full-backup-interval can not be used with shards of the reader',
+                                     'full-backup-interval', self._backup_id, self.module_name())
 
         # If folder doesn't exist, it will be created by _pre_run_tasks
         if self._output_folder.exists() and not self._output_folder.is_dir():
@@ -63,15 +122,25 @@ class FileWriter(AbstractWriter):
                                      self._backup_id, self.module_name())
 
     def _generate_backup_cmd(self) -> [str]:
-        cmd = ['cat']
+        if self.fullBackupInterval is None:
+            cmd = ['cat']
+        elif self._delta_base_path is None:
+            cmd = ['bashckup-delta-base', f'--block-size={self.deltaBlockSize}',
+                   f'--signature={self._output_file_path}{delta.signatureSuffix}']
+        else:
+            cmd = ['bashckup-delta', f'--block-size={self.deltaBlockSize}', f'--base={self._delta_base_path}']
         return cmd
 
     # Override because this module have a special way to managed process
     def generate_dry_run_backup_cmd(self) -> [str]:
+        if self.fullBackupInterval is not None:
+            return self._generate_backup_cmd() + ['>', str(self._output_file_path)]
         return ['>', str(self._output_file_path)]
 
     # Override because this module have a special way to managed process
     def generate_backup_process(self, stdin: IO[AnyStr], stdout: IO[AnyStr] = None) -> subprocess.Popen:
+        if self._shards is not None and self._shard_index == 0:
+            self._write_shards_manifest()
         try:
             file_descriptor = os.open(self._output_file_path, flags=os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode=0o600)
             with open(file_descriptor, 'w') as f:
@@ -91,26 +160,116 @@ class FileWriter(AbstractWriter):
             self._backup_datetime = datetime.today()
             self._file_prefix = self._backup_datetime.isoformat(timespec='seconds') + '-'
             self._output_file_path = self._output_folder / (self._file_prefix + self.file_name)
+            if self._shards is not None:
+                self._shards_manifest_path = self._output_folder / (self._file_prefix + self.file_name +
+                                                                    shardsManifestSuffix)
+                self._output_file_path = self._output_folder / (self._file_prefix + self.file_name +
+                                                                shardSuffix.format(self._shard_index + 1))
+            if self.fullBackupInterval is not None:
+                self._delta_base_path = self._get_delta_base()
+                if self._delta_base_path is not None:
+                    self._output_file_path = self._output_folder / (self._file_prefix + self.file_name +
+                                                                    delta.deltaSuffix)
         else:
             latest_backup = self._get_latest_backup_file()
             self._backup_datetime = latest_backup['backup-datetime']
             self._file_prefix = self._backup_datetime.isoformat(timespec='seconds') + '-'
             self._output_file_path = latest_backup['file-path']
+            if self._shards is not None:
+                self._shards_manifest_path = Path(latest_backup['file-path'])
+                self._output_file_path = self._output_folder / self._read_shards_manifest()[self._shard_index]['file']
+            self._members_index = self._get_members_index()
 
     def _generate_metadata(self) -> dict:
         return {'output-directory': str(self._output_folder), 'file-prefix': self._file_prefix,
+                'file-name': self.file_name, 'output-file': str(self._output_file_path),
                 'backup-datetime': self._backup_datetime.isoformat(timespec='seconds')}
 
+    def _write_shards_manifest(self) -> None:
+        shards = [{'file': self._file_prefix + self.file_name + shardSuffix.format(index + 1), 'entries': entries}
+                  for (index, entries) in enumerate(self._shards)]
+        write_atomically(self._shards_manifest_path, json.dumps({'shards': shards}, indent=1))
+
+    def _read_shards_manifest(self) -> List[dict]:
+        try:
+            with open(self._shards_manifest_path, 'r') as f:
+                shards = json.load(f)['shards']
+        except (OSError, ValueError, KeyError) as e:
+            raise ModuleException(f'Manifest of shards [{self._shards_manifest_path}] is unreadable: {e}',
+                                  self._backup_id, self.module_name()) from e
+        if len(shards) != len(self._shards):
+            raise ModuleException(f'Backup [{self._shards_manifest_path}] has {len(shards)} shards, the reader '
+                                  f'expects {len(self._shards)}', self._backup_id, self.module_name())
+        return shards
+
+    def catalog_entry(self) -> dict:
+        files = [self._output_file_path.name]
+        if self._shards is not None and self._shard_index == 0:
+            files.append(self._shards_manifest_path.name)
+        if self.fullBackupInterval is not None and self._delta_base_path is None:
+            files.append(self._output_file_path.name + delta.signatureSuffix)
+        if self._delta_base_path is None:
+            return {'files': files}
+        return {'files': files, 'depends-on': [datetimeOutputFileRegex.search(self._delta_base_path.name).group(1)]}
+
+    def register_backup(self, success: bool, entries: List[dict]) -> None:
+        # Catalog is created by modules using it, e.g. cleanFolder
+        if not catalog.Catalog(self._output_folder).exists():
+            return
+        parts = entries + [self.catalog_entry()]
+        # Files are missing when the backup failed before writing them
+        files = [f for part in parts for f in part.get('files', []) if (self._output_folder / f).exists()]
+        try:
+            with catalog.Catalog(self._output_folder).update() as backups:
+                backups.add({'datetime': self._backup_datetime.isoformat(timespec='seconds'), 'name': self.file_name,
+                             'files': files,
+                             'depends-on': sorted({d for part in parts for d in part.get('depends-on', [])}),
+                             'success': success})
+        except catalog.CatalogError as e:
+            raise RunningException(str(e)) from e
+
+    def _get_delta_base(self) -> Path or None:
+        """
+        :returns: Latest full backup with a signature, None if a full backup has to be written (no full backup, or
+        full-backup-interval reached)
+        """
+        bases = {}
+        deltas = []
+        with os.scandir(self._output_folder) as it:
+            entry: os.DirEntry
+            for entry in it:
+                matches = outputFileRegex.search(entry.name)
+                if matches is None or len(matches.groups()) != 2:
+                    continue
+                if matches.group(2) == self.file_name + delta.signatureSuffix:
+                    bases[datetime.fromisoformat(matches.group(1))] = self._output_folder / (
+                        entry.name[:-len(delta.signatureSuffix)])
+                elif matches.group(2) == self.file_name + delta.deltaSuffix:
+                    deltas.append(datetime.fromisoformat(matches.group(1)))
+        if len(bases) == 0:
+            return None
+        latest_base_datetime = max(bases)
+        if not bases[latest_base_datetime].is_file():
+            return None
+        if len([d for d in deltas if d > latest_base_datetime]) + 1 >= self.fullBackupInterval:
+            return None
+        return bases[latest_base_datetime]
+
     def _get_latest_backup_file(self) -> {Any}:
         latest_backup_path = None
         latest_backup_datetime = None
+        # Deltas are restored with their base
+        file_names = [self.file_name] if self.fullBackupInterval is None else [self.file_name,
+                                                                               self.file_name + delta.deltaSuffix]
+        if self._shards is not None:
+            file_names = [self.file_name + shardsManifestSuffix]
         with os.scandir(self._output_folder) as it:
             entry: os.DirEntry
             for entry in it:
                 matches = outputFileRegex.search(entry.name)
                 if matches is None or len(matches.groups()) != 2:
                     continue
-                if matches.group(2) != self.file_name:
+                if matches.group(2) not in file_names:
                     continue
                 current_backup_datetime = datetime.fromisoformat(matches.group(1))
                 if latest_backup_datetime is None or latest_backup_datetime < current_backup_datetime:
@@ -122,7 +281,295 @@ class FileWriter(AbstractWriter):
 
         return {'file-path': latest_backup_path, 'backup-datetime': latest_backup_datetime}
 
+    def _get_members_index(self) -> dict or None:
+        """
+        :returns: Index of the members of the output file when only some members are restored, None if the whole file
+        has to be read
+        """
+        selected = [v.get('members') for (i, v) in self._metadata.get('reader', {}).items()
+                    if v.get('members') is not None]
+        if len(selected) == 0:
+            return None
+        index_path = Path(str(self._output_file_path) + members.indexSuffix)
+        if not index_path.is_file():
+            logging.warning('WARNING: [%s] has no index of its members, the whole backup is read', index_path.name)
+            return None
+        try:
+            index = members.read_index(index_path)
+        except members.MembersError as e:
+            raise ModuleException(str(e), self._backup_id, self.module_name()) from e
+        # Index describes the output of gzip, which is not the output file when it is transformed after gzip
+        if index['members'] is None or index['compressed-size'] != os.path.getsize(self._output_file_path):
+            logging.warning('WARNING: Index [%s] does not describe the output file, the whole backup is read',
+                            index_path.name)
+            return None
+        index['selected'] = selected[0]
+        return index
+
     def _generate_restore_cmd(self) -> [str]:
+        if str(self._output_file_path).endswith(delta.deltaSuffix):
+            return ['bashckup-delta-restore', self._output_file_path]
+        if self._members_index is not None:
+            return ['bashckup-extract-members', f'--index={self._output_file_path}{members.indexSuffix}',
+                    str(self._output_file_path)]
         cmd = ['cat', self._output_file_path]
 
         return cmd
+
+    # Override because data is always moved by bashckup, it saves a 'cat' process and a copy of the data
+    def _run_in_process(self) -> bool:
+        return True
+
+    def _native_backup_target(self) -> Callable[[int, int], dict or None]:
+        # Output file is given as output file descriptor by generate_backup_process
+        def backup(in_fd: int, out_fd: int) -> dict or None:
+            native.enlarge_pipe(in_fd)
+            if self.fullBackupInterval is None:
+                native.transfer_stream(in_fd, out_fd)
+            elif self._delta_base_path is None:
+                return delta.write_base(in_fd, out_fd, Path(f'{self._output_file_path}{delta.signatureSuffix}'),
+                                        self.deltaBlockSize, self._threads)
+            else:
+                return delta.write_delta(in_fd, out_fd, self._delta_base_path, self.deltaBlockSize, self._threads)
+
+        return backup
+
+    def _native_restore_target(self) -> Callable[[int, int], dict or None]:
+        def restore(in_fd: int, out_fd: int) -> dict or None:
+            native.enlarge_pipe(out_fd)
+            if str(self._output_file_path).endswith(delta.deltaSuffix):
+                delta.restore_delta(Path(self._output_file_path), out_fd)
+                return
+            if self._members_index is not None:
+                return members.extract_members(Path(self._output_file_path), self._members_index,
+                                               self._members_index['selected'], out_fd)
+            file_descriptor = os.open(self._output_file_path, os.O_RDONLY)
+            try:
+                native.transfer_stream(file_descriptor, out_fd)
+            finally:
+                os.close(file_descriptor)
+
+        return restore
+
+
+class DedupStoreWriter(FileWriter):
+    validation_schema = {'type': 'object',
+                         'properties': {
+                             'path': FileWriter.validation_schema['properties']['path'],
+                             'file-name': {
+                                 'type': 'string',
+                                 'description': 'File name of the manifest of the backup'},
+                             'average-chunk-size': {
+                                 'type': 'integer',
+                                 'minimum': dedup.minimumAverageChunkSize,
+                                 'maximum': dedup.maximumAverageChunkSize,
+                                 'default': dedup.defaultAverageChunkSize,
+                                 'description': 'Average size in bytes of chunks. Smaller chunks find more duplicated '
+                                                'data, but there are more files in the store'},
+                             'compression-level': {
+                                 'type': 'integer',
+                                 'minimum': 0,
+                                 'maximum': 9,
+                                 'default': dedup.defaultCompressionLevel,
+                                 'description': 'Gzip compression level of chunks, from 0 (no compression) to 9 (best '
+                                                'compression)'},
+                             'threads': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'description': 'Number of processes splitting the stream and threads storing chunks. '
+                                                'By default, CPUs are shared between backups run at the same time '
+                                                '(see --jobs)'}
+                         },
+                         'required': ['path', 'file-name'],
+                         'additionalProperties': False}
+
+    @staticmethod
+    def module_name() -> str:
+        return 'dedupStore'
+
+    def _get_params(self) -> None:
+        super()._get_params()
+        self.averageChunkSize = self._args.get('average-chunk-size', dedup.defaultAverageChunkSize)
+        self.compressionLevel = self._args.get('compression-level', dedup.defaultCompressionLevel)
+        self.threads = self._args.get('threads', self._threads)
+        self._store = self._output_folder / dedup.storeFolderName
+        # Indexes of compressed streams do not apply to chunks
+        self._check_no_output_file_index()
+
+    def _generate_backup_cmd(self) -> [str]:
+        return ['bashckup-dedup-store', f'--average-chunk-size={self.averageChunkSize}',
+                f'--compression-level={self.compressionLevel}', f'--store={self._store}']
+
+    def generate_dry_run_backup_cmd(self) -> [str]:
+        return self._generate_backup_cmd() + ['>', str(self._output_file_path)]
+
+    def _generate_restore_cmd(self) -> [str]:
+        return ['bashckup-dedup-restore', f'--store={self._store}', str(self._output_file_path)]
+
+    def end_run(self) -> None:
+        # Chunks of manifests removed (e.g. by cleanFolder of this run) are removed
+        if self._isBackup and self._dry_run is False:
+            try:
+                removed = dedup.collect_garbage(self._output_folder, self._store)
+            except OSError as e:
+                raise RunningException(f'Unable to remove unused chunks of [{self._store}].\nReason: {e}') from e
+            if removed != 0:
+                logging.info('%d unused chunks removed from [%s]', removed, str(self._store))
+
+    def _native_backup_target(self) -> Callable[[int, int], dict]:
+        # Manifest file is given as output file descriptor by generate_backup_process
+        def backup(in_fd: int, out_fd: int) -> dict:
+            native.enlarge_pipe(in_fd)
+            # The store is locked until the manifest lists all chunks written
+            with dedup.lock_store(self._store, exclusive=False), os.fdopen(out_fd, 'wb', closefd=False) as manifest:
+                return dedup.store_stream(in_fd, manifest, self._store, self.averageChunkSize,
+                                          self.compressionLevel, self.threads)
+
+        return backup
+
+    def _native_restore_target(self) -> Callable[[int, int], None]:
+        def restore(in_fd: int, out_fd: int) -> None:
+            native.enlarge_pipe(out_fd)
+            dedup.restore_stream(Path(self._output_file_path), self._store, out_fd, self.threads)
+
+        return restore
+
+
+class SshFileWriter(AbstractWriter):
+    validation_schema = {'type': 'object',
+                         'properties': {
+                             'host': {
+                                 'type': 'string',
+                                 'description': 'Remote host (name, IP address or alias of the SSH configuration)'},
+                             'user': {
+                                 'type': 'string',
+                                 'description': 'Username to use to log in'},
+                             'port': {
+                                 'type': 'integer',
+                                 'minimum': 1,
+                                 'maximum': 65535,
+                                 'description': 'SSH port of the remote host'},
+                             'identity-file': {
+                                 'type': 'string',
+                                 'description': 'Private key used to log in'},
+                             'path': {
+                                 'type': 'string',
+                                 'description': 'Path to the output folder on the remote host'},
+                             'file-name': FileWriter.validation_schema['properties']['file-name'],
+                             'control-persist': {
+                                 'type': 'integer',
+                                 'minimum': 0,
+                                 'default': ssh.defaultControlPersist,
+                                 'description': 'Seconds the SSH connection is kept open once idle, so plans and '
+                                                'next runs reuse it. 0 opens a connection by command'}
+                         },
+                         'required': ['host', 'path', 'file-name'],
+                         'additionalProperties': False}
+
+    @staticmethod
+    def module_name() -> str:
+        return 'sshFile'
+
+    def _get_params(self) -> None:
+        validate(self._args, self.validation_schema)
+
+        self.host = self._args['host']
+        self.user = self._args.get('user')
+        self.port = self._args.get('port')
+        self.identity_file = self._args.get('identity-file')
+        self.path = self._args['path']
+        self.file_name = self._args['file-name']
+        self.controlPersist = self._args.get('control-persist', ssh.defaultControlPersist)
+        self._multiplexed = False
+        self._check_no_output_file_index()
+        self._check_no_output_directory_files()
+        if len([v for (i, v) in self._metadata.get('reader', {}).items() if v.get('shards') is not None]) != 0:
+            raise ParameterException('Shards of the reader can not be written on a remote host', 'path',
+                                     self._backup_id, self.module_name())
+        if self.identity_file is not None and not Path(self.identity_file).is_file():
+            raise ParameterException(f'''File [{self.identity_file}] doesn't exists''', 'identity-file',
+                                     self._backup_id, self.module_name())
+
+    def _destination(self) -> str:
+        return self.host if self.user is None else f'{self.user}@{self.host}'
+
+    def _base_ssh_cmd(self) -> [str]:
+        cmd = ['ssh', '-o', 'BatchMode=yes']
+        if self.port is not None:
+            cmd.extend(['-p', str(self.port)])
+        if self.identity_file is not None:
+            cmd.extend(['-i', self.identity_file])
+        return cmd
+
+    def _ssh_cmd(self, remote_cmd: str) -> [str]:
+        """ :returns: SSH command to run a command on the remote host, through the master connection if any """
+        control_options = ssh.control_options() if self._multiplexed else []
+        return self._base_ssh_cmd() + control_options + [self._destination(), '--', remote_cmd]
+
+    def _run_ssh(self, remote_cmd: str) -> str:
+        """ :returns: Output of a command run on the remote host """
+        process = subprocess.run(self._ssh_cmd(remote_cmd), capture_output=True, shell=False, text=True,
+                                 stdin=subprocess.DEVNULL)
+        if process.returncode != 0:
+            raise ModuleException(f'Error during execution of ssh on [{self.host}]\n'
+                                  f'SSH output: {process.stderr}\n'
+                                  f'''Command executed: {' '.join(process.args)}''', self._backup_id,
+                                  self.module_name())
+        return process.stdout
+
+    def _pre_run_tasks(self) -> None:
+        if self.controlPersist != 0 and self._dry_run is False:
+            try:
+                if ssh.open_master(self._base_ssh_cmd(), self._destination(), self.controlPersist):
+                    logging.info('SSH connection to [%s] opened', self._destination())
+            except ssh.SshError as e:
+                raise ModuleException(str(e), self._backup_id, self.module_name()) from None
+            self._multiplexed = True
+        if self._isBackup:
+            self._backup_datetime = datetime.today()
+            self._file_prefix = self._backup_datetime.isoformat(timespec='seconds') + '-'
+            self._output_file_path = os.path.join(self.path, self._file_prefix + self.file_name)
+        else:
+            latest_backup = self._get_latest_backup_file()
+            self._backup_datetime = latest_backup['backup-datetime']
+            self._file_prefix = self._backup_datetime.isoformat(timespec='seconds') + '-'
+            self._output_file_path = latest_backup['file-path']
+
+    def _generate_metadata(self) -> dict:
+        # No output-directory: nothing is written on the local host
+        return {'file-prefix': self._file_prefix, 'file-name': self.file_name,
+                'backup-datetime': self._backup_datetime.isoformat(timespec='seconds')}
+
+    def _get_latest_backup_file(self) -> {Any}:
+        backups = {}
+        for name in self._run_ssh(f'ls -1 -- {shlex.quote(self.path)}').splitlines():
+            matches = outputFileRegex.search(name)
+            if matches is not None and matches.group(2) == self.file_name:
+                backups[datetime.fromisoformat(matches.group(1))] = name
+        if len(backups) == 0:
+            raise ParameterException(f'''path [{self.path}] of [{self.host}] does not contains any backup''',
+                                     'path', self._backup_id, self.module_name())
+        latest_backup_datetime = max(backups)
+        return {'file-path': os.path.join(self.path, backups[latest_backup_datetime]),
+                'backup-datetime': latest_backup_datetime}
+
+    def _generate_backup_cmd(self) -> [str]:
+        # Backup is written in a partial file, renamed by register_backup once all processes succeeded
+        partial_file = shlex.quote(self._output_file_path + partialSuffix)
+        return self._ssh_cmd(f'mkdir -p -- {shlex.quote(self.path)} && cat > {partial_file}')
+
+    def _generate_restore_cmd(self) -> [str]:
+        return self._ssh_cmd(f'cat -- {shlex.quote(self._output_file_path)}')
+
+    def catalog_entry(self) -> dict:
+        return {'files': [os.path.basename(self._output_file_path)]}
+
+    def register_backup(self, success: bool, entries: List[dict]) -> None:
+        partial_file = shlex.quote(self._output_file_path + partialSuffix)
+        try:
+            if success:
+                self._run_ssh(f'mv -- {partial_file} {shlex.quote(self._output_file_path)}')
+            else:
+                self._run_ssh(f'rm -f -- {partial_file}')
+        except ModuleException as e:
+            raise RunningException(e.message) from e
@@ -4,7 +4,9 @@ import datetime
 import logging
 import os
 import sys
+import threading
 import time
+from pathlib import Path
 
 import yaml
 from jsonschema import validate
@@ -14,6 +16,11 @@ from yaml.loader import SafeLoader
 
 from bashckup.actuators.actuators_factories import ActuatorFactory
 from bashckup.actuators.exceptions import UserException, RunningException
+from bashckup.actuators.writers import AbstractWriter
+from bashckup.pipeline import Pipeline
+from bashckup.report import write_json_report, write_openmetrics
+from bashckup.scheduler import Scheduler, read_durations, write_durations
+from bashckup.sync_stage import PostBackupStage, SyncStage
 
 yaml_schema = """
 type: array
@@ -25,6 +32,16 @@ items:
     id:
       type: string
       pattern: '[a-zA-Z0-9]+'
+    parallel:
+      type: boolean
+      default: true
+      description: 'Can this backup run at the same time as other backups (see --jobs) ?'
+    resources:
+      type: array
+      items:
+        type: string
+      description: 'Resources used by this backup (source device, database host, destination directory...). Number of
+        backups running at the same time on a resource is limited (see --resource-limit)'
     reader:
       type: object
       minProperties: 1
@@ -171,29 +188,45 @@ def read_config_from_cli(parameters: argparse.Namespace):
     return result
 
 
+def prepare_pipeline(global_context: dict, current_backup: dict) -> (dict, dict):
+    """
+    Builds the reader, the transformers and the writer of a backup
+    :returns: Modules and their metadata
+    """
+    metadata = {}
+    modules = {}
+
+    reader = ActuatorFactory().build_reader(global_context, current_backup['reader'], metadata)
+    modules.update({'reader': reader})
+    metadata.update(reader.prepare_module())
+
+    if current_backup.get('transformers') is not None:
+        for transformer in current_backup['transformers']:
+            trans = ActuatorFactory().build_transformer(global_context, transformer, metadata)
+            transformers = modules.get('transformers', [])
+            transformers.append(trans)
+            modules.update({'transformers': transformers})
+            metadata.update(trans.prepare_module())
+
+    writer = ActuatorFactory().build_writer(global_context, current_backup['writer'], metadata)
+    modules.update({'writer': writer})
+    metadata.update(writer.prepare_module())
+    return modules, metadata
+
+
 def prepare(global_parameters: dict, configurations: dict) -> dict:
     result = {}
     for current_backup in configurations:
-        metadata = {}
-        modules = {}
-
         global_context = {**global_parameters, **{'backup-id': current_backup['id']}}
 
-        reader = ActuatorFactory().build_reader(global_context, current_backup['reader'], metadata)
-        modules.update({'reader': reader})
-        metadata.update(reader.prepare_module())
-
-        if current_backup.get('transformers') is not None:
-            for transformer in current_backup['transformers']:
-                trans = ActuatorFactory().build_transformer(global_context, transformer, metadata)
-                transformers = modules.get('transformers', [])
-                transformers.append(trans)
-                modules.update({'transformers': transformers})
-                metadata.update(trans.prepare_module())
-
-        writer = ActuatorFactory().build_writer(global_context, current_backup['writer'], metadata)
-        modules.update({'writer': writer})
-        metadata.update(writer.prepare_module())
+        (modules, metadata) = prepare_pipeline(global_context, current_backup)
+        # When the reader splits the backup in shards, each shard has its own pipeline
+        pipelines = [modules]
+        shards = modules['reader'].shards()
+        if shards is not None:
+            for shard_index in range(1, len(shards)):
+                shard_context = {**global_context, 'shard-index': shard_index, 'shards': shards}
+                pipelines.append(prepare_pipeline(shard_context, current_backup)[0])
 
         if current_backup.get('post-backup') is not None:
             for post_backup in current_backup['post-backup']:
@@ -203,153 +236,269 @@ def prepare(global_parameters: dict, configurations: dict) -> dict:
                 modules.update({'post-backup': post_backups})
                 metadata.update(post_bck.prepare_module())
 
-        result.update({current_backup['id']: {'modules': modules, 'metadata': metadata}})
+        result.update({current_backup['id']: {'modules': modules, 'metadata': metadata, 'pipelines': pipelines,
+                                              'parallel': current_backup.get('parallel', True),
+                                              'resources': current_backup.get('resources', [])}})
 
     return result
 
 
+# Backup id of the plan run by the current thread, used to prefix logs when plans run in parallel
+_log_context = threading.local()
+
+
+class BackupIdLogFilter(logging.Filter):
+    """ Adds 'backup_id' attribute to log records, based on the plan run by the current thread """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.backup_id = getattr(_log_context, 'backup_id', None) or '-'
+        return True
+
+
 def run_backup_plans(global_parameters: dict, backup_plans: dict) -> bool:
     """
+    Runs backup plans, up to 'jobs' plans at the same time, see Scheduler.
     :returns: True if no errors appear during the backup, otherwise False.
     """
+    durations_file = global_parameters.get('durations-file')
+    durations = read_durations(durations_file) if durations_file is not None else {}
+    scheduler = Scheduler(global_parameters.get('jobs', 1), global_parameters.get('resource-limits'), durations)
+
+    report_file = global_parameters.get('report-file')
+    metrics_file = global_parameters.get('metrics-file')
+    report = {} if (report_file is not None or metrics_file is not None) and global_parameters['dry-run'] is False \
+        else None
+    # Post backups run while next plans are backed up
+    post_backup_stage = PostBackupStage() if global_parameters['dry-run'] is False else None
+    error = scheduler.run(backup_plans, lambda backup_id, backup_plan: run_backup_plan(global_parameters, backup_id,
+                                                                                       backup_plan, report,
+                                                                                       post_backup_stage))
+    if post_backup_stage is not None and post_backup_stage.wait() is True:
+        error = True
+        if report is not None:
+            for backup_id in post_backup_stage.failed:
+                report[backup_id]['success'] = False
+
+    if durations_file is not None and global_parameters['dry-run'] is False:
+        write_durations(durations_file, scheduler.durations)
+    if report is not None and report_file is not None:
+        write_json_report(report_file, 'backup', report)
+    if report is not None and metrics_file is not None:
+        write_openmetrics(metrics_file, report)
+    return error
+
+
+def run_backup_plan(global_parameters: dict, backup_id: str, backup_plan: dict, report: dict = None,
+                    post_backup_stage: PostBackupStage = None) -> bool:
+    """
+    :param report: If set, metrics of the backup are added to it
+    :param post_backup_stage: If set, post backups are given to it instead of being run by the plan
+    :returns: True if errors appear during the backup, otherwise False.
+    """
     error = False
-    for (backup_id, backup_plan) in backup_plans.items():
-        try:
-            logging.info('=== Backup %s ===', backup_id)
-
-            #
-            # Backup
-            #
-            if global_parameters['dry-run'] is False:
-                processes = []  # Store all processes to be able to retrieve errors
-                try:
-                    logging.info('= Run reader %s =', backup_plan['modules']['reader'].module_name())
-                    processes.append(backup_plan['modules']['reader'].generate_backup_process())
-                    if backup_plan['modules'].get('transformers') is not None:
-                        for transformer in backup_plan['modules']['transformers']:
+    _log_context.backup_id = backup_id
+    starting_time = time.time()
+    plan_report = {'start': datetime.datetime.fromtimestamp(starting_time).isoformat(timespec='seconds'),
+                   'stages': [], 'post-backup': {}}
+    try:
+        logging.info('=== Backup %s ===', backup_id)
+
+        #
+        # Backup
+        #
+        if global_parameters['dry-run'] is False:
+            # Pipelines of shards run at the same time
+            pipelines = []
+            started = False
+            try:
+                for modules in backup_plan['pipelines']:
+                    pipeline = Pipeline(metered=report is not None)
+                    pipelines.append(pipeline)
+                    logging.info('= Run reader %s =', modules['reader'].module_name())
+                    reader = modules['reader']
+                    pipeline.start('reader', reader, reader.generate_backup_process)
+                    if modules.get('transformers') is not None:
+                        for transformer in modules['transformers']:
                             logging.info('= Run transformer %s =', transformer.module_name())
-                            previous_process = processes[-1]
-                            processes.append(transformer.generate_backup_process(previous_process.stdout))
-                            previous_process.stdout.close()  # Allow previous process to receive a SIGPIPE
-
-                    previous_process = processes[-1]
-                    logging.info('= Run writer %s =', backup_plan['modules']['writer'].module_name())
-                    processes.append(backup_plan['modules']['writer'].generate_backup_process(previous_process.stdout))
-                    previous_process.stdout.close()  # Allow previous process to receive a SIGPIPE
-                finally:
-                    for process in processes:
-                        return_code = process.wait()
-                        if return_code != 0:
-                            error = True
-                            logging.error('ERROR: Error during execution of backup\n'
-                                          f'Command output: {process.stderr.read().decode(sys.getdefaultencoding())}\n'
-                                          f'''Command executed: {' '.join(process.args)}'''
-                                          f'Error code: {return_code}')
-                        else:
-                            stderr = process.stderr.read().decode(sys.getdefaultencoding())
-                            if stderr != '':
-                                logging.debug(stderr)
-                        if process.stderr is not None:
-                            process.stderr.close()
-                        if process.stdout is not None:
-                            process.stdout.close()
-            else:  # Dry run
+                            pipeline.start('transformer', transformer, transformer.generate_backup_process)
+
+                    logging.info('= Run writer %s =', modules['writer'].module_name())
+                    writer = modules['writer']
+                    pipeline.start('writer', writer, writer.generate_backup_process)
+                started = True
+            finally:
+                for pipeline in pipelines:
+                    if pipeline.wait() is True:
+                        error = True
+                if report is not None:
+                    plan_report['stages'] = [stage for pipeline in pipelines for stage in pipeline.metrics()]
+                for modules in backup_plan['pipelines']:
+                    stages = [modules['reader']] + modules.get('transformers', [])
+                    for module in stages:
+                        module.end_backup(started and not error)
+                    # Failed backups are recorded too, so they can be cleaned
+                    if started:
+                        modules['writer'].register_backup(not error, [m.catalog_entry() for m in stages])
+        else:  # Dry run
+            for modules in backup_plan['pipelines']:
                 cmd = []
-                cmd.extend(backup_plan['modules']['reader'].generate_dry_run_backup_cmd())
-                if backup_plan['modules'].get('transformers') is not None:
-                    for transformer in backup_plan['modules']['transformers']:
+                cmd.extend(modules['reader'].generate_dry_run_backup_cmd())
+                if modules.get('transformers') is not None:
+                    for transformer in modules['transformers']:
                         cmd.append('|')
                         cmd.extend(transformer.generate_dry_run_backup_cmd())
 
                 cmd.append('|')
-                cmd.extend(backup_plan['modules']['writer'].generate_dry_run_backup_cmd())
+                cmd.extend(modules['writer'].generate_dry_run_backup_cmd())
                 logging.info(f'''Command [{' '.join(cmd)}] would have been ran.''')
-            #
-            # Post backup
-            #
-            if backup_plan['modules'].get('post-backup') is not None:
-                logging.info('== Post backup ==')
-                for post_backup in backup_plan['modules']['post-backup']:
-                    logging.info('= Run post backup %s =', post_backup.module_name())
-                    # TODO manage return code and errors
-                    post_backup.run_backup()
-        except (UserException, RunningException) as e:
+        #
+        # Post backup
+        #
+        post_backups = backup_plan['modules'].get('post-backup', [])
+        if len(post_backups) != 0:
+            logging.info('== Post backup ==')
+        # The writer ends its run after post backups (e.g. chunks of the store freed by cleanFolder are removed)
+        writer = backup_plan['modules']['writer']
+        if post_backup_stage is not None:
+            if len(post_backups) != 0:
+                logging.info('= Post backups run in background =')
+
+            def run_in_background() -> bool:
+                _log_context.backup_id = backup_id
+                return run_post_backups(post_backups, writer, backup_id, plan_report, post_backup_stage.sync_stage)
+
+            post_backup_stage.submit(backup_id, output_directories(backup_plan), run_in_background)
+        elif run_post_backups(post_backups, writer, backup_id, plan_report) is True:
             error = True
-            logging.error(str(e))
+    except (UserException, RunningException) as e:
+        error = True
+        logging.error(str(e))
+    finally:
+        _log_context.backup_id = None
+        if report is not None:
+            plan_report.update({'end-timestamp': time.time(), 'duration': time.time() - starting_time,
+                                'success': not error})
+            report[backup_id] = plan_report
+    return error
+
+
+def output_directories(backup_plan: dict) -> [str]:
+    """ :returns: Output directories written by the plan, its post backups are run in order with other plans' ones """
+    return sorted({os.path.realpath(metadata.get('output-directory'))
+                   for metadata in backup_plan['metadata'].get('writer', {}).values()
+                   if metadata.get('output-directory') is not None})
+
+
+def run_post_backups(post_backups: list, writer: AbstractWriter, backup_id: str, plan_report: dict,
+                     sync_stage: SyncStage = None) -> bool:
+    """
+    Runs post backups of a plan one after the other, next ones are not run once one failed, then ends the run of the
+    writer
+    :param sync_stage: If set, batched post backups are run by it, with the ones of other plans
+    :returns: True if errors appear during the post backups, otherwise False.
+    """
+    error = False
+    try:
+        for post_backup in post_backups:
+            if sync_stage is not None and post_backup.batched():
+                logging.info('= Post backup %s batched with other plans =', post_backup.module_name())
+                metrics = sync_stage.submit(backup_id, post_backup).result()
+            else:
+                logging.info('= Run post backup %s =', post_backup.module_name())
+                metrics = post_backup.run_backup()
+            plan_report['post-backup'][post_backup.module_name()] = metrics
+    except (UserException, RunningException) as e:
+        logging.error(str(e))
+        error = True
+    try:
+        writer.end_run()
+    except (UserException, RunningException) as e:
+        logging.error(str(e))
+        error = True
     return error
 
 
 def run_restoration_plans(global_parameters: dict, backup_plans: dict) -> bool:
     """
+    Runs restoration plans, up to 'jobs' plans at the same time, see Scheduler.
     :returns: True if no errors appear during the restoration, otherwise False.
     """
+    scheduler = Scheduler(global_parameters.get('jobs', 1), global_parameters.get('resource-limits'))
+    report_file = global_parameters.get('report-file')
+    report = {} if report_file is not None and global_parameters['dry-run'] is False else None
+    error = scheduler.run(backup_plans, lambda backup_id, backup_plan: run_restoration_plan(global_parameters,
+                                                                                            backup_id, backup_plan,
+                                                                                            report))
+    if report is not None:
+        write_json_report(report_file, 'restore', report)
+    return error
+
+
+def run_restoration_plan(global_parameters: dict, backup_id: str, backup_plan: dict, report: dict = None) -> bool:
+    """
+    :param report: If set, metrics of the restoration are added to it
+    :returns: True if errors appear during the restoration, otherwise False.
+    """
     error = False
-    for (backup_id, backup_plan) in backup_plans.items():
-        try:
-            logging.info('=== Restoration backup %s ===', backup_id)
-
-            #
-            # Post backup
-            #
-            if backup_plan['modules'].get('post-backup') is not None:
-                logging.info('== Post backup ==')
-                for post_backup in backup_plan['modules']['post-backup'].reverse():
-                    logging.info('= Run post backup %s =', post_backup.module_name())
-                    # TODO manage return code and errors
-                    post_backup.run_restore()
-
-            #
-            # Backup
-            #
-            if global_parameters['dry-run'] is False:
-                processes = []  # Store all processes to be able to retrieve errors
-                try:
-                    logging.info('= Run writer %s =', backup_plan['modules']['writer'].module_name())
-                    processes.append(backup_plan['modules']['writer'].generate_restore_process())
-
-                    if backup_plan['modules'].get('transformers') is not None:
-                        for transformer in backup_plan['modules']['transformers'].reverse():
+    _log_context.backup_id = backup_id
+    try:
+        logging.info('=== Restoration backup %s ===', backup_id)
+
+        #
+        # Post backup
+        #
+        if backup_plan['modules'].get('post-backup') is not None:
+            logging.info('== Post backup ==')
+            for post_backup in reversed(backup_plan['modules']['post-backup']):
+                logging.info('= Run post backup %s =', post_backup.module_name())
+                # TODO manage return code and errors
+                post_backup.run_restore()
+
+        #
+        # Backup
+        #
+        if global_parameters['dry-run'] is False:
+            # Pipelines of shards run at the same time
+            pipelines = []
+            try:
+                for modules in backup_plan['pipelines']:
+                    pipeline = Pipeline(metered=report is not None)
+                    pipelines.append(pipeline)
+                    logging.info('= Run writer %s =', modules['writer'].module_name())
+                    writer = modules['writer']
+                    pipeline.start('writer', writer, writer.generate_restore_process)
+
+                    if modules.get('transformers') is not None:
+                        for transformer in reversed(modules['transformers']):
                             logging.info('= Run transformer %s =', transformer.module_name())
-                            previous_process = processes[-1]
-                            processes.append(transformer.generate_restore_process(previous_process.stdout))
-                            previous_process.stdout.close()  # Allow previous process to receive a SIGPIPE
-
-                    previous_process = processes[-1]
-                    logging.info('= Run reader %s =', backup_plan['modules']['reader'].module_name())
-                    processes.append(backup_plan['modules']['reader'].generate_restore_process(previous_process.stdout))
-                    previous_process.stdout.close()  # Allow previous process to receive a SIGPIPE
-
-                finally:
-                    for process in processes:
-                        return_code = process.wait()
-                        if return_code != 0:
-                            error = True
-                            logging.error('ERROR: Error during execution of backup\n'
-                                          f'Command output: {process.stderr.read().decode(sys.getdefaultencoding())}\n'
-                                          f'''Command executed: {' '.join(process.args)}'''
-                                          f'Error code: {return_code}')
-                        else:
-                            stderr = process.stderr.read().decode(sys.getdefaultencoding())
-                            if stderr != '':
-                                logging.debug(stderr)
-                        if process.stderr is not None:
-                            process.stderr.close()
-                        if process.stdout is not None:
-                            process.stdout.close()
-            else:  # Dry run
+                            pipeline.start('transformer', transformer, transformer.generate_restore_process)
+
+                    logging.info('= Run reader %s =', modules['reader'].module_name())
+                    reader = modules['reader']
+                    pipeline.start('reader', reader, reader.generate_restore_process)
+            finally:
+                for pipeline in pipelines:
+                    if pipeline.wait() is True:
+                        error = True
+                if report is not None:
+                    report[backup_id] = {'stages': [stage for pipeline in pipelines for stage in pipeline.metrics()]}
+        else:  # Dry run
+            for modules in backup_plan['pipelines']:
                 cmd = []
-                cmd.extend(backup_plan['modules']['writer'].generate_dry_run_restore_cmd())
-                if backup_plan['modules'].get('transformers') is not None:
-                    for transformer in backup_plan['modules']['transformers'].reverse():
+                cmd.extend(modules['writer'].generate_dry_run_restore_cmd())
+                if modules.get('transformers') is not None:
+                    for transformer in reversed(modules['transformers']):
                         cmd.append('|')
                         cmd.extend(transformer.generate_dry_run_restore_cmd())
                 cmd.append('|')
-                cmd.extend(backup_plan['modules']['reader'].generate_dry_run_restore_cmd())
+                cmd.extend(modules['reader'].generate_dry_run_restore_cmd())
 
                 logging.info(f'''Command [{' '.join(cmd)}] would have been ran.''')
-        except (UserException, RunningException) as e:
-            error = True
-            logging.error(str(e))
+    except (UserException, RunningException) as e:
+        error = True
+        logging.error(str(e))
+    finally:
+        _log_context.backup_id = None
     return error
 
 
@@ -363,11 +512,32 @@ def extract_cli_parameters(args):
     args_parser.add_argument('--quiet', action='store_true',
                              help='Never print into stdout, only warning and errors will be printed in stderr. '
                                   'Cannot be used together with --verbose')
+    args_parser.add_argument('--jobs', type=int, default=1,
+                             help='Maximum number of backups (or restorations) run at the same time. Backups with '
+                                  '\'parallel\' set to false are always run alone')
+    args_parser.add_argument('--resource-limit', action=KeyValue, nargs='*', dest='resource_limits', default={},
+                             help='Maximum number of backups run at the same time on a resource (e.g. disk1=2). '
+                                  'Default limit of a resource is 1')
+    args_parser.add_argument('--in-process', action='store_true',
+                             help='Run built-in stages (gzip) inside bashckup instead of running commands. '
+                                  'It saves processes and copies of data between them')
+    args_parser.add_argument('--report-file', type=Path,
+                             help='JSON file where metrics of each stage of each backup are written (data size, time, '
+                                  'CPU and memory used...). It is useful to find bottlenecks')
+    args_parser.add_argument('--metrics-file', type=Path,
+                             help='OpenMetrics file written after each backup run (e.g. for node_exporter\'s textfile '
+                                  'collector): duration, bytes written, compression ratio, last success...')
+    args_parser.add_argument('--durations-file', type=Path,
+                             help='File used to store durations of backups. Longest backups are started first')
 
     sub_parser = args_parser.add_subparsers(title='Mode', dest='mode', required=True,
                                             description='Backup or restore')
     backup_parser = sub_parser.add_parser('backup', help='Get config by CLI arguments')
     restore_parser = sub_parser.add_parser('restore', help='Get config from a YAML file')
+    restore_parser.add_argument('--path', action='append', dest='paths',
+                                help='Path to restore, relative to the backed up folder (may be repeated). Only '
+                                     'blocks of the backup containing it are read when the backup has an index of '
+                                     'its members')
 
     for parse in [backup_parser, restore_parser]:
         sub_parser = parse.add_subparsers(title='Config mode', dest='config_mode', required=True,
@@ -399,6 +569,11 @@ def extract_cli_parameters(args):
     # Checks some basics stuff
     if parameters.verbose is True and parameters.quiet is True:
         raise UserException("--verbose and --quiet cannot present together, choose one.")
+    if parameters.jobs < 1:
+        raise UserException("--jobs must be greater than 0.")
+    for (resource, limit) in parameters.resource_limits.items():
+        if type(limit) is not int or limit < 1:
+            raise UserException(f'--resource-limit of [{resource}] must be an integer greater than 0.')
 
     return parameters
 
@@ -414,7 +589,12 @@ def configure_logging(parameters):
         else:
             msg_stream_handler.setLevel(logging.INFO)
         handlers.append(msg_stream_handler)
-    logging.basicConfig(format='%(levelname)s - %(message)s', handlers=handlers, level=logging.DEBUG)
+    log_format = '%(levelname)s - %(message)s'
+    if parameters.jobs > 1:  # Logs of backups run in parallel are mixed, so they are prefixed by the backup id
+        log_format = '%(levelname)s - [%(backup_id)s] %(message)s'
+    for handler in handlers:
+        handler.addFilter(BackupIdLogFilter())
+    logging.basicConfig(format=log_format, handlers=handlers, level=logging.DEBUG)
 
 
 def main(args=None):
@@ -426,7 +606,12 @@ def main(args=None):
 
         configure_logging(parameters)
         global_parameters = {'dry-run': parameters.dry_run, 'verbose': parameters.verbose,
-                             'backup': parameters.mode == 'backup'}
+                             'backup': parameters.mode == 'backup', 'jobs': parameters.jobs,
+                             'threads': max(1, (os.cpu_count() or 1) // parameters.jobs),
+                             'resource-limits': parameters.resource_limits,
+                             'durations-file': parameters.durations_file, 'in-process': parameters.in_process,
+                             'report-file': parameters.report_file, 'metrics-file': parameters.metrics_file,
+                             'restore-paths': getattr(parameters, 'paths', None)}
 
         if parameters.config_mode == 'file':
             configurations = read_config_from_file(parameters.config_file)
@@ -0,0 +1,139 @@
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List
+
+from bashckup.actuators import native
+from bashckup.actuators.actuators import CommandActuator
+from bashckup.actuators.native import NativeProcess, StreamMeter
+
+
+def _exit_code(wait_status: int) -> int:
+    """ Same as os.waitstatus_to_exitcode, available since python 3.9 """
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+class Stage:
+    """ A running process (command or native) of a backup plan, with its metrics """
+
+    def __init__(self, actuator_type: str, actuator: CommandActuator, process: subprocess.Popen or NativeProcess):
+        self.actuator_type = actuator_type
+        self.actuator = actuator
+        self.process = process
+        self.input_meter: StreamMeter or None = None
+        self.output_meter: StreamMeter or None = None
+        self._start_time = time.monotonic()
+        self._end_time = None
+        self._rusage = None
+        self._waiter = None
+        if isinstance(process, subprocess.Popen):
+            # Reaps the process as soon as it ends, to get its duration and its resource usage
+            self._waiter = threading.Thread(target=self._wait_command, name=f'bashckup-wait-{process.pid}',
+                                            daemon=True)
+            self._waiter.start()
+
+    def _wait_command(self) -> None:
+        _, status, self._rusage = os.wait4(self.process.pid, 0)
+        self._end_time = time.monotonic()
+        # Popen.wait() returns returncode without waiting for the process once it is set
+        self.process.returncode = _exit_code(status)
+
+    def wait(self) -> int:
+        if self._waiter is not None:
+            self._waiter.join()
+        return self.process.wait()
+
+    def metrics(self) -> dict:
+        result = {'type': self.actuator_type, 'module': self.actuator.module_name(),
+                  'command': ' '.join(str(arg) for arg in self.process.args),
+                  'return-code': self.process.returncode,
+                  'bytes-in': self.input_meter.bytes if self.input_meter is not None else None,
+                  'bytes-out': self.output_meter.bytes if self.output_meter is not None else None,
+                  # Time waiting for data from the previous stage (the previous stage is slower)
+                  'blocked-reading': self.input_meter.blocked_reading if self.input_meter is not None else None,
+                  # Time waiting for the next stage to accept data (the next stage is slower)
+                  'blocked-writing': self.output_meter.blocked_writing if self.output_meter is not None else None}
+        if isinstance(self.process, NativeProcess):
+            result.update({'wall-time': self.process.end_time - self.process.start_time,
+                           'cpu-user': self.process.cpu_time, 'cpu-system': None, 'max-rss': None})
+            if isinstance(self.process.result, dict):
+                result.update(self.process.result)  # Metrics specific to the module (e.g. deduplication)
+        else:
+            result.update({'wall-time': self._end_time - self._start_time,
+                           'cpu-user': self._rusage.ru_utime, 'cpu-system': self._rusage.ru_stime,
+                           'max-rss': self._rusage.ru_maxrss})  # KiB
+        return result
+
+
+class Pipeline:
+    """
+    Chains processes of actuators: stdout of each process is the stdin of the next one.
+    When metered, a relay counting data and waiting times is interposed between each stage.
+    """
+
+    def __init__(self, metered: bool = False):
+        self._metered = metered
+        self._stages: List[Stage] = []
+        self._relays: List[NativeProcess] = []
+
+    def start(self, actuator_type: str, actuator: CommandActuator, generate_process: Callable) -> None:
+        """
+        :param generate_process: Method of the actuator generating the process, called with the stdout of the
+        previous stage
+        """
+        if len(self._stages) == 0:
+            self._stages.append(Stage(actuator_type, actuator, generate_process()))
+            return
+        previous_stage = self._stages[-1]
+        upstream = previous_stage.process.stdout
+        meter = None
+        if self._metered:
+            meter = StreamMeter()
+            relay = NativeProcess(['meter'], lambda in_fd, out_fd: native.meter_stream(in_fd, out_fd, meter),
+                                  upstream, subprocess.PIPE)
+            self._relays.append(relay)
+            upstream.close()  # Allow previous process to receive a SIGPIPE
+            upstream = relay.stdout
+        try:
+            stage = Stage(actuator_type, actuator, generate_process(upstream))
+        finally:
+            upstream.close()  # Allow previous process to receive a SIGPIPE
+        previous_stage.output_meter = meter
+        stage.input_meter = meter
+        self._stages.append(stage)
+
+    def wait(self) -> bool:
+        """
+        Waits the end of all processes and logs their errors
+        :returns: True if errors appear, otherwise False.
+        """
+        error = False
+        for stage in self._stages:
+            process = stage.process
+            return_code = stage.wait()
+            if return_code != 0:
+                error = True
+                logging.error('ERROR: Error during execution of backup\n'
+                              f'Command output: {process.stderr.read().decode(sys.getdefaultencoding())}\n'
+                              f'''Command executed: {' '.join(str(arg) for arg in process.args)}'''
+                              f'Error code: {return_code}')
+            else:
+                stderr = process.stderr.read().decode(sys.getdefaultencoding())
+                if stderr != '':
+                    logging.debug(stderr)
+            if process.stderr is not None:
+                process.stderr.close()
+            if process.stdout is not None:
+                process.stdout.close()
+        for relay in self._relays:
+            relay.wait()  # Errors of relays are consequences of errors of stages
+        return error
+
+    def metrics(self) -> List[dict]:
+        """ Metrics of each stage, must be called after wait() """
+        return [stage.metrics() for stage in self._stages]
@@ -0,0 +1,118 @@
+import datetime
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def write_atomically(file_path: Path, content: str, mode: Optional[int] = None) -> None:
+    """
+    Writes a file through a temporary file, so readers never see a partially written file
+    :param mode: Permissions of the file, whatever the umask, for files read by other tools (e.g. node_exporter).
+    By default, the file is only readable by its owner, as the temporary file.
+    """
+    file_path = Path(file_path)
+    # Runs writing the same file have their own temporary file
+    (fd, tmp_file) = tempfile.mkstemp(dir=file_path.parent, prefix=file_path.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+            f.write(content)
+        os.replace(tmp_file, file_path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def write_json_report(report_file: Path, mode: str, plans_report: dict) -> None:
+    """
+    :param mode: 'backup' or 'restore'
+    :param plans_report: Report of each plan, by backup id
+    """
+    report = {'mode': mode, 'date': datetime.datetime.today().isoformat(timespec='seconds'), 'backups': plans_report}
+    write_atomically(report_file, json.dumps(report, indent=2))
+
+
+# Name, type and help of each metric of the OpenMetrics file, labelled by backup id
+openMetrics = [
+    ('bashckup_backup_success', 'gauge', 'Whether the last backup succeeded (1) or failed (0).'),
+    ('bashckup_backup_last_success_timestamp_seconds', 'gauge', 'End time of the last successful backup.'),
+    ('bashckup_backup_duration_seconds', 'gauge', 'Duration of the last backup, post-backup tasks included.'),
+    ('bashckup_backup_read_bytes', 'gauge', 'Bytes produced by the reader during the last backup.'),
+    ('bashckup_backup_written_bytes', 'gauge', 'Bytes received by the writer during the last backup.'),
+    ('bashckup_backup_compression_ratio', 'gauge', 'Bytes read divided by bytes written during the last backup.'),
+    ('bashckup_clean_folder_deleted_files', 'gauge', 'Files deleted by cleanFolder during the last backup.'),
+    ('bashckup_rsync_sent_bytes', 'gauge', 'Bytes sent by rsync during the last backup.')]
+openMetricsSampleRegex = re.compile(r'^(\w+)\{backup_id="((?:[^"\\]|\\.)*)"} (\S+)$')
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _unescape_label(value: str) -> str:
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
+
+
+def _stage_metric(plan_report: dict, actuator_type: str, metric: str) -> int or None:
+    # Plans split in shards have a stage of each type by shard
+    values = [s[metric] for s in plan_report['stages'] if s['type'] == actuator_type and s[metric] is not None]
+    return sum(values) if len(values) != 0 else None
+
+
+def _plan_openmetrics(plan_report: dict) -> Dict[str, float or None]:
+    """ :returns: Value of each metric for a plan, None when it is unknown """
+    read_bytes = _stage_metric(plan_report, 'reader', 'bytes-out')
+    written_bytes = _stage_metric(plan_report, 'writer', 'bytes-in')
+    post_backup = plan_report['post-backup']
+    return {'bashckup_backup_success': 1 if plan_report['success'] else 0,
+            'bashckup_backup_last_success_timestamp_seconds':
+                plan_report['end-timestamp'] if plan_report['success'] else None,
+            'bashckup_backup_duration_seconds': plan_report['duration'],
+            'bashckup_backup_read_bytes': read_bytes,
+            'bashckup_backup_written_bytes': written_bytes,
+            'bashckup_backup_compression_ratio': read_bytes / written_bytes if read_bytes and written_bytes else None,
+            'bashckup_clean_folder_deleted_files': post_backup.get('cleanFolder', {}).get('deleted-files'),
+            'bashckup_rsync_sent_bytes': post_backup.get('rsync', {}).get('transferred-bytes')}
+
+
+def read_openmetrics(metrics_file: Path) -> Dict[str, Dict[str, float]]:
+    """ :returns: Samples of a file written by write_openmetrics, by metric name then backup id """
+    samples = {name: {} for (name, _, _) in openMetrics}
+    try:
+        with open(metrics_file, 'r') as f:
+            for line in f:
+                matches = openMetricsSampleRegex.search(line.rstrip('\n'))
+                if matches is not None and matches.group(1) in samples:
+                    samples[matches.group(1)][_unescape_label(matches.group(2))] = float(matches.group(3))
+    except FileNotFoundError:
+        pass
+    return samples
+
+
+def write_openmetrics(metrics_file: Path, plans_report: dict) -> None:
+    """
+    Updates the OpenMetrics file with plans of this run. Samples of plans not run are kept, as well as the last
+    success timestamp of failed plans.
+    """
+    samples = read_openmetrics(metrics_file)
+    for (backup_id, plan_report) in plans_report.items():
+        for (name, value) in _plan_openmetrics(plan_report).items():
+            if value is not None:
+                samples[name][backup_id] = value
+            elif name != 'bashckup_backup_last_success_timestamp_seconds':
+                samples[name].pop(backup_id, None)
+
+    lines = []
+    for (name, metric_type, description) in openMetrics:
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.append(f'# HELP {name} {description}')
+        for (backup_id, value) in sorted(samples[name].items()):
+            value = str(int(value)) if float(value).is_integer() else repr(float(value))
+            lines.append(f'{name}{{backup_id="{_escape_label(backup_id)}"}} {value}')
+    lines.append('# EOF')
+    write_atomically(metrics_file, '\n'.join(lines) + '\n', mode=0o644)
@@ -0,0 +1,125 @@
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Callable
+
+from bashckup.report import write_atomically
+
+defaultResourceLimit = 1
+
+
+class Scheduler:
+    """
+    Runs backup plans on a bounded pool of workers.
+    A plan is started only when each resource (tag) it uses is below its limit, and plans are started longest-first
+    based on durations of previous runs. Plans with 'parallel' set to false are started last, and alone.
+    """
+
+    def __init__(self, jobs: int = 1, resource_limits: Dict[str, int] = None, durations: Dict[str, float] = None):
+        self._jobs = jobs
+        self._resource_limits = resource_limits if resource_limits is not None else {}
+        self._durations = dict(durations) if durations is not None else {}
+        self._condition = threading.Condition()
+        self._pending: List[str] = []
+        self._running: List[str] = []
+        self._used_resources: Dict[str, int] = {}
+
+    @property
+    def durations(self) -> Dict[str, float]:
+        """ Durations in seconds of each plan, updated with plans run by this scheduler """
+        return dict(self._durations)
+
+    def order(self, backup_plans: dict) -> List[str]:
+        """
+        :returns: Backup ids sorted by priority. Plans without known duration are considered as the longest ones.
+        """
+        return sorted(backup_plans, key=lambda backup_id: (not backup_plans[backup_id].get('parallel', True),
+                                                           -self._durations.get(backup_id, math.inf)))
+
+    def run(self, backup_plans: dict, run_plan: Callable[[str, dict], bool]) -> bool:
+        """
+        :param run_plan: Function that runs a plan and returns True if errors appear
+        :returns: True if errors appear during one of the plans, otherwise False.
+        """
+        self._pending = self.order(backup_plans)
+        self._running = []
+        self._used_resources = {}
+        error = False
+        workers = max(1, min(self._jobs, len(backup_plans)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._work, backup_plans, run_plan) for _ in range(workers)]
+            for future in futures:
+                if future.result() is True:
+                    error = True
+        return error
+
+    def _can_start(self, backup_plans: dict, backup_id: str) -> bool:
+        if not backup_plans[backup_id].get('parallel', True) or \
+                any(not backup_plans[i].get('parallel', True) for i in self._running):
+            return len(self._running) == 0
+        return all(self._used_resources.get(tag, 0) < self._resource_limits.get(tag, defaultResourceLimit)
+                   for tag in backup_plans[backup_id].get('resources', []))
+
+    def _next_plan(self, backup_plans: dict) -> str or None:
+        """ Waits until a plan can be started and reserves its resources. Returns None when all plans are started """
+        with self._condition:
+            while True:
+                if len(self._pending) == 0:
+                    return None
+                backup_id = next((i for i in self._pending if self._can_start(backup_plans, i)), None)
+                if backup_id is not None:
+                    break
+                self._condition.wait()
+            self._pending.remove(backup_id)
+            self._running.append(backup_id)
+            for tag in backup_plans[backup_id].get('resources', []):
+                self._used_resources[tag] = self._used_resources.get(tag, 0) + 1
+            return backup_id
+
+    def _release_plan(self, backup_plans: dict, backup_id: str, duration: float) -> None:
+        with self._condition:
+            self._running.remove(backup_id)
+            for tag in backup_plans[backup_id].get('resources', []):
+                self._used_resources[tag] -= 1
+            self._durations[backup_id] = duration
+            self._condition.notify_all()
+
+    def _work(self, backup_plans: dict, run_plan: Callable[[str, dict], bool]) -> bool:
+        error = False
+        while True:
+            backup_id = self._next_plan(backup_plans)
+            if backup_id is None:
+                return error
+            starting_time = time.monotonic()
+            try:
+                if run_plan(backup_id, backup_plans[backup_id]) is True:
+                    error = True
+            finally:
+                self._release_plan(backup_plans, backup_id, time.monotonic() - starting_time)
+
+
+def read_durations(durations_file: Path) -> Dict[str, float]:
+    """ Reads durations of previous runs, a missing or unreadable file is considered as empty """
+    try:
+        with open(durations_file, 'r') as f:
+            durations = json.load(f)
+        if not isinstance(durations, dict):
+            raise ValueError('a JSON object is expected')
+        for (k, v) in durations.items():
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                raise ValueError(f'a number is expected as duration of [{k}]')
+        return {str(k): float(v) for (k, v) in durations.items()}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f'WARNING: Durations file [{durations_file}] is ignored.\nReason: {e}')
+        return {}
+
+
+def write_durations(durations_file: Path, durations: Dict[str, float]) -> None:
+    """ Writes durations atomically, so a crash cannot leave a truncated file """
+    write_atomically(durations_file, json.dumps(durations, indent=2, sort_keys=True))
@@ -0,0 +1,120 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Tuple
+
+from bashckup.actuators.post_backup import AbstractPostBackup
+
+
+class SyncStage:
+    """
+    Runs post backups batched across the plans of a run (e.g. rsync with 'batch'), while next plans are backed up.
+    Each batch key (e.g. remote host) has its own worker, which runs at once all post backups waiting for it: plans
+    ended while a batch runs are run together by the next one, so they share connections and transfers.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending: Dict[tuple, List[Tuple[str, AbstractPostBackup, dict, Future]]] = {}
+        self._workers: Dict[tuple, threading.Thread] = {}
+
+    def submit(self, backup_id: str, post_backup: AbstractPostBackup) -> Future:
+        """
+        Adds the post backup of a plan to the batch of its key, once the rest of the plan ended
+        :returns: Metrics of the post backup once its batch ran, or the exception raised by its run
+        """
+        args = post_backup.prepare_batch()
+        key = (type(post_backup), post_backup.batch_key())
+        future = Future()
+        with self._condition:
+            self._pending.setdefault(key, []).append((backup_id, post_backup, args, future))
+            if key not in self._workers:
+                self._workers[key] = threading.Thread(target=self._work, args=(key,), daemon=True)
+                self._workers[key].start()
+        return future
+
+    def _work(self, key: tuple) -> None:
+        while True:
+            with self._condition:
+                batch = self._pending.pop(key, [])
+                if len(batch) == 0:
+                    del self._workers[key]
+                    self._condition.notify_all()
+                    return
+            logging.info('= Run post backup %s of %s =', batch[0][1].module_name(),
+                         ', '.join(backup_id for (backup_id, _, _, _) in batch))
+            try:
+                try:
+                    results = key[0].run_batch([(post_backup, args) for (_, post_backup, args, _) in batch])
+                    if len(results) != len(batch):
+                        raise RuntimeError(f'Post backup {batch[0][1].module_name()} gave {len(results)} results '
+                                           f'for a batch of {len(batch)}')
+                except Exception as e:  # Errors are reported with the plans, the worker keeps running next batches
+                    results = [e] * len(batch)
+                for ((_, _, _, future), result) in zip(batch, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            finally:
+                # Plans waiting for their result must never be blocked, whatever happened to the worker
+                for (_, _, _, future) in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError(f'Post backup {batch[0][1].module_name()} ended without '
+                                                          'result'))
+
+    def wait(self) -> None:
+        """ Waits until all batches ran """
+        with self._condition:
+            while len(self._workers) != 0:
+                self._condition.wait()
+
+
+class PostBackupStage:
+    """
+    Runs the post backups of each plan in background once its backup ended, while next plans are backed up. Post
+    backups of plans sharing an output directory run in the order their plans ended: e.g. cleanFolder of a plan does
+    not remove files while rsync of a previous plan sends the directory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[str, threading.Thread] = {}  # Post backups submitted last, by output directory
+        self._threads: List[threading.Thread] = []
+        self.sync_stage = SyncStage()  # Batched post backups are run by it
+        self.failed: List[str] = []  # Backup ids of plans whose post backups failed
+
+    def submit(self, backup_id: str, directories: List[str], run: Callable[[], bool]) -> None:
+        """
+        :param directories: Output directories of the plan
+        :param run: Runs the post backups of the plan, returns True if errors appear
+        """
+        with self._lock:
+            previous = {self._latest[directory] for directory in directories if directory in self._latest}
+            thread = threading.Thread(target=self._run, args=(backup_id, previous, run), daemon=True)
+            for directory in directories:
+                self._latest[directory] = thread
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self, backup_id: str, previous: set, run: Callable[[], bool]) -> None:
+        for thread in previous:
+            thread.join()
+        try:
+            error = run()
+        except Exception as e:  # Unexpected errors fail the plan, they must not be lost with the thread
+            logging.exception(str(e))
+            error = True
+        if error is True:
+            with self._lock:
+                self.failed.append(backup_id)
+
+    def wait(self) -> bool:
+        """
+        Waits until post backups of all plans ran
+        :returns: True if errors appear during one of the post backups, otherwise False.
+        """
+        for thread in self._threads:
+            thread.join()
+        self.sync_stage.wait()
+        return len(self.failed) != 0
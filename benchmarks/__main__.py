@@ -0,0 +1,70 @@
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+from benchmarks.generators import dataSets
+from benchmarks.runner import run, compare, transformerChains
+
+"""
+Benchmarks of backup pipelines
+
+Run:     python -m benchmarks run --output results.json
+Compare: python -m benchmarks compare baseline.json results.json
+"""
+
+
+def _format_change(change: float or None) -> str:
+    return '-' if change is None else f'{change:+.1f}%'
+
+
+def main(args=None) -> int:
+    args_parser = argparse.ArgumentParser(prog='benchmarks', description='Benchmarks of backup pipelines')
+    sub_parser = args_parser.add_subparsers(title='Mode', dest='mode', required=True)
+    run_parser = sub_parser.add_parser('run', help='Run benchmarks and write results')
+    run_parser.add_argument('--output', type=Path, required=True, help='JSON file where results are written')
+    run_parser.add_argument('--size', type=int, default=256, help='Size of each data set in MiB')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each benchmark')
+    run_parser.add_argument('--data-set', choices=list(dataSets), action='append', dest='data_sets',
+                            help='Data sets to use, all by default')
+    run_parser.add_argument('--chain', choices=list(transformerChains), action='append', dest='chains',
+                            help='Transformer chains to run, all by default')
+    run_parser.add_argument('--work-dir', type=Path, help='Folder where data sets and backups are written')
+    run_parser.add_argument('--mariadb-database', help='Database also benchmarked with mariaDBDatabase reader')
+    compare_parser = sub_parser.add_parser('compare', help='Compare 2 results, exit code is 1 on regression')
+    compare_parser.add_argument('baseline', type=Path, help='Results of the reference')
+    compare_parser.add_argument('current', type=Path, help='Results to check')
+    compare_parser.add_argument('--threshold', type=float, default=5, help='Significant change in percent')
+    parameters = args_parser.parse_args(args)
+    logging.basicConfig(format='%(levelname)s - %(message)s', level=logging.INFO)
+    # Logs of backups are not useful here
+    logging.getLogger().handlers[0].addFilter(lambda record: record.levelno >= logging.WARNING or
+                                              record.pathname.startswith(str(Path(__file__).parent)))
+
+    if parameters.mode == 'run':
+        results = run(parameters.data_sets or list(dataSets), parameters.chains or list(transformerChains),
+                      parameters.size * 1024 * 1024, parameters.repeat, parameters.work_dir,
+                      parameters.mariadb_database)
+        with open(parameters.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        for (key, result) in results['results'].items():
+            print(f'''{key:70} {result['mb-per-second'] or 0:10.1f} MB/s {result['cpu-seconds']:8.2f} s CPU '''
+                  f'''{result['peak-rss-kib'] / 1024:8.1f} MiB''')
+        return 0
+
+    with open(parameters.baseline) as f:
+        baseline = json.load(f)
+    with open(parameters.current) as f:
+        current = json.load(f)
+    comparison = compare(baseline, current, parameters.threshold)
+    for entry in comparison:
+        status = 'REGRESSION' if entry['regression'] else 'improved' if entry['improvement'] else ''
+        print(f'''{entry['benchmark']:70} throughput {_format_change(entry['mb-per-second']):>8} '''
+              f'''cpu {_format_change(entry['cpu-seconds']):>8} memory {_format_change(entry['peak-rss-kib']):>8} '''
+              f'''{status}''')
+    return 1 if any(entry['regression'] for entry in comparison) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
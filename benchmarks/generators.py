@@ -0,0 +1,96 @@
+import os
+import random
+from pathlib import Path
+
+"""
+Synthetic data sets used by benchmarks, they are generated from a fixed seed so runs are comparable
+"""
+
+smallFileSize = 4 * 1024
+hugeFilesCount = 4
+filesPerFolder = 1000
+textWords = [b'backup', b'restore', b'archive', b'stream', b'bashckup', b'pipeline', b'compress', b'transform',
+             b'reader', b'writer', b'snapshot', b'incremental', b'database', b'table', b'index', b'folder']
+
+
+def compressible_bytes(rnd: random.Random, size: int) -> bytes:
+    """ Text made of a small vocabulary, it compresses like logs or source code """
+    words = []
+    length = 0
+    while length < size:
+        word = rnd.choice(textWords)
+        words.append(word)
+        length += len(word) + 1
+    return b' '.join(words)[:size]
+
+
+def incompressible_bytes(rnd: random.Random, size: int) -> bytes:
+    """ Random data, it compresses like already compressed or encrypted files """
+    return rnd.getrandbits(size * 8).to_bytes(size, 'little') if size > 0 else b''
+
+
+def _content(rnd: random.Random, size: int, compressible: bool) -> bytes:
+    return compressible_bytes(rnd, size) if compressible else incompressible_bytes(rnd, size)
+
+
+def generate_small_files(path: Path, total_size: int, compressible: bool, seed: int = 0) -> None:
+    """ Many small files spread in folders """
+    rnd = random.Random(seed)
+    for i in range(max(1, total_size // smallFileSize)):
+        folder = path / f'folder{i // filesPerFolder:05d}'
+        if i % filesPerFolder == 0:
+            os.makedirs(folder, exist_ok=True)
+        with open(folder / f'file{i:08d}', 'wb') as f:
+            f.write(_content(rnd, smallFileSize, compressible))
+
+
+def generate_huge_files(path: Path, total_size: int, compressible: bool, seed: int = 0,
+                        block_size: int = 4 * 1024 * 1024) -> None:
+    """ A few big files, written by blocks to keep memory low """
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    file_size = max(1, total_size // hugeFilesCount)
+    for i in range(hugeFilesCount):
+        with open(path / f'huge{i}', 'wb') as f:
+            remaining = file_size
+            while remaining > 0:
+                size = min(block_size, remaining)
+                f.write(_content(rnd, size, compressible))
+                remaining -= size
+
+
+def generate_sql_dump(path: Path, total_size: int, seed: int = 0) -> None:
+    """ A file that looks like the output of mysqldump: a few tables filled with extended INSERT statements """
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    with open(path / 'dump.sql', 'wb') as f:
+        written = 0
+        table = 0
+        while written < total_size:
+            header = (f'DROP TABLE IF EXISTS `table{table}`;\n'
+                      f'CREATE TABLE `table{table}` (`id` int(11) NOT NULL, `name` varchar(64), `price` '
+                      f'decimal(10,2), `created` datetime, PRIMARY KEY (`id`)) ENGINE=InnoDB;\n').encode()
+            f.write(header)
+            written += len(header)
+            for row_block in range(100):
+                rows = []
+                for row in range(row_block * 100, row_block * 100 + 100):
+                    rows.append(f'''({row},'{rnd.choice(textWords).decode()}-{rnd.getrandbits(32):08x}','''
+                                f'''{rnd.randint(0, 99999) / 100:.2f},'2023-{rnd.randint(1, 12):02d}-'''
+                                f'''{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00')''')
+                statement = f'''INSERT INTO `table{table}` VALUES {','.join(rows)};\n'''.encode()
+                f.write(statement)
+                written += len(statement)
+                if written >= total_size:
+                    break
+            table += 1
+
+
+# Name of each data set and how to generate it, from the path and the total size in bytes
+dataSets = {
+    'small-files-compressible': lambda path, size: generate_small_files(path, size, True),
+    'small-files-incompressible': lambda path, size: generate_small_files(path, size, False),
+    'huge-files-compressible': lambda path, size: generate_huge_files(path, size, True),
+    'huge-files-incompressible': lambda path, size: generate_huge_files(path, size, False),
+    'sql-dump': generate_sql_dump,
+}
@@ -0,0 +1,201 @@
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict
+
+from bashckup.bashckup import prepare, run_backup_plans
+from benchmarks.generators import dataSets
+
+formatVersion = 1
+
+# Transformer chains benchmarked: name -> (transformers, run in-process, commands required)
+transformerChains = {
+    'none': ([], False, []),
+    'gzip': (['gzip'], False, ['gzip']),
+    'gzip-in-process': (['gzip'], True, []),
+    'pigz': (['pigz'], False, ['pigz']),
+    'zstd': (['zstd'], False, ['zstd']),
+    'xz': ([{'xz': {'args': {'level': 1}}}], False, ['xz']),
+    'crypt': ([{'crypt': {'args': {'password-file': '{password-file}'}}}], False, ['openssl']),
+    'gzip-crypt': (['gzip', {'crypt': {'args': {'password-file': '{password-file}'}}}], False, ['gzip', 'openssl']),
+    'aead': ([{'aead': {'args': {'password-file': '{password-file}'}}}], True, []),
+    'gzip-aead': (['gzip', {'aead': {'args': {'password-file': '{password-file}'}}}], True, []),
+    'aead-public-key': ([{'aead': {'args': {'public-key-files': ['{public-key-file}']}}}], True, []),
+}
+
+# Python modules required by chains, chains are skipped when they are not installed
+chainModules = {'aead': ['cryptography'], 'gzip-aead': ['cryptography'], 'aead-public-key': ['cryptography']}
+
+
+def _with_key_files(value, key_files: Dict[str, Path]):
+    """ :returns: value where '{password-file}' like placeholders are replaced by the path of the key files """
+    if isinstance(value, dict):
+        return {k: _with_key_files(v, key_files) for (k, v) in value.items()}
+    if isinstance(value, list):
+        return [_with_key_files(v, key_files) for v in value]
+    if isinstance(value, str) and value.startswith('{') and value.endswith('}') and value[1:-1] in key_files:
+        return str(key_files[value[1:-1]])
+    return value
+
+
+def _generate_key_files(work_path: Path) -> Dict[str, Path]:
+    """ :returns: Files of the password, and of a X25519 key pair when cryptography is installed """
+    key_files = {'password-file': work_path / 'password'}
+    with open(os.open(key_files['password-file'], os.O_WRONLY | os.O_CREAT, 0o600), 'w') as f:
+        f.write('benchmark-password')
+    if importlib.util.find_spec('cryptography') is not None:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+        private_key = X25519PrivateKey.generate()
+        key_files['public-key-file'] = work_path / 'public-key.pem'
+        key_files['public-key-file'].write_bytes(private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+    return key_files
+
+
+def available_chains(chains: List[str]) -> List[str]:
+    """ Chains whose commands and Python modules are installed, others are skipped with a warning """
+    result = []
+    for chain in chains:
+        missing = [cmd for cmd in transformerChains[chain][2] if shutil.which(cmd) is None]
+        missing_modules = [module for module in chainModules.get(chain, [])
+                           if importlib.util.find_spec(module) is None]
+        if len(missing) != 0:
+            logging.warning(f'''Chain [{chain}] skipped, missing commands: {', '.join(missing)}''')
+        elif len(missing_modules) != 0:
+            logging.warning(f'''Chain [{chain}] skipped, missing Python modules: {', '.join(missing_modules)}''')
+        else:
+            result.append(chain)
+    return result
+
+
+def _peak_memory_kib() -> int:
+    """
+    :returns: Peak memory of this process. ru_maxrss of a new process starts from the peak of its parent on Linux, the
+    peak of its own memory since exec is read from /proc when available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_in_child(work_path: Path, reader: dict, chain: str, key_files: Dict[str, Path]) -> dict:
+    """
+    Runs one backup through run_backup_plans, in a process of its own
+    :returns: Report of the plan, and peak memory of the process, i.e. of this backup only
+    """
+    transformers, in_process, _ = transformerChains[chain]
+    output = work_path / 'output'
+    report_file = work_path / 'report.json'
+    configuration = [{'name': 'Benchmark', 'id': 'benchmark', 'reader': reader,
+                      'transformers': _with_key_files(transformers, key_files),
+                      'writer': {'outputFile': {'args': {'path': str(output), 'file-name': 'benchmark'}}}}]
+    global_parameters = {'dry-run': False, 'verbose': False, 'backup': True, 'jobs': 1,
+                         'threads': os.cpu_count() or 1, 'in-process': in_process, 'report-file': report_file}
+    try:
+        backup_plans = prepare(global_parameters, configuration)
+        if run_backup_plans(global_parameters, backup_plans) is True:
+            raise RuntimeError(f'Backup failed for chain [{chain}]')
+        with open(report_file) as f:
+            plan_report = json.load(f)['backups']['benchmark']
+    except Exception as e:  # Exceptions of bashckup may not be sent back to the benchmark process
+        raise RuntimeError(str(e)) from None
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
+    return {'report': plan_report, 'max-rss': _peak_memory_kib()}
+
+
+def run_once(work_path: Path, reader: dict, chain: str, key_files: Dict[str, Path]) -> dict:
+    """
+    Runs one backup in a new process and extracts its metrics from the report. Stages run in-process use the memory
+    of this new process, so their peak memory does not include the benchmark process nor earlier runs.
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        child = pool.apply(_run_in_child, (work_path, reader, chain, key_files))
+    stages = child['report']['stages']
+    rss = [s['max-rss'] for s in stages if s['max-rss'] is not None]
+    if len(rss) != len(stages):  # Stages run in-process have no RSS of their own, the one of their process is used
+        rss.append(child['max-rss'])
+    return {'duration': child['report']['duration'],
+            'input-bytes': stages[0]['bytes-out'],
+            'output-bytes': stages[-1]['bytes-in'],
+            'cpu-seconds': sum((s['cpu-user'] or 0) + (s['cpu-system'] or 0) for s in stages),
+            'peak-rss-kib': max(rss)}
+
+
+def run(data_sets: List[str], chains: List[str], size: int, repeat: int, work_path: Path = None,
+        mariadb_database: str = None) -> dict:
+    """
+    Generates data sets then runs each chain on each of them, 'repeat' times. Median of each metric is kept.
+    :param size: Size of each data set in bytes
+    """
+    work_path = Path(tempfile.mkdtemp(prefix='bashckup-benchmark-', dir=work_path))
+    results = {}
+    try:
+        key_files = _generate_key_files(work_path)
+        sources = {}
+        for data_set in data_sets:
+            logging.info('Generating data set [%s]', data_set)
+            dataSets[data_set](work_path / data_set, size)
+            sources[data_set] = {'files': {'args': {'path': str(work_path / data_set)}}}
+        if mariadb_database is not None:
+            sources['mariadb'] = {'mariaDBDatabase': {'args': {'database-name': mariadb_database}}}
+
+        for (source, reader) in sources.items():
+            reader_module = next(iter(reader))
+            for chain in available_chains(chains):
+                key = f'{source}/{reader_module}/{chain}/outputFile'
+                logging.info('Running [%s]', key)
+                runs = [run_once(work_path, reader, chain, key_files) for _ in range(repeat)]
+                result = {metric: statistics.median(r[metric] for r in runs) for metric in runs[0]}
+                result['mb-per-second'] = result['input-bytes'] / 1024 / 1024 / result['duration'] \
+                    if result['duration'] > 0 else None
+                result['ratio'] = result['input-bytes'] / result['output-bytes'] if result['output-bytes'] else None
+                results[key] = result
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return {'version': formatVersion, 'date': datetime.today().isoformat(timespec='seconds'),
+            'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                     'cpu-count': os.cpu_count()},
+            'parameters': {'size': size, 'repeat': repeat}, 'results': results}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[Dict]:
+    """
+    Compares results of 2 runs
+    :param threshold: Percentage of change considered as significant
+    :returns: One entry for each benchmark present in both runs, with 'regression' set when throughput dropped,
+    or CPU or memory grew, by more than the threshold
+    """
+    comparison = []
+    for key in sorted(set(baseline['results']) & set(current['results'])):
+        before = baseline['results'][key]
+        after = current['results'][key]
+        entry = {'benchmark': key, 'regression': False, 'improvement': False}
+        # Sign of each metric: 1 when higher is better, -1 when lower is better
+        for (metric, sign) in [('mb-per-second', 1), ('cpu-seconds', -1), ('peak-rss-kib', -1)]:
+            if not before.get(metric) or after.get(metric) is None:
+                entry[metric] = None
+                continue
+            change = (after[metric] - before[metric]) / before[metric] * 100
+            entry[metric] = change
+            if change * sign < -threshold:
+                entry['regression'] = True
+            elif change * sign > threshold:
+                entry['improvement'] = True
+        comparison.append(entry)
+    return comparison
@@ -1,13 +1,16 @@
+import json
 import locale
 import logging
 import os
 import shutil
 from pathlib import Path
 
+import pytest
 from _pytest.fixtures import fixture
 from assertpy import assert_that
 from freezegun import freeze_time
 
+from bashckup.actuators import catalog
 from bashckup.bashckup import main
 
 current_path = Path(os.path.dirname(os.path.realpath(__file__)))
@@ -42,8 +45,12 @@ def test_tar_clean(backup_folder, server_data_folder):
     with os.scandir(expected_backup_folder) as it:
         entry: os.DirEntry
         for entry in it:
-            output.append({'file-name': entry.name, 'size': entry.stat().st_size})
+            if entry.name != catalog.catalogFileName:
+                output.append({'file-name': entry.name, 'size': entry.stat().st_size})
 
+    assert_that(_catalog_files(expected_backup_folder)).contains_only('2023-07-09T15:02:10-tar-clean.tar',
+                                                                      '2023-07-08T15:02:10-tar.tar',
+                                                                      '2023-07-08T15:02:11-tar.tar')
     assert_that(output).contains_only({'file-name': '2023-07-09T15:02:10-tar-clean.tar', 'size': 10240},
                                       {'file-name': '2023-07-08T15:02:10-tar.tar', 'size': 7},
                                       {'file-name': '2023-07-08T15:02:11-tar.tar', 'size': 7})
@@ -78,6 +85,7 @@ def test_tar_incremental_clean_retention_less_than_level0_frequency(caplog, back
             output.append({'file-name': entry.name})
 
     assert_that(output).contains_only({'file-name': '2023-07-09T15:02:10-tar-diff-clean.tar'},
+                                      {'file-name': catalog.catalogFileName},
                                       {'file-name': '2023-07-09T15:02:10-tar-snap-w27.snar'},
                                       {'file-name': '2023-07-08T15:02:10-tar.tar'},
                                       {'file-name': '2023-07-07T15:02:11-tar.tar'},
@@ -89,6 +97,124 @@ def test_tar_incremental_clean_retention_less_than_level0_frequency(caplog, back
                                   'Retention value is override by the minimum'))
 
 
+@freeze_time('2023-07-09 15:02:10')
+def test_tar_clean_gfs(backup_folder, server_data_folder):
+    """
+    Goal: Latest backup of each of the last 2 days, 2 weeks and 2 months are kept, others are removed
+    3th of July is the first day of the current week
+    """
+    # Given
+    config_file = conf_path / 'tar-clean-gfs.yml'
+    expected_backup_folder = backup_folder / 'tar-clean-gfs'
+    generate_file(expected_backup_folder, '2023-07-08T15:02:10-tar-clean-gfs.tar')  # Expected to be kept, daily
+    generate_file(expected_backup_folder, '2023-07-07T15:02:10-tar-clean-gfs.tar')  # Expected to be removed
+    generate_file(expected_backup_folder, '2023-07-01T15:02:10-tar-clean-gfs.tar')  # Expected to be kept, weekly
+    generate_file(expected_backup_folder, '2023-06-30T15:02:10-tar-clean-gfs.tar')  # Expected to be kept, monthly
+    generate_file(expected_backup_folder, '2023-06-15T15:02:10-tar-clean-gfs.tar')  # Expected to be removed
+    generate_file(expected_backup_folder, '2023-05-31T15:02:10-tar-clean-gfs.tar')  # Expected to be removed
+
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only(catalog.catalogFileName,
+                                                                  '2023-07-09T15:02:10-tar-clean-gfs.tar',
+                                                                  '2023-07-08T15:02:10-tar-clean-gfs.tar',
+                                                                  '2023-07-01T15:02:10-tar-clean-gfs.tar',
+                                                                  '2023-06-30T15:02:10-tar-clean-gfs.tar')
+    assert_that(_catalog_files(expected_backup_folder)).contains_only('2023-07-09T15:02:10-tar-clean-gfs.tar',
+                                                                      '2023-07-08T15:02:10-tar-clean-gfs.tar',
+                                                                      '2023-07-01T15:02:10-tar-clean-gfs.tar',
+                                                                      '2023-06-30T15:02:10-tar-clean-gfs.tar')
+
+
+def test_tar_incremental_clean_gfs_keeps_level_0(backup_folder, server_data_folder):
+    """
+    Goal: Level 0 backup, its metadata file and previous incremental backups are kept while a kept incremental backup
+    needs them
+    10th of July is the first day of the week
+    """
+    # Given
+    config_file = conf_path / 'tar-diff-clean-gfs.yml'
+    expected_backup_folder = backup_folder / 'tar-diff-clean-gfs'
+    for date in ['2023-07-10 15:02:10', '2023-07-11 15:02:10']:
+        with freeze_time(date):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+
+    # When
+    with freeze_time('2023-07-12 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only(catalog.catalogFileName,
+                                                                  '2023-07-10T15:02:10-tar-diff-clean-gfs.tar',
+                                                                  '2023-07-10T15:02:10-tar-snap-w28.snar',
+                                                                  '2023-07-11T15:02:10-tar-diff-clean-gfs.tar',
+                                                                  '2023-07-12T15:02:10-tar-diff-clean-gfs.tar')
+    backups = catalog.Catalog(expected_backup_folder).load().entries
+    assert_that([(b['datetime'], b['depends-on']) for b in backups]) \
+        .contains_only(('2023-07-10T15:02:10', []), ('2023-07-11T15:02:10', ['2023-07-10T15:02:10']),
+                       ('2023-07-12T15:02:10', ['2023-07-11T15:02:10']))
+
+
+@freeze_time('2023-07-12 15:02:10')
+def test_tar_incremental_clean_gfs_keeps_file_preservation_window(backup_folder, server_data_folder):
+    """
+    Goal: Backups of the file preservation window of the reader are kept with keep-* rules too
+    10th of July is the first day of the week
+    """
+    # Given
+    config_file = conf_path / 'tar-diff-clean-gfs.yml'
+    expected_backup_folder = backup_folder / 'tar-diff-clean-gfs'
+    generate_file(expected_backup_folder, '2023-07-11T10:00:00-tar-diff-clean-gfs.tar')  # Expected to be kept, window
+    generate_file(expected_backup_folder, '2023-07-05T15:02:10-tar-diff-clean-gfs.tar')  # Expected to be removed
+
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(_catalog_files(expected_backup_folder)).contains_only('2023-07-12T15:02:10-tar-diff-clean-gfs.tar',
+                                                                      '2023-07-12T15:02:10-tar-snap-w28.snar',
+                                                                      '2023-07-11T10:00:00-tar-diff-clean-gfs.tar')
+
+
+@freeze_time('2023-07-09 15:02:10')
+def test_tar_clean_error_fails_the_run(caplog, backup_folder, server_data_folder):
+    """
+    Goal: Post backups run in background once the backup ended, their errors fail the run and the plan in the report
+    """
+    caplog.set_level(logging.ERROR)
+    # Given
+    config_file = conf_path / 'tar-clean.yml'
+    report_file = backup_folder / 'report.json'
+    expected_backup_folder = backup_folder / 'tar-clean'
+    os.makedirs(expected_backup_folder / '2023-07-06T15:02:10-tar.tar' / 'not-removable')
+    with catalog.Catalog(expected_backup_folder).update() as backups:
+        backups.add({'datetime': '2023-07-06T15:02:10', 'name': 'tar.tar', 'files': ['2023-07-06T15:02:10-tar.tar'],
+                     'depends-on': [], 'success': True})
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['--report-file', str(report_file), 'backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert e.value.code == 1
+    assert_that(caplog.record_tuples).contains(
+        ('root', logging.ERROR, 'ERROR:\n'
+                                'Reason: Unable to remove file [backup/tar-clean/2023-07-06T15:02:10-tar.tar].\n'
+                                "Reason: [Errno 21] Is a directory: 'backup/tar-clean/2023-07-06T15:02:10-tar.tar'"))
+    with open(report_file) as f:
+        report = json.load(f)
+    assert_that(report['backups']['tar-clean']['success']).is_false()
+    assert_that(report['backups']['tar-clean']['post-backup']).is_empty()
+
+
+def _catalog_files(backup_folder: Path) -> [str]:
+    return [f for backup in catalog.Catalog(backup_folder).load().entries for f in backup['files']]
+
+
 def generate_file(expected_backup_folder, file_name):
     if not os.path.isdir(expected_backup_folder):
         os.makedirs(expected_backup_folder)
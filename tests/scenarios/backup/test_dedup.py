@@ -0,0 +1,73 @@
+import locale
+import os
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+def _stored_chunks(store: Path) -> [str]:
+    return [chunk.name for folder in store.iterdir() if folder.is_dir() for chunk in folder.iterdir()]
+
+
+def test_tar_dedup(backup_folder, server_data_folder):
+    """
+    GOAL: Chunks of an unchanged stream are stored once, each backup only has its own manifest
+    """
+    # Given
+    config_file = conf_path / 'tar-dedup.yml'
+    expected_backup_folder = backup_folder / 'tar-dedup'
+    with freeze_time('2023-07-10 15:02:10'):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    chunks = _stored_chunks(expected_backup_folder / 'chunks')
+
+    # When
+    with freeze_time('2023-07-11 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only('chunks',
+                                                                  '2023-07-10T15:02:10-tar-dedup.manifest',
+                                                                  '2023-07-11T15:02:10-tar-dedup.manifest')
+    assert_that(chunks).is_not_empty()
+    assert_that(_stored_chunks(expected_backup_folder / 'chunks')).contains_only(*chunks)
+    manifest = (expected_backup_folder / '2023-07-11T15:02:10-tar-dedup.manifest').read_text().splitlines()
+    assert_that(manifest[0]).is_equal_to('bashckup-dedup 1')
+    assert_that(manifest[-1]).starts_with('end 10240 ')
+
+
+def test_tar_dedup_removes_unused_chunks(backup_folder, server_data_folder):
+    """
+    GOAL: Chunks which are not listed by any manifest anymore are removed by the next backup
+    """
+    # Given
+    config_file = conf_path / 'tar-dedup.yml'
+    expected_backup_folder = backup_folder / 'tar-dedup'
+    with freeze_time('2023-07-10 15:02:10'):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    old_chunks = _stored_chunks(expected_backup_folder / 'chunks')
+    os.remove(expected_backup_folder / '2023-07-10T15:02:10-tar-dedup.manifest')
+    (server_data_folder / 'file1').write_text('new content of file 1')
+
+    # When
+    with freeze_time('2023-07-11 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    manifest = (expected_backup_folder / '2023-07-11T15:02:10-tar-dedup.manifest').read_text().splitlines()
+    assert_that(_stored_chunks(expected_backup_folder / 'chunks')) \
+        .contains_only(*[line.split()[0] for line in manifest[1:-1]])
+    assert_that(_stored_chunks(expected_backup_folder / 'chunks')).does_not_contain(*old_chunks)
@@ -0,0 +1,100 @@
+import locale
+import os
+import random
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.actuators import catalog
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+def _backup(config_file: Path, date: str) -> None:
+    with freeze_time(date):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+
+
+def test_tar_delta(backup_folder, server_data_folder):
+    """
+    GOAL: Second backup only contains changes since the full backup
+    """
+    # Given
+    config_file = conf_path / 'tar-delta.yml'
+    expected_backup_folder = backup_folder / 'tar-delta'
+    size = 2 * 1024 * 1024
+    (server_data_folder / 'big-file').write_bytes(random.Random(0).getrandbits(8 * size).to_bytes(size, 'little'))
+    _backup(config_file, '2023-07-10 15:02:10')
+    (server_data_folder / 'file1').write_text('new content of file 1')
+
+    # When
+    with freeze_time('2023-07-11 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only('2023-07-10T15:02:10-tar-delta.tar',
+                                                                  '2023-07-10T15:02:10-tar-delta.tar.signature',
+                                                                  '2023-07-11T15:02:10-tar-delta.tar.delta')
+    base_size = (expected_backup_folder / '2023-07-10T15:02:10-tar-delta.tar').stat().st_size
+    delta_size = (expected_backup_folder / '2023-07-11T15:02:10-tar-delta.tar.delta').stat().st_size
+    assert_that(delta_size).is_less_than(base_size // 4)
+
+
+def test_tar_delta_full_backup_interval(backup_folder, server_data_folder):
+    """
+    GOAL: A full backup is written every full-backup-interval backups
+    """
+    # Given
+    config_file = conf_path / 'tar-delta.yml'
+    expected_backup_folder = backup_folder / 'tar-delta'
+    _backup(config_file, '2023-07-10 15:02:10')
+    _backup(config_file, '2023-07-11 15:02:10')
+    _backup(config_file, '2023-07-12 15:02:10')
+
+    # When
+    with freeze_time('2023-07-13 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only('2023-07-10T15:02:10-tar-delta.tar',
+                                                                  '2023-07-10T15:02:10-tar-delta.tar.signature',
+                                                                  '2023-07-11T15:02:10-tar-delta.tar.delta',
+                                                                  '2023-07-12T15:02:10-tar-delta.tar.delta',
+                                                                  '2023-07-13T15:02:10-tar-delta.tar',
+                                                                  '2023-07-13T15:02:10-tar-delta.tar.signature')
+
+
+def test_tar_delta_clean_keeps_base(backup_folder, server_data_folder):
+    """
+    GOAL: cleanFolder does not remove a full backup while a kept delta backup needs it
+    """
+    # Given
+    config_file = conf_path / 'tar-delta-clean.yml'
+    expected_backup_folder = backup_folder / 'tar-delta-clean'
+    _backup(config_file, '2023-07-10 15:02:10')
+    _backup(config_file, '2023-07-11 15:02:10')
+    _backup(config_file, '2023-07-12 15:02:10')
+
+    # When
+    with freeze_time('2023-07-13 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)) \
+        .contains_only(catalog.catalogFileName,
+                       '2023-07-10T15:02:10-tar-delta-clean.tar',
+                       '2023-07-10T15:02:10-tar-delta-clean.tar.signature',
+                       '2023-07-12T15:02:10-tar-delta-clean.tar.delta',
+                       '2023-07-13T15:02:10-tar-delta-clean.tar.delta')
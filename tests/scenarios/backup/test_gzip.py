@@ -1,6 +1,7 @@
 import locale
 import os
 import shutil
+import subprocess
 from pathlib import Path
 
 from _pytest.fixtures import fixture
@@ -69,3 +70,43 @@ def test_tar_gz(backup_folder, server_data_folder):
     # With level set to 9 and same files, output size change a lot between executions
     # Info: Without compression its 10240 octets
     assert_that(bck_file['size']).is_between(160, 210)
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_gz_in_process(backup_folder, server_data_folder):
+    """
+    GOAL: Test GZIP and output file run inside bashckup, output must be readable by gzip
+    """
+    # Given
+    config_file = conf_path / 'tar-gz.yml'
+    expected_backup_folder = backup_folder / 'tar-gz'
+    # When
+    return_code = main(['--in-process', 'backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    backup_file = expected_backup_folder / '2023-07-10T15:02:10-tar-gz.tar.gz'
+    process = subprocess.run(['gzip', '--decompress', '--stdout', str(backup_file)], capture_output=True)
+    assert_that(process.returncode).is_equal_to(0)
+    assert_that(process.stdout).is_length(10240)
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_gz_blocks(backup_folder, server_data_folder):
+    """
+    GOAL: Test GZIP by blocks, output must be readable by gzip and the index of members is written next to it
+    """
+    # Given
+    config_file = conf_path / 'tar-gz-blocks.yml'
+    expected_backup_folder = backup_folder / 'tar-gz-blocks'
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only(
+        '2023-07-10T15:02:10-tar-gz-blocks.tar.gz', '2023-07-10T15:02:10-tar-gz-blocks.tar.gz.members')
+    backup_file = expected_backup_folder / '2023-07-10T15:02:10-tar-gz-blocks.tar.gz'
+    process = subprocess.run(['gzip', '--decompress', '--stdout', str(backup_file)], capture_output=True)
+    assert_that(process.returncode).is_equal_to(0)
+    assert_that(process.stdout).is_length(10240)
@@ -0,0 +1,65 @@
+import locale
+import os
+import tarfile
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+
+def _backup(config_file: Path, date: str) -> None:
+    with freeze_time(date):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+
+
+def test_incremental_files(backup_folder, server_data_folder):
+    """
+    GOAL: Backup of level 1 only contains changes since the backup of level 0, and deleted files
+    """
+    # Given
+    config_file = conf_path / 'files-incremental.yml'
+    expected_backup_folder = backup_folder / 'files-incremental'
+    _backup(config_file, '2023-07-10 15:02:10')  # Monday: level 0
+    (server_data_folder / 'file1').write_text('new content of file 1')
+    (server_data_folder / 'file2').unlink()
+
+    # When
+    with freeze_time('2023-07-11 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only('2023-07-10T15:02:10-files-incremental.tar',
+                                                                  '2023-07-11T15:02:10-files-incremental.tar',
+                                                                  'files-incremental-L0.index',
+                                                                  'files-incremental-L1.index')
+    with tarfile.open(expected_backup_folder / '2023-07-11T15:02:10-files-incremental.tar') as tar:
+        assert_that(tar.getnames()).is_equal_to(['.bashckup/backup.json', 'file1', '.bashckup/deleted'])
+        assert_that(tar.extractfile('.bashckup/deleted').read()).is_equal_to(b'file2')
+
+
+def test_incremental_files_level_0_removes_higher_indexes(backup_folder, server_data_folder):
+    """
+    GOAL: Backups of level 1 following a new level 0 are done against it
+    """
+    # Given
+    config_file = conf_path / 'files-incremental.yml'
+    expected_backup_folder = backup_folder / 'files-incremental'
+    _backup(config_file, '2023-07-10 15:02:10')
+    _backup(config_file, '2023-07-11 15:02:10')
+
+    # When
+    with freeze_time('2023-07-17 15:02:10'):
+        return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that([f for f in os.listdir(expected_backup_folder) if f.endswith('.index')]) \
+        .contains_only('files-incremental-L0.index')
@@ -0,0 +1,80 @@
+import json
+import locale
+import logging
+import os
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_jobs(backup_folder, server_data_folder):
+    """
+    GOAL: Test backups run in parallel, including a backup that is not allowed to run in parallel
+    """
+    # Given
+    config_file = conf_path / 'tar-parallel.yml'
+    # When
+    return_code = main(['--jobs', '2', 'backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    for backup_id in ['tar-parallel1', 'tar-parallel2', 'tar-serial']:
+        output = []
+        with os.scandir(backup_folder / backup_id) as it:
+            entry: os.DirEntry
+            for entry in it:
+                output.append({'file-name': entry.name, 'size': entry.stat().st_size})
+
+        assert_that(output).contains_only({'file-name': f'2023-07-10T15:02:10-{backup_id}.tar', 'size': 10240})
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_jobs_durations_file(backup_folder, server_data_folder):
+    """
+    GOAL: Test durations of backups are stored, with a resource shared by 2 backups
+    """
+    # Given
+    config_file = conf_path / 'tar-parallel.yml'
+    durations_file = backup_folder / 'durations.json'
+    # When
+    return_code = main(['--jobs', '2', '--resource-limit', 'serverData=2', '--durations-file', str(durations_file),
+                        'backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    with open(durations_file) as f:
+        durations = json.load(f)
+    assert_that(durations).contains_only('tar-parallel1', 'tar-parallel2', 'tar-serial')
+
+
+def test_jobs_lower_than_one(caplog, backup_folder, server_data_folder):
+    """
+    GOAL: --jobs must be strictly positive
+    """
+    # Given
+    caplog.set_level(logging.ERROR)
+    config_file = conf_path / 'tar-parallel.yml'
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['--jobs', '0', 'backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert e.type == SystemExit
+    assert e.value.code == 1
+    assert_that(caplog.record_tuples).contains(
+        ('root', logging.ERROR, 'ERROR:\n'
+                                'Reason: --jobs must be greater than 0.'))
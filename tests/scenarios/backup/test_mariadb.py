@@ -1,8 +1,11 @@
+import gzip
+import json
 import locale
 import os
 import re
 import shutil
 import subprocess
+import tarfile
 from pathlib import Path
 
 from _pytest.fixtures import fixture
@@ -44,3 +47,67 @@ def test_mariadb(backup_folder):
                                                                                               '')
     expected = (tests_path / 'resources' / 'mariadb' / 'sqlDump.sql').read_text().replace('COLLATE utf8mb4_bin ', '')
     assert_that(actual).contains(expected)
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_mariadb_parallel(backup_folder):
+    """
+    GOAL: Test parallel dump, each table is in its own chunk listed by the manifest
+    """
+    # Given
+    config_file = conf_path / 'mariadb-parallel.yml'
+    expected_backup_folder = backup_folder / 'mariadb-parallel'
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    with tarfile.open(expected_backup_folder / '2023-07-10T15:02:10-mariadb.tar') as archive:
+        manifest = json.load(archive.extractfile('manifest.json'))
+        assert_that([chunk['table'] for chunk in manifest['chunks']]).contains_only('MOCK_DATA')
+        (schema, data) = manifest['chunks']
+        assert_that(data['rows']).is_equal_to(1000)
+        schema_chunk = gzip.decompress(archive.extractfile(schema['name']).read()).decode()
+        data_chunk = gzip.decompress(archive.extractfile(data['name']).read()).decode()
+    assert_that(schema_chunk).contains('CREATE TABLE `MOCK_DATA`')
+    assert_that(data_chunk).contains("INSERT INTO `MOCK_DATA` (`id`,`app_name`,`app_version`,`color_theme`) VALUES "
+                                     "('1','Ronstring','0.7.3','Violet'),")
+
+
+@fixture
+def keyed_table():
+    """ Copy of MOCK_DATA with a primary key, so it can be split """
+    process = subprocess.run(['mysql', '-D', 'test', '-e', 'CREATE TABLE `KEYED_DATA` (`id` int PRIMARY KEY, '
+                                                           '`app_name` varchar(50)) '
+                                                           'SELECT `id`, `app_name` FROM `MOCK_DATA`; '
+                                                           'ANALYZE TABLE `KEYED_DATA`'])
+    if process.returncode != 0:
+        raise Exception("Unable run mysql command")
+    yield 'KEYED_DATA'
+    subprocess.run(['mysql', '-D', 'test', '-e', 'DROP TABLE `KEYED_DATA`'])
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_mariadb_chunked(backup_folder, keyed_table):
+    """
+    GOAL: Test parallel dump of a table split by ranges of its primary key
+    """
+    # Given
+    config_file = conf_path / 'mariadb-chunked.yml'
+    expected_backup_folder = backup_folder / 'mariadb-chunked'
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    with tarfile.open(expected_backup_folder / '2023-07-10T15:02:10-mariadb.tar') as archive:
+        names = archive.getnames()
+        manifest = json.load(archive.extractfile('manifest.json'))
+    # Schemas are sent before data
+    assert_that(names[:2]).contains_only('schema/00000.sql.gz', 'schema/00001.sql.gz')
+    data_chunks = [chunk for chunk in manifest['chunks'] if chunk['kind'] == 'data' and chunk['table'] == keyed_table]
+    assert_that(len(data_chunks)).is_greater_than(1)
+    assert_that(sum(chunk['rows'] for chunk in data_chunks)).is_equal_to(1000)
+    # MOCK_DATA has no primary key
+    assert_that([chunk for chunk in manifest['chunks'] if chunk['kind'] == 'data' and chunk['table'] == 'MOCK_DATA']) \
+        .is_length(1)
@@ -0,0 +1,77 @@
+import locale
+import os
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+from bashckup.report import read_openmetrics
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR and CLEAN
+"""
+
+
+@freeze_time('2023-07-09 15:02:10')
+def test_tar_clean_openmetrics(backup_folder, server_data_folder):
+    """
+    GOAL: Test OpenMetrics file, samples of other backups are kept
+    """
+    # Given
+    config_file = conf_path / 'tar-clean.yml'
+    metrics_file = backup_folder / 'bashckup.prom'
+    with open(metrics_file, 'w') as f:
+        f.write('# TYPE bashckup_backup_success gauge\n'
+                'bashckup_backup_success{backup_id="other"} 0\n'
+                'bashckup_backup_last_success_timestamp_seconds{backup_id="other"} 1688900000\n'
+                '# EOF\n')
+    os.makedirs(backup_folder / 'tar-clean')
+    with open(backup_folder / 'tar-clean' / '2023-07-06T15:02:10-tar.tar', 'w') as f:
+        f.write('content')
+    # When
+    return_code = main(['--metrics-file', str(metrics_file), 'backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    with open(metrics_file) as f:
+        content = f.read()
+    assert_that(content).ends_with('# EOF\n')
+    samples = read_openmetrics(metrics_file)
+    assert_that(samples['bashckup_backup_success']).is_equal_to({'other': 0, 'tar-clean': 1})
+    assert_that(samples['bashckup_backup_last_success_timestamp_seconds']).is_equal_to(
+        {'other': 1688900000, 'tar-clean': 1688914930})
+    assert_that(samples['bashckup_backup_written_bytes']).is_equal_to({'tar-clean': 10240})
+    assert_that(samples['bashckup_backup_compression_ratio']).is_equal_to({'tar-clean': 1})
+    assert_that(samples['bashckup_clean_folder_deleted_files']).is_equal_to({'tar-clean': 1})
+    assert_that(samples['bashckup_rsync_sent_bytes']).is_empty()
+
+
+@freeze_time('2023-07-09 15:02:10')
+def test_tar_clean_openmetrics_readable_by_others(backup_folder, server_data_folder):
+    """
+    GOAL: OpenMetrics file is readable by node_exporter whatever the umask, other files written with it are not,
+    no temporary file is left
+    """
+    # Given
+    config_file = conf_path / 'tar-clean.yml'
+    metrics_file = backup_folder / 'bashckup.prom'
+    report_file = backup_folder / 'report.json'
+    previous_umask = os.umask(0o077)
+    # When
+    try:
+        return_code = main(['--metrics-file', str(metrics_file), '--report-file', str(report_file),
+                            'backup', 'file', '--config-file', str(config_file)])
+    finally:
+        os.umask(previous_umask)
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.stat(metrics_file).st_mode & 0o777).is_equal_to(0o644)
+    assert_that(os.stat(report_file).st_mode & 0o777).is_equal_to(0o600)
+    assert_that([f for f in os.listdir(backup_folder) if f.endswith('.tmp')]).is_empty()
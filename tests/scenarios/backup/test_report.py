@@ -0,0 +1,50 @@
+import json
+import locale
+import os
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR and GZIP
+"""
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_gz_report(backup_folder, server_data_folder):
+    """
+    GOAL: Test metrics of each stage are written in the report
+    """
+    # Given
+    config_file = conf_path / 'tar-gz.yml'
+    report_file = backup_folder / 'report.json'
+    # When
+    return_code = main(['--report-file', str(report_file), 'backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    with open(report_file) as f:
+        report = json.load(f)
+    assert_that(report['mode']).is_equal_to('backup')
+    plan_report = report['backups']['tar-gz']
+    assert_that(plan_report['success']).is_true()
+    stages = plan_report['stages']
+    assert_that([(s['type'], s['module']) for s in stages]).is_equal_to(
+        [('reader', 'files'), ('transformer', 'gzip'), ('writer', 'outputFile')])
+    assert_that(stages[0]['bytes-out']).is_equal_to(10240)
+    assert_that(stages[1]['bytes-in']).is_equal_to(10240)
+    assert_that(stages[1]['bytes-out']).is_between(160, 210)
+    assert_that(stages[1]['max-rss']).is_greater_than(0)
+    assert_that(stages[2]['bytes-in']).is_equal_to(stages[1]['bytes-out'])
+    for stage in stages:
+        assert_that(stage['return-code']).is_equal_to(0)
+        assert_that(stage['wall-time']).is_not_none()
+        assert_that(stage['cpu-user']).is_not_none()
@@ -0,0 +1,68 @@
+import json
+import locale
+import os
+from pathlib import Path
+
+from _pytest.fixtures import fixture
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.actuators import ssh
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR. The remote host is played by resources/bin/ssh and resources/bin/rsync, which only log their calls
+"""
+
+
+@fixture
+def fake_remote(monkeypatch, tmp_path):
+    """ ssh and rsync of resources/bin are used, their calls are logged in the returned files """
+    logs = {'ssh': tmp_path / 'ssh.log', 'rsync': tmp_path / 'rsync.log'}
+    monkeypatch.setenv('PATH', str((tests_path / 'resources' / 'bin').resolve()) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('FAKE_SSH_LOG', str(logs['ssh']))
+    monkeypatch.setenv('FAKE_RSYNC_LOG', str(logs['rsync']))
+    master_connection = ssh.control_folder() / 'backup@backup-host'
+    yield logs
+    if master_connection.exists():
+        os.remove(master_connection)
+
+
+def test_rsync_batch(tmp_path, backup_folder, server_data_folder, fake_remote):
+    """
+    GOAL: Synchronizations of plans to the same host go through one SSH connection, and only new files are sent once
+    the first synchronization is done
+    """
+    # Given
+    config_file = conf_path / 'tar-rsync-batch.yml'
+    report_file = tmp_path / 'report.json'
+    with freeze_time('2023-07-10 15:02:10'):
+        assert_that(main(['--jobs', '2', 'backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    first_calls = fake_remote['rsync'].read_text().splitlines()
+
+    # When
+    with freeze_time('2023-07-10 15:02:11'):
+        return_code = main(['--jobs', '2', '--report-file', str(report_file), 'backup', 'file', '--config-file',
+                            str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that([c for c in fake_remote['ssh'].read_text().splitlines() if 'ControlMaster=yes' in c]).is_length(1)
+    assert_that(first_calls).is_length(2)
+    assert_that([c for c in first_calls if '--delete-after' in c and '--rsh' in c]).is_length(2)
+    # State of the synchronization of this host is not sent, nor deleted from the remote folder
+    assert_that([c for c in first_calls if ' --exclude=/.bashckup-sync.json ' in c]).is_length(2)
+    calls = fake_remote['rsync'].read_text().splitlines()[2:]
+    assert_that(calls).is_length(2)
+    assert_that(sorted(c.split(' | ')[1].strip() for c in calls)).is_equal_to(
+        ['2023-07-10T15:02:11-tar-rsync-batch1.tar', '2023-07-10T15:02:11-tar-rsync-batch2.tar'])
+    with open(report_file) as f:
+        backups = json.load(f)['backups']
+    assert_that(backups['tar-rsync-batch1']['post-backup']['rsync']).is_equal_to(
+        {'transferred-bytes': 1024, 'transferred-files': 1, 'deleted-files': 0})
+    assert_that(backups['tar-rsync-batch2']['success']).is_true()
@@ -0,0 +1,77 @@
+import gzip
+import io
+import json
+import locale
+import os
+import tarfile
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+def _members(archive: Path) -> [str]:
+    with tarfile.open(fileobj=io.BytesIO(gzip.decompress(archive.read_bytes()))) as tar:
+        return tar.getnames()
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_shards(backup_folder, server_data_folder):
+    """
+    GOAL: Top-level entries are split in 2 archives of about the same size, tied by a manifest
+    """
+    # Given
+    config_file = conf_path / 'tar-shards.yml'
+    expected_backup_folder = backup_folder / 'tar-shards'
+    (server_data_folder / 'big').mkdir()
+    (server_data_folder / 'big' / 'data').write_bytes(os.urandom(100000))
+    (server_data_folder / 'medium').write_bytes(os.urandom(60000))
+    (server_data_folder / 'small').write_bytes(os.urandom(50000))
+
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(expected_backup_folder)).contains_only('2023-07-10T15:02:10-tar-shards.tar.gz.shards',
+                                                                  '2023-07-10T15:02:10-tar-shards.tar.gz.shard1',
+                                                                  '2023-07-10T15:02:10-tar-shards.tar.gz.shard2')
+    manifest = json.loads((expected_backup_folder / '2023-07-10T15:02:10-tar-shards.tar.gz.shards').read_text())
+    assert_that(manifest['shards']).is_equal_to([
+        {'file': '2023-07-10T15:02:10-tar-shards.tar.gz.shard1', 'entries': ['big', 'file1', 'file2']},
+        {'file': '2023-07-10T15:02:10-tar-shards.tar.gz.shard2', 'entries': ['medium', 'small']}])
+    assert_that(_members(expected_backup_folder / '2023-07-10T15:02:10-tar-shards.tar.gz.shard1')) \
+        .contains_only('serverData/big', 'serverData/big/data', 'serverData/file1', 'serverData/file2')
+    assert_that(_members(expected_backup_folder / '2023-07-10T15:02:10-tar-shards.tar.gz.shard2')) \
+        .contains_only('serverData/medium', 'serverData/small')
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_more_shards_than_entries(backup_folder, server_data_folder):
+    """
+    GOAL: Shards without entries are empty archives
+    """
+    # Given
+    config_file = conf_path / 'tar-shards.yml'
+    expected_backup_folder = backup_folder / 'tar-shards'
+    os.remove(server_data_folder / 'file2')
+
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(_members(expected_backup_folder / '2023-07-10T15:02:10-tar-shards.tar.gz.shard1')) \
+        .contains_only('serverData/file1')
+    assert_that(_members(expected_backup_folder / '2023-07-10T15:02:10-tar-shards.tar.gz.shard2')).is_empty()
@@ -0,0 +1,164 @@
+import locale
+import os
+from pathlib import Path
+
+import pytest
+from _pytest.fixtures import fixture
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.actuators import ssh
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR. The remote host is played by resources/bin/ssh, which runs commands locally
+"""
+
+
+@fixture
+def fake_ssh(monkeypatch, tmp_path):
+    """ ssh of resources/bin is used, its calls are logged in the returned file """
+    log_file = tmp_path / 'ssh.log'
+    monkeypatch.setenv('PATH', str((tests_path / 'resources' / 'bin').resolve()) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('FAKE_SSH_LOG', str(log_file))
+    master_connection = ssh.control_folder() / 'backup@backup-host'
+    yield log_file
+    if master_connection.exists():
+        os.remove(master_connection)
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_ssh(backup_folder, server_data_folder, fake_ssh):
+    """
+    GOAL: Backups are streamed to the remote host, through one connection shared by plans
+    """
+    # Given
+    config_file = conf_path / 'tar-ssh.yml'
+
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(backup_folder / 'tar-ssh1')).contains_only('2023-07-10T15:02:10-tar-ssh1.tar.gz')
+    assert_that(os.listdir(backup_folder / 'tar-ssh2')).contains_only('2023-07-10T15:02:10-tar-ssh2.tar')
+    assert_that((backup_folder / 'tar-ssh2' / '2023-07-10T15:02:10-tar-ssh2.tar').stat().st_size).is_equal_to(10240)
+    calls = fake_ssh.read_text().splitlines()
+    assert_that([c for c in calls if 'ControlMaster=yes' in c]).is_length(1)
+    assert_that([c for c in calls if 'cat >' in c]).is_length(2)
+    assert_that([c for c in calls if 'ControlPath=' not in c]).is_empty()
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_ssh_without_multiplexing(tmp_path, backup_folder, server_data_folder, fake_ssh):
+    """
+    GOAL: control-persist 0 opens a connection by command
+    """
+    # Given
+    config_file = tmp_path / 'tar-ssh.yml'
+    config_file.write_text((conf_path / 'tar-ssh.yml').read_text().replace(
+        '        user: backup\n', '        user: backup\n        control-persist: 0\n'))
+
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(backup_folder / 'tar-ssh2')).contains_only('2023-07-10T15:02:10-tar-ssh2.tar')
+    assert_that([c for c in fake_ssh.read_text().splitlines() if 'ControlPath=' in c]).is_empty()
+
+
+def test_tar_ssh_unreachable_host(caplog, backup_folder, server_data_folder, monkeypatch, fake_ssh):
+    """
+    GOAL: Backup fails before reading data when the remote host can not be reached
+    """
+    # Given
+    config_file = conf_path / 'tar-ssh.yml'
+    failing_bin = tests_path / 'backup' / 'bin'
+    os.makedirs(failing_bin)
+    (failing_bin / 'ssh').write_text('#!/bin/sh\necho "Connection refused" >&2\nexit 255\n')
+    os.chmod(failing_bin / 'ssh', 0o755)
+    monkeypatch.setenv('PATH', str(failing_bin.resolve()) + os.pathsep + os.environ['PATH'])
+
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(e.value.code).is_equal_to(1)
+    assert_that(caplog.text).contains('Unable to connect to [backup@backup-host]')
+
+
+def test_tar_ssh_clean_folder(caplog, tmp_path, backup_folder, server_data_folder, fake_ssh):
+    """
+    GOAL: cleanFolder is rejected with a writer which has no local output directory
+    """
+    # Given
+    config_file = tmp_path / 'tar-ssh.yml'
+    config_file.write_text((conf_path / 'tar-ssh.yml').read_text() + '  post-backup:\n'
+                                                                      '    - cleanFolder:\n'
+                                                                      '        args:\n'
+                                                                      '          retention: 2\n')
+
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(e.value.code).is_equal_to(1)
+    assert_that(caplog.text).contains('cleanFolder needs a writer with an output directory (e.g. outputFile)')
+
+
+def test_tar_ssh_gzip_blocks(caplog, tmp_path, backup_folder, server_data_folder, fake_ssh):
+    """
+    GOAL: gzip with block-size is rejected with a writer which has no local output file for the index
+    """
+    # Given
+    config_file = tmp_path / 'tar-ssh.yml'
+    config_file.write_text((conf_path / 'tar-ssh.yml').read_text().replace(
+        '    - gzip\n', '    - gzip:\n        args:\n          block-size: 65536\n'))
+
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(e.value.code).is_equal_to(1)
+    assert_that(caplog.text).contains('block-size needs a writer of a local output file (e.g. outputFile), not sshFile')
+
+
+@pytest.mark.parametrize('reader, message', [
+    ('    incrementalFiles:\n      args:\n        path: serverData/\n',
+     'incrementalFiles with index-name needs a writer with a local output directory (e.g. outputFile), not sshFile'),
+    ('    files:\n      args:\n        path: serverData/\n        incremental-metadata-file-prefix: tar-snap\n',
+     'files with incremental-metadata-file-prefix needs a writer with a local output directory (e.g. outputFile), '
+     'not sshFile')])
+def test_tar_ssh_incremental_reader(caplog, tmp_path, backup_folder, server_data_folder, fake_ssh, reader, message):
+    """
+    GOAL: Incremental readers are rejected with a writer which has no local output directory for their files
+    """
+    # Given
+    config_file = tmp_path / 'ssh-incremental.yml'
+    config_file.write_text('- name: Incremental ssh\n'
+                           '  id: ssh-incremental\n'
+                           '  reader:\n' + reader +
+                           '  writer:\n'
+                           '    sshFile:\n'
+                           '      args:\n'
+                           '        host: backup-host\n'
+                           '        user: backup\n'
+                           '        path: backup/ssh-incremental/\n'
+                           '        file-name: ssh-incremental.tar\n')
+
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(e.value.code).is_equal_to(1)
+    assert_that(caplog.text).contains(message)
@@ -0,0 +1,42 @@
+import locale
+import os
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_tar_xz(backup_folder, server_data_folder):
+    """
+    GOAL: Test XZ with custom option (threads set to 2)
+    """
+    # Given
+    config_file = conf_path / 'tar-xz.yml'
+    expected_backup_folder = backup_folder / 'tar-xz'
+    # When
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    output = []
+    with os.scandir(expected_backup_folder) as it:
+        entry: os.DirEntry
+        for entry in it:
+            output.append({'file-name': entry.name, 'size': entry.stat().st_size})
+
+    assert_that(output).is_length(1)
+    assert_that(output[0]['file-name']).is_equal_to('2023-07-10T15:02:10-tar-xz.tar.xz')
+    # Info: Without compression its 10240 octets
+    assert_that(output[0]['size']).is_between(150, 400)
@@ -0,0 +1,146 @@
+import locale
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from _pytest.fixtures import fixture
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+pytest.importorskip('cryptography')
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+@fixture
+def crypt_password_file():
+    """ Password file readable only by its owner, rights are reset after the test """
+    password_file = conf_path / 'crypt-password.pwd'
+    file_mod = os.stat(password_file).st_mode
+    os.chmod(password_file, 0o600)
+    yield password_file
+    os.chmod(password_file, file_mod)
+
+
+@fixture
+def aead_key_files():
+    """ X25519 key pair generated for the test, the private key is readable only by its owner """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    private_key = X25519PrivateKey.generate()
+    public_key_file = conf_path / 'aead-public-key.pem'
+    public_key_file.write_bytes(private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+    private_key_file = conf_path / 'aead-private-key.pem'
+    with open(os.open(private_key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption()))
+    yield public_key_file, private_key_file
+    os.remove(public_key_file)
+    os.remove(private_key_file)
+
+
+def test_restore_aead(backup_folder, server_data_folder, crypt_password_file):
+    """
+    GOAL: Backup encrypted by chunks is decrypted and authenticated by the restoration
+    """
+    # Given
+    config_file = conf_path / 'tar-aead.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:11'
+    (server_data_folder / 'file3').write_bytes(os.urandom(20 * 1024))
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+
+        # When
+        with freeze_time('2023-07-10 15:02:11'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        assert_that(os.listdir(server_data_folder)).contains_only('file1', 'file2', 'file3')
+        assert_that((server_data_folder / 'file3').stat().st_size).is_equal_to(20 * 1024)
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
+
+
+def test_restore_corrupted_aead(backup_folder, server_data_folder, crypt_password_file):
+    """
+    GOAL: Corruption of the backup fails the restoration
+    """
+    # Given
+    config_file = conf_path / 'tar-aead.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:11'
+    (server_data_folder / 'file3').write_bytes(os.urandom(20 * 1024))
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        backup_file = backup_folder / 'tar-aead' / '2023-07-10T15:02:10-tar-aead.tar.gz.aead'
+        with open(backup_file, 'r+b') as f:
+            f.seek(5000)
+            byte = f.read(1)
+            f.seek(5000)
+            f.write(bytes([byte[0] ^ 1]))
+
+        # When
+        with pytest.raises(SystemExit) as e, freeze_time('2023-07-10 15:02:11'):
+            main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(e.value.code).is_equal_to(1)
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
+
+
+def test_restore_aead_public_key(backup_folder, server_data_folder, aead_key_files):
+    """
+    GOAL: Backup encrypted for a public key is restored with its private key
+    """
+    # Given
+    config_file = conf_path / 'tar-aead-public-key.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:11'
+    (server_data_folder / 'file3').write_bytes(os.urandom(20 * 1024))
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+
+        # When
+        with freeze_time('2023-07-10 15:02:11'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        assert_that(os.listdir(server_data_folder)).contains_only('file1', 'file2', 'file3')
+        assert_that((server_data_folder / 'file3').stat().st_size).is_equal_to(20 * 1024)
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
+
+
+def test_restore_aead_public_key_without_private_key(caplog, tmp_path, backup_folder, server_data_folder,
+                                                    aead_key_files):
+    """
+    GOAL: Restoration of a backup encrypted for public keys needs a private key
+    """
+    # Given
+    (public_key_file, _) = aead_key_files
+    config_file = tmp_path / 'tar-aead-public-key.yml'
+    config = (conf_path / 'tar-aead-public-key.yml').read_text()
+    config_file.write_text(config.replace('          private-key-file: resources/confs/aead-private-key.pem\n', ''))
+
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['restore', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(e.value.code).is_equal_to(1)
+    assert_that(caplog.text).contains('private-key-file is needed')
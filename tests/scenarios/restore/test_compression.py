@@ -0,0 +1,48 @@
+import locale
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+@pytest.mark.parametrize('config_name', ['tar-gz', 'tar-gz-blocks', 'tar-xz'])
+def test_restore_compressed_tar(backup_folder, server_data_folder, config_name):
+    """
+    GOAL: Backup is decompressed by the restore command of the transformer
+    """
+    # Given
+    config_file = conf_path / f'{config_name}.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:11'
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+
+        # When
+        with freeze_time('2023-07-10 15:02:11'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        output = []
+        with os.scandir(server_data_folder) as it:
+            entry: os.DirEntry
+            for entry in it:
+                output.append({'file-name': entry.name, 'size': entry.stat().st_size})
+
+        assert_that(output).contains_only({'file-name': 'file1', 'size': 17}, {'file-name': 'file2', 'size': 17})
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
@@ -0,0 +1,71 @@
+import locale
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+def test_restore_tar_dedup(backup_folder, server_data_folder):
+    """
+    GOAL: Stream is rebuilt from chunks listed by the manifest of the latest backup
+    """
+    # Given
+    config_file = conf_path / 'tar-dedup.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-11T15:02:11'
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        (server_data_folder / 'file1').write_text('new content of file 1')
+        with freeze_time('2023-07-11 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        (server_data_folder / 'file2').write_text('modified after the backup')
+
+        # When
+        with freeze_time('2023-07-11 15:02:11'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        assert_that((server_data_folder / 'file1').read_text()).is_equal_to('new content of file 1')
+        assert_that((server_data_folder / 'file2').stat().st_size).is_equal_to(17)
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
+
+
+def test_restore_tar_dedup_corrupted_chunk(backup_folder, server_data_folder):
+    """
+    GOAL: Restoration fails when a chunk does not match its digest
+    """
+    # Given
+    config_file = conf_path / 'tar-dedup.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:11'
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        store = backup_folder / 'tar-dedup' / 'chunks'
+        chunk = next(next(store.iterdir()).iterdir())
+        chunk.write_bytes(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+        # When
+        with freeze_time('2023-07-10 15:02:11'), pytest.raises(SystemExit) as e:
+            main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert e.type == SystemExit
+        assert e.value.code == 1
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
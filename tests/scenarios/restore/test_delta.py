@@ -0,0 +1,77 @@
+import locale
+import os
+import random
+import shutil
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+def test_restore_tar_delta(backup_folder, server_data_folder):
+    """
+    GOAL: Latest delta backup is restored with its full backup
+    """
+    # Given
+    config_file = conf_path / 'tar-delta.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-11T15:02:11'
+    size = 2 * 1024 * 1024
+    big_file = random.Random(0).getrandbits(8 * size).to_bytes(size, 'little')
+    try:
+        (server_data_folder / 'big-file').write_bytes(big_file)
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        (server_data_folder / 'file1').write_text('new content of file 1')
+        with freeze_time('2023-07-11 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        (server_data_folder / 'file2').write_text('modified after the backup')
+
+        # When
+        with freeze_time('2023-07-11 15:02:11'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        assert_that((server_data_folder / 'file1').read_text()).is_equal_to('new content of file 1')
+        assert_that((server_data_folder / 'file2').stat().st_size).is_equal_to(17)
+        assert_that((server_data_folder / 'big-file').read_bytes()).is_equal_to(big_file)
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
+
+
+def test_restore_tar_delta_modified_base(backup_folder, server_data_folder):
+    """
+    GOAL: Restoration fails when the full backup does not match the one the delta was computed against
+    """
+    # Given
+    config_file = conf_path / 'tar-delta.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-11T15:02:11'
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        with freeze_time('2023-07-11 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        base = backup_folder / 'tar-delta' / '2023-07-10T15:02:10-tar-delta.tar'
+        base.write_bytes(bytes(base.stat().st_size))
+
+        # When
+        with freeze_time('2023-07-11 15:02:11'), pytest.raises(SystemExit) as e:
+            main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert e.type == SystemExit
+        assert e.value.code == 1
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
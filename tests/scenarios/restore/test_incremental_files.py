@@ -0,0 +1,63 @@
+import locale
+import os
+import shutil
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+
+def test_restore_incremental_files(backup_folder, server_data_folder):
+    """
+    GOAL: Latest incremental backup is applied on the tree, deleted files are removed
+    """
+    # Given
+    config_file = conf_path / 'files-incremental.yml'
+    with freeze_time('2023-07-10 15:02:10'):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    (server_data_folder / 'file1').write_text('new content of file 1')
+    (server_data_folder / 'file2').unlink()
+    with freeze_time('2023-07-11 15:02:10'):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    (server_data_folder / 'file1').write_text('modified after the backup')
+    (server_data_folder / 'file2').write_text('created after the backup')
+
+    # When
+    with freeze_time('2023-07-11 15:02:11'):
+        return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(server_data_folder)).contains_only('file1')
+    assert_that((server_data_folder / 'file1').read_text()).is_equal_to('new content of file 1')
+
+
+def test_restore_full_files_backup(backup_folder, server_data_folder):
+    """
+    GOAL: Files are moved aside before restoring a backup of level 0
+    """
+    # Given
+    config_file = conf_path / 'files-incremental.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:11'
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        (server_data_folder / 'file3').write_text('created after the backup')
+
+        # When
+        with freeze_time('2023-07-10 15:02:11'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        assert_that(os.listdir(server_data_folder)).contains_only('file1', 'file2')
+        assert_that(os.listdir(backup_of_backup_folder)).contains_only('file1', 'file2', 'file3')
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
@@ -0,0 +1,40 @@
+import json
+import locale
+import os
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+def test_restore_jobs(backup_folder, server_data_folder):
+    """
+    GOAL: Restorations are run by the scheduler of backups, resources shared by plans are restored one at a time
+    """
+    # Given
+    config_file = conf_path / 'tar-parallel.yml'
+    with freeze_time('2023-07-10 15:02:10'):
+        assert_that(main(['--jobs', '2', 'backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    (server_data_folder / 'file1').write_text('modified after the backup')
+
+    # When
+    with freeze_time('2023-07-10 15:02:11'):
+        return_code = main(['--jobs', '2', '--report-file', str(backup_folder / 'report.json'), 'restore', '--path',
+                            'file1', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that((server_data_folder / 'file1').stat().st_size).is_equal_to(17)
+    with open(backup_folder / 'report.json') as f:
+        assert_that(json.load(f)['backups']).contains_only('tar-parallel1', 'tar-parallel2', 'tar-serial')
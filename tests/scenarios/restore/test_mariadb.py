@@ -53,3 +53,75 @@ def test_restore_mariadb(backup_folder):
     expected = (tests_path / '..' / '.github' / 'images' / 'database.sql').read_text().replace('COLLATE utf8mb4_bin ',
                                                                                                '')
     assert_that(sql_dump.replace('COLLATE utf8mb4_bin ', '')).is_equal_to(expected)
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_restore_mariadb_parallel(backup_folder):
+    """
+    GOAL: Test restoration of a parallel dump: all modifications have to be reverted
+    """
+    # Given
+    config_file = conf_path / 'mariadb-parallel.yml'
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+    if return_code != 0:
+        raise Exception("Unable to dump the database")
+    # Do some modifications
+    process = subprocess.run(['mysql', '-D', 'test', '-e', "INSERT INTO `MOCK_DATA` (`id`, `app_name`, `app_version`, "
+                                                           "`color_theme`) VALUES ('1001', 'bashckup-test', '0.1.0', "
+                                                           "'blouge'); "
+                                                           "UPDATE `MOCK_DATA` SET `app_version` = '0.0.1' "
+                                                           "WHERE id = '42'"])
+    if process.returncode != 0:
+        raise Exception("Unable run mysql command")
+
+    # When
+    return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+
+    # Remove 'comments'
+    regex = r"/\*![0-9]{5} ?(?:[^*]*)\*/(?:;)?\n?"
+    process = subprocess.run(['mysqldump', '--compact', '--skip-extended-insert', 'test'], capture_output=True,
+                             shell=False, text=True)
+    sql_dump = re.sub(regex, '', process.stdout, 0, re.MULTILINE)
+    expected = (tests_path / '..' / '.github' / 'images' / 'database.sql').read_text().replace('COLLATE utf8mb4_bin ',
+                                                                                               '')
+    assert_that(sql_dump.replace('COLLATE utf8mb4_bin ', '')).is_equal_to(expected)
+
+
+@freeze_time('2023-07-10 15:02:10')
+def test_restore_mariadb_chunked(backup_folder):
+    """
+    GOAL: Test restoration of a table split by ranges of its primary key
+    """
+    # Given
+    config_file = conf_path / 'mariadb-chunked.yml'
+    process = subprocess.run(['mysql', '-D', 'test', '-e', 'CREATE TABLE `KEYED_DATA` (`id` int PRIMARY KEY, '
+                                                           '`app_name` varchar(50)) '
+                                                           'SELECT `id`, `app_name` FROM `MOCK_DATA`; '
+                                                           'ANALYZE TABLE `KEYED_DATA`'])
+    if process.returncode != 0:
+        raise Exception("Unable run mysql command")
+    return_code = main(['backup', 'file', '--config-file', str(config_file)])
+    if return_code != 0:
+        raise Exception("Unable to dump the database")
+    expected = subprocess.run(['mysqldump', '--compact', '--skip-extended-insert', 'test', 'KEYED_DATA'],
+                              capture_output=True, shell=False, text=True).stdout
+    process = subprocess.run(['mysql', '-D', 'test', '-e', "DELETE FROM `KEYED_DATA` WHERE id > 500; "
+                                                           "UPDATE `KEYED_DATA` SET `app_name` = 'bashckup-test' "
+                                                           "WHERE id = '42'"])
+    if process.returncode != 0:
+        raise Exception("Unable run mysql command")
+
+    # When
+    return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+    # Then
+    try:
+        assert_that(return_code).is_equal_to(0)
+        actual = subprocess.run(['mysqldump', '--compact', '--skip-extended-insert', 'test', 'KEYED_DATA'],
+                                capture_output=True, shell=False, text=True).stdout
+        assert_that(actual).is_equal_to(expected)
+    finally:
+        subprocess.run(['mysql', '-D', 'test', '-e', 'DROP TABLE `KEYED_DATA`'])
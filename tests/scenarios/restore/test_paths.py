@@ -0,0 +1,59 @@
+import locale
+import os
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+@pytest.mark.parametrize('config_name', ['tar-gz-blocks', 'tar-gz'])
+def test_restore_selected_paths(backup_folder, server_data_folder, config_name):
+    """
+    GOAL: Only selected paths are restored, other files are kept in place. Without index of members, the whole backup
+    is read
+    """
+    # Given
+    config_file = conf_path / f'{config_name}.yml'
+    (server_data_folder / 'dir').mkdir()
+    (server_data_folder / 'dir' / 'file3').write_bytes(os.urandom(200 * 1024))
+    with freeze_time('2023-07-10 15:02:10'):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    (server_data_folder / 'file1').write_text('modified after the backup')
+    (server_data_folder / 'file2').write_text('modified after the backup')
+
+    # When
+    with freeze_time('2023-07-10 15:02:11'):
+        return_code = main(['restore', '--path', 'file1', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(return_code).is_equal_to(0)
+    assert_that(os.listdir(server_data_folder.parent)).does_not_contain('serverData-bck-2023-07-10T15:02:11')
+    assert_that((server_data_folder / 'file1').stat().st_size).is_equal_to(17)
+    assert_that((server_data_folder / 'file2').read_text()).is_equal_to('modified after the backup')
+
+
+def test_restore_path_outside_of_the_folder(backup_folder, server_data_folder):
+    """
+    GOAL: Paths are relative to the backed up folder
+    """
+    # Given
+    config_file = conf_path / 'tar-gz-blocks.yml'
+
+    # When
+    with pytest.raises(SystemExit) as e:
+        main(['restore', '--path', '../file1', 'file', '--config-file', str(config_file)])
+
+    # Then
+    assert_that(e.value.code).is_equal_to(1)
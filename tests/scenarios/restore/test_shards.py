@@ -0,0 +1,45 @@
+import locale
+import os
+import shutil
+from pathlib import Path
+
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR
+"""
+
+
+def test_restore_tar_shards(backup_folder, server_data_folder):
+    """
+    GOAL: All shards of the latest backup are restored
+    """
+    # Given
+    config_file = conf_path / 'tar-shards.yml'
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:11'
+    (server_data_folder / 'dir').mkdir()
+    (server_data_folder / 'dir' / 'file3').write_text('content of file 3')
+    try:
+        with freeze_time('2023-07-10 15:02:10'):
+            assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+        (server_data_folder / 'file1').write_text('modified after the backup')
+
+        # When
+        with freeze_time('2023-07-10 15:02:11'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        assert_that(os.listdir(server_data_folder)).contains_only('dir', 'file1', 'file2')
+        assert_that((server_data_folder / 'file1').stat().st_size).is_equal_to(17)
+        assert_that((server_data_folder / 'dir' / 'file3').read_text()).is_equal_to('content of file 3')
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
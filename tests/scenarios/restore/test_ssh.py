@@ -0,0 +1,55 @@
+import locale
+import os
+import shutil
+from pathlib import Path
+
+from _pytest.fixtures import fixture
+from assertpy import assert_that
+from freezegun import freeze_time
+
+from bashckup.actuators import ssh
+from bashckup.bashckup import main
+
+current_path = Path(os.path.dirname(os.path.realpath(__file__)))
+tests_path = current_path / '..' / '..'
+conf_path = tests_path / 'resources' / 'confs'
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+"""
+Depends on TAR. The remote host is played by resources/bin/ssh, which runs commands locally
+"""
+
+
+@fixture
+def fake_ssh(monkeypatch):
+    """ ssh of resources/bin is used """
+    monkeypatch.setenv('PATH', str((tests_path / 'resources' / 'bin').resolve()) + os.pathsep + os.environ['PATH'])
+    master_connection = ssh.control_folder() / 'backup@backup-host'
+    yield
+    if master_connection.exists():
+        os.remove(master_connection)
+
+
+def test_restore_ssh(tmp_path, backup_folder, server_data_folder, fake_ssh):
+    """
+    GOAL: Latest backup of the remote host is streamed to the restoration
+    """
+    # Given
+    config_file = tmp_path / 'tar-ssh1.yml'  # Plans of tar-ssh.yml restore the same folder
+    config_file.write_text((conf_path / 'tar-ssh.yml').read_text().split('- name: Tar ssh 2')[0])
+    backup_of_backup_folder = str(server_data_folder) + '-bck-2023-07-10T15:02:12'
+    with freeze_time('2023-07-10 15:02:10'):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    (server_data_folder / 'file3').write_text('content')
+    with freeze_time('2023-07-10 15:02:11'):
+        assert_that(main(['backup', 'file', '--config-file', str(config_file)])).is_equal_to(0)
+    try:
+        # When
+        with freeze_time('2023-07-10 15:02:12'):
+            return_code = main(['restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        assert_that(os.listdir(server_data_folder)).contains_only('file1', 'file2', 'file3')
+    finally:
+        shutil.rmtree(backup_of_backup_folder, ignore_errors=True)
@@ -51,6 +51,36 @@ def test_restore_tar(backup_folder):
         shutil.rmtree(server_data_folder, ignore_errors=True)
 
 
+@freeze_time('2023-07-10 15:02:10')
+def test_restore_tar_in_process(backup_folder):
+    """
+    GOAL: Output file is read inside bashckup
+    """
+    # Given
+    config_file = conf_path / 'tar.yml'
+    expected_backup_folder = backup_folder / 'tar'
+    try:
+        os.makedirs(expected_backup_folder)
+        os.makedirs(server_data_folder)
+
+        shutil.copyfile(files_path / '2023-07-10T15:02:10-tar.tar',
+                        expected_backup_folder / '2023-07-10T15:02:10-tar.tar')
+        # When
+        return_code = main(['--in-process', 'restore', 'file', '--config-file', str(config_file)])
+
+        # Then
+        assert_that(return_code).is_equal_to(0)
+        output = []
+        with os.scandir(server_data_folder) as it:
+            entry: os.DirEntry
+            for entry in it:
+                output.append({'file-name': entry.name, 'size': entry.stat().st_size})
+
+        assert_that(output).contains_only({'file-name': 'file1', 'size': 17}, {'file-name': 'file2', 'size': 17})
+    finally:
+        shutil.rmtree(server_data_folder, ignore_errors=True)
+
+
 @freeze_time('2023-07-10 15:02:10')
 def test_restore_tar_backup_folder_not_empty(backup_folder):
     """
@@ -0,0 +1,185 @@
+import os
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+
+from bashckup.actuators import aead
+
+pytest.importorskip('cryptography')
+
+"""
+Authenticated encryption of a stream by chunks
+"""
+
+password = b'password'
+iterations = 1000  # Fast key derivation for tests
+
+
+def _run(tmp_path: Path, function, data: bytes, *args, **kwargs) -> (dict, bytes):
+    source = tmp_path / 'source'
+    source.write_bytes(data)
+    output = tmp_path / 'output'
+    in_fd = os.open(source, os.O_RDONLY)
+    out_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        metrics = function(in_fd, out_fd, *args, **kwargs)
+    finally:
+        os.close(in_fd)
+        os.close(out_fd)
+    return metrics, output.read_bytes()
+
+
+@pytest.mark.parametrize('cipher, size', [('aes-256-gcm', 100 * 1024), ('chacha20-poly1305', 16 * 1024),
+                                          ('aes-256-gcm', 0)])
+def test_decrypted_stream_is_the_encrypted_one(tmp_path, cipher, size):
+    # Given
+    data = os.urandom(size)
+    (metrics, encrypted) = _run(tmp_path, aead.encrypt, data, password, cipher, aead.minimumChunkSize, 4,
+                                iterations)
+
+    # When
+    (_, decrypted) = _run(tmp_path, aead.decrypt, encrypted, password, 4)
+
+    # Then
+    assert_that(metrics).is_equal_to({'chunks': max(1, size // aead.minimumChunkSize)})
+    assert_that(decrypted).is_equal_to(data)
+    assert_that(len(encrypted)).is_equal_to(aead.headerSize + size + metrics['chunks'] * aead.tagSize)
+
+
+def test_corrupted_chunk_is_detected(tmp_path):
+    # Given
+    (_, encrypted) = _run(tmp_path, aead.encrypt, os.urandom(20 * 1024), password, 'aes-256-gcm',
+                          aead.minimumChunkSize, 2, iterations)
+    corrupted = bytearray(encrypted)
+    corrupted[aead.headerSize + 2 * (aead.minimumChunkSize + aead.tagSize) + 10] ^= 1
+
+    # When
+    with pytest.raises(aead.AeadError) as e:
+        _run(tmp_path, aead.decrypt, bytes(corrupted), password, 2)
+
+    # Then
+    assert_that(str(e.value)).starts_with('Chunk [2] is corrupted')
+
+
+def test_stream_truncated_between_chunks_is_detected(tmp_path):
+    # Given
+    (_, encrypted) = _run(tmp_path, aead.encrypt, os.urandom(20 * 1024), password, 'aes-256-gcm',
+                          aead.minimumChunkSize, 2, iterations)
+
+    # When
+    with pytest.raises(aead.AeadError) as e:
+        _run(tmp_path, aead.decrypt, encrypted[:aead.headerSize + 3 * (aead.minimumChunkSize + aead.tagSize)],
+             password, 2)
+
+    # Then
+    assert_that(str(e.value)).starts_with('Chunk [2] is corrupted or truncated')
+
+
+def test_wrong_password_is_detected(tmp_path):
+    # Given
+    (_, encrypted) = _run(tmp_path, aead.encrypt, b'content', password, 'aes-256-gcm', aead.minimumChunkSize, 1,
+                          iterations)
+
+    # When
+    with pytest.raises(aead.AeadError):
+        _run(tmp_path, aead.decrypt, encrypted, b'other password', 1)
+
+
+def test_chunk_is_read_alone(tmp_path):
+    # Given
+    data = os.urandom(20 * 1024)
+    (_, encrypted) = _run(tmp_path, aead.encrypt, data, password, 'aes-256-gcm', aead.minimumChunkSize, 1, iterations)
+    (tmp_path / 'encrypted').write_bytes(encrypted)
+
+    # When
+    fd = os.open(tmp_path / 'encrypted', os.O_RDONLY)
+    try:
+        chunks = [aead.read_chunk(fd, password, index) for index in [1, 4]]
+    finally:
+        os.close(fd)
+
+    # Then
+    assert_that(chunks).is_equal_to([data[4096:8192], data[16384:]])
+
+
+def _key_pair(tmp_path: Path, name: str, key_type: str) -> (Path, Path):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    private_key = X25519PrivateKey.generate() if key_type == 'x25519' else \
+        rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_file = tmp_path / f'{name}.key'
+    private_file.write_bytes(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                       serialization.NoEncryption()))
+    public_file = tmp_path / f'{name}.pub'
+    public_file.write_bytes(private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                                  serialization.PublicFormat.SubjectPublicKeyInfo))
+    return public_file, private_file
+
+
+@pytest.mark.parametrize('key_type', ['x25519', 'rsa'])
+def test_stream_encrypted_for_public_key_is_decrypted_by_private_key(tmp_path, key_type):
+    # Given
+    data = os.urandom(30 * 1024)
+    (public_file, private_file) = _key_pair(tmp_path, 'key', key_type)
+    (_, encrypted) = _run(tmp_path, aead.encrypt, data, None, 'chacha20-poly1305', aead.minimumChunkSize, 2,
+                          public_keys=[aead.load_public_key(public_file)])
+
+    # When
+    (metrics, decrypted) = _run(tmp_path, aead.decrypt, encrypted, None, 2,
+                                private_key=aead.load_private_key(private_file))
+
+    # Then
+    assert_that(metrics).is_equal_to({'chunks': 8})
+    assert_that(decrypted).is_equal_to(data)
+
+
+def test_stream_encrypted_for_several_public_keys_is_decrypted_by_each_private_key(tmp_path):
+    # Given
+    data = os.urandom(10 * 1024)
+    key_pairs = [_key_pair(tmp_path, 'first', 'x25519'), _key_pair(tmp_path, 'second', 'rsa')]
+    (_, encrypted) = _run(tmp_path, aead.encrypt, data, None, 'aes-256-gcm', aead.minimumChunkSize, 1,
+                          public_keys=[aead.load_public_key(public_file) for (public_file, _) in key_pairs])
+
+    # When
+    decrypted = [_run(tmp_path, aead.decrypt, encrypted, None, 1, private_key=aead.load_private_key(private_file))[1]
+                 for (_, private_file) in key_pairs]
+
+    # Then
+    assert_that(decrypted).is_equal_to([data, data])
+
+
+def test_other_private_key_is_detected(tmp_path):
+    # Given
+    (public_file, _) = _key_pair(tmp_path, 'recipient', 'x25519')
+    (_, other_private_file) = _key_pair(tmp_path, 'other', 'x25519')
+    (_, encrypted) = _run(tmp_path, aead.encrypt, b'content', None, 'aes-256-gcm', aead.minimumChunkSize, 1,
+                          public_keys=[aead.load_public_key(public_file)])
+
+    # When
+    with pytest.raises(aead.AeadError) as e:
+        _run(tmp_path, aead.decrypt, encrypted, None, 1, private_key=aead.load_private_key(other_private_file))
+
+    # Then
+    assert_that(str(e.value)).is_equal_to('Private key is not a recipient of the stream')
+
+
+def test_stream_encrypted_with_password_needs_password(tmp_path):
+    # Given
+    (_, private_file) = _key_pair(tmp_path, 'key', 'x25519')
+    (_, encrypted) = _run(tmp_path, aead.encrypt, b'content', password, 'aes-256-gcm', aead.minimumChunkSize, 1,
+                          iterations)
+
+    # When
+    with pytest.raises(aead.AeadError):
+        _run(tmp_path, aead.decrypt, encrypted, None, 1, private_key=aead.load_private_key(private_file))
+
+
+def test_private_key_is_not_a_public_key(tmp_path):
+    # Given
+    (_, private_file) = _key_pair(tmp_path, 'key', 'x25519')
+
+    # When
+    with pytest.raises(aead.AeadError):
+        aead.load_public_key(private_file)
@@ -0,0 +1,46 @@
+from assertpy import assert_that
+
+from benchmarks.runner import compare, run_once
+
+"""
+Runs of benchmarks and comparison of their results
+"""
+
+
+def test_compare_detects_regressions():
+    # Given
+    baseline = {'results': {
+        'a/files/gzip/outputFile': {'mb-per-second': 100, 'cpu-seconds': 10, 'peak-rss-kib': 1000},
+        'b/files/gzip/outputFile': {'mb-per-second': 100, 'cpu-seconds': 10, 'peak-rss-kib': 1000},
+        'c/files/gzip/outputFile': {'mb-per-second': 100, 'cpu-seconds': 10, 'peak-rss-kib': 1000},
+        'removed/files/gzip/outputFile': {'mb-per-second': 100, 'cpu-seconds': 10, 'peak-rss-kib': 1000}}}
+    current = {'results': {
+        'a/files/gzip/outputFile': {'mb-per-second': 90, 'cpu-seconds': 10, 'peak-rss-kib': 1000},
+        'b/files/gzip/outputFile': {'mb-per-second': 103, 'cpu-seconds': 8, 'peak-rss-kib': 1000},
+        'c/files/gzip/outputFile': {'mb-per-second': 100, 'cpu-seconds': 10, 'peak-rss-kib': 1100}}}
+
+    # When
+    result = compare(baseline, current, 5)
+
+    # Then
+    assert_that(result).extracting('benchmark', 'regression', 'improvement').is_equal_to(
+        [('a/files/gzip/outputFile', True, False),
+         ('b/files/gzip/outputFile', False, True),
+         ('c/files/gzip/outputFile', True, False)])
+    assert_that(result[0]['mb-per-second']).is_equal_to(-10)
+
+
+def test_run_once_peak_memory_excludes_benchmark_process(tmp_path):
+    # Given
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'file').write_bytes(b'data' * 1024)
+    reader = {'files': {'args': {'path': str(tmp_path / 'data')}}}
+    benchmark_memory = b'x' * 512 * 1024 * 1024  # Resident in the benchmark process only
+
+    # When
+    result = run_once(tmp_path, reader, 'gzip-in-process', {})
+
+    # Then
+    assert_that(len(benchmark_memory)).is_greater_than(result['peak-rss-kib'] * 1024)
+    assert_that(result['peak-rss-kib']).is_positive()
+    assert_that(result['input-bytes']).is_positive()
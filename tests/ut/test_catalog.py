@@ -0,0 +1,85 @@
+from datetime import datetime
+
+from assertpy import assert_that
+
+from bashckup.actuators import catalog
+
+"""
+Catalog of backups and retention rules of cleanFolder
+"""
+
+
+def _backup(backup_datetime: str, depends_on: [str] = None, success: bool = True, name: str = 'db.sql') -> dict:
+    return {'datetime': backup_datetime, 'name': name, 'files': [f'{backup_datetime}-{name}'],
+            'depends-on': depends_on if depends_on is not None else [], 'success': success}
+
+
+def test_failed_backups_are_not_kept_by_gfs_rules():
+    # Given
+    backups = [_backup('2023-07-08T01:00:00'), _backup('2023-07-09T01:00:00'),
+               _backup('2023-07-09T02:00:00', success=False)]
+
+    # When
+    kept = catalog.backups_to_keep(backups, datetime(2023, 7, 9, 12), keep={'daily': 1})
+
+    # Then
+    assert_that([b['datetime'] for b in kept]).contains_only('2023-07-09T01:00:00')
+
+
+def test_dependencies_of_kept_backups_are_kept():
+    # Given
+    backups = [_backup('2023-01-01T01:00:00'), _backup('2023-01-02T01:00:00', ['2023-01-01T01:00:00']),
+               _backup('2023-01-03T01:00:00', ['2023-01-02T01:00:00']), _backup('2023-01-04T01:00:00'),
+               _backup('2023-01-05T01:00:00', ['2023-01-04T01:00:00'], name='other.sql')]
+
+    # When
+    kept = catalog.backups_to_keep(backups, datetime(2023, 7, 9), keep={'yearly': 1, 'daily': 1})
+
+    # Then
+    assert_that([(b['datetime'], b['name']) for b in kept]) \
+        .contains_only(('2023-01-04T01:00:00', 'db.sql'), ('2023-01-05T01:00:00', 'other.sql'))
+
+
+def test_dependencies_are_followed_transitively():
+    # Given
+    backups = [_backup('2023-01-01T01:00:00'), _backup('2023-01-02T01:00:00', ['2023-01-01T01:00:00']),
+               _backup('2023-01-03T01:00:00', ['2023-01-02T01:00:00'])]
+
+    # When
+    kept = catalog.backups_to_keep(backups, datetime(2023, 1, 3, 12), retention=1)
+
+    # Then
+    assert_that(kept).is_length(3)
+
+
+def test_catalog_is_built_from_the_directory(tmp_path):
+    # Given
+    for name in ['2023-07-10T15:02:10-db.sql', '2023-07-10T15:02:10-snap-w28.snar', '2023-07-11T15:02:10-db.sql',
+                 'unrelated.txt']:
+        (tmp_path / name).write_text('content')
+
+    # When
+    backups = catalog.Catalog(tmp_path, 'db.sql').load()
+
+    # Then
+    assert_that(backups.exists()).is_false()
+    assert_that(backups.entries).is_equal_to([
+        {'datetime': '2023-07-10T15:02:10', 'name': 'db.sql', 'depends-on': [], 'success': True,
+         'files': ['2023-07-10T15:02:10-db.sql', '2023-07-10T15:02:10-snap-w28.snar']},
+        {'datetime': '2023-07-11T15:02:10', 'name': 'db.sql', 'depends-on': [], 'success': True,
+         'files': ['2023-07-11T15:02:10-db.sql']}])
+
+
+def test_catalog_update_merges_files_of_the_same_backup(tmp_path):
+    # Given
+    (tmp_path / '2023-07-10T15:02:10-db.sql').write_text('content')
+    (tmp_path / '2023-07-10T15:02:10-other.sql').write_text('content')
+
+    # When
+    with catalog.Catalog(tmp_path).update() as backups:
+        backups.add(_backup('2023-07-10T15:02:10'))
+
+    # Then
+    entries = catalog.Catalog(tmp_path).load().entries
+    assert_that([f for e in entries for f in e['files']]).is_length(2)
+    assert_that(entries).is_length(1)
@@ -0,0 +1,95 @@
+import io
+import os
+import random
+import threading
+from pathlib import Path
+
+from assertpy import assert_that
+
+from bashckup.actuators import dedup
+
+"""
+Content-defined chunking of the deduplicating store
+"""
+
+
+def test_find_boundaries_is_the_sum_of_the_window():
+    # Given
+    data = random.Random(0).getrandbits(8 * 200000).to_bytes(200000, 'little')
+    threshold = 200
+
+    # When
+    boundaries = dedup.find_boundaries(data[100:], data[100 - dedup.windowSize + 1:100], threshold)
+
+    # Then
+    expected = [i - 100 for i in range(100, len(data))
+                if sum(dedup.gearValues[b] for b in data[i - dedup.windowSize + 1:i + 1]) % (1 << dedup.gearBits)
+                < threshold]
+    assert_that(expected).is_not_empty()
+    assert_that(boundaries).is_equal_to(expected)
+
+
+def test_find_boundaries_ignores_runs_of_a_byte():
+    # When
+    boundaries = [dedup.find_boundaries(bytes([byte]) * 4096, bytes([byte]) * (dedup.windowSize - 1), 255)
+                  for byte in range(256)]
+
+    # Then
+    assert_that([b for b in boundaries if len(b) != 0]).is_empty()
+
+
+def _store(data: bytes, store: Path) -> [str]:
+    read_fd, write_fd = os.pipe()
+
+    def feed():
+        with open(write_fd, 'wb') as f:
+            f.write(data)
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    manifest = io.BytesIO()
+    dedup.store_stream(read_fd, manifest, store, dedup.minimumAverageChunkSize, 1)
+    feeder.join()
+    os.close(read_fd)
+    return manifest.getvalue().decode().splitlines()
+
+
+def test_insertion_only_changes_chunks_around_it(tmp_path):
+    # Given
+    data = random.Random(1).getrandbits(8 * 2 * 1024 * 1024).to_bytes(2 * 1024 * 1024, 'little')
+    chunks = _store(data, tmp_path)[1:-1]
+
+    # When
+    new_chunks = _store(data[:1000000] + b'inserted' + data[1000000:], tmp_path)[1:-1]
+
+    # Then
+    assert_that(len(chunks)).is_greater_than(8)
+    assert_that(len(set(new_chunks) - set(chunks))).is_less_than_or_equal_to(2)
+
+
+def test_garbage_collection_waits_for_backups_writing_in_the_store(tmp_path):
+    # Given
+    store = tmp_path / dedup.storeFolderName
+    manifest = _store(b'referenced' * 100000, store)
+    (tmp_path / 'backup.manifest').write_text('\n'.join(manifest) + '\n')
+    unused = dedup.chunk_path(store, 'ab' + '0' * 62)  # Left by a failed backup
+    os.makedirs(unused.parent, exist_ok=True)
+    unused.write_bytes(b'chunk')
+    temporary = unused.parent / f'.{unused.name}.0123.tmp'
+    temporary.write_bytes(b'chunk')
+    removed = []
+
+    # When
+    with dedup.lock_store(store, exclusive=False):
+        collector = threading.Thread(target=lambda: removed.append(dedup.collect_garbage(tmp_path, store)))
+        collector.start()
+        collector.join(0.2)
+        running_while_locked = collector.is_alive()
+    collector.join()
+
+    # Then
+    assert_that(running_while_locked).is_true()
+    assert_that(removed).is_equal_to([1])
+    assert_that(unused.exists()).is_false()
+    assert_that(temporary.exists()).is_true()
+    assert_that(dedup.chunk_path(store, manifest[1].split()[0]).exists()).is_true()
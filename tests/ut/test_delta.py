@@ -0,0 +1,79 @@
+import os
+import random
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+
+from bashckup.actuators import delta
+
+"""
+Delta backups against a full backup
+"""
+
+
+def _write(path: Path, function, data: bytes, *args) -> dict:
+    source = path.parent / 'source'
+    source.write_bytes(data)
+    in_fd = os.open(source, os.O_RDONLY)
+    out_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        return function(in_fd, out_fd, *args)
+    finally:
+        os.close(in_fd)
+        os.close(out_fd)
+
+
+def _restore(delta_path: Path) -> bytes:
+    restored = delta_path.parent / 'restored'
+    out_fd = os.open(restored, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        delta.restore_delta(delta_path, out_fd)
+    finally:
+        os.close(out_fd)
+    return restored.read_bytes()
+
+
+def test_delta_only_stores_changes(tmp_path):
+    # Given
+    data = random.Random(0).getrandbits(8 * 4 * 1024 * 1024).to_bytes(4 * 1024 * 1024, 'little')
+    base = tmp_path / 'base'
+    _write(base, delta.write_base, data, tmp_path / ('base' + delta.signatureSuffix))
+    changed = data[:1000000] + b'inserted' + data[1000000:3000000] + data[3100000:]
+
+    # When
+    metrics = _write(tmp_path / 'delta', delta.write_delta, changed, base)
+
+    # Then
+    assert_that(metrics['bytes']).is_equal_to(len(changed))
+    assert_that(metrics['stored-bytes']).is_less_than(len(changed) // 4)
+    assert_that(metrics['copied-bytes'] + metrics['stored-bytes']).is_equal_to(len(changed))
+    assert_that((tmp_path / 'delta').stat().st_size).is_less_than(len(changed) // 4)
+    assert_that(delta.base_name(tmp_path / 'delta')).is_equal_to('base')
+    assert_that(_restore(tmp_path / 'delta')).is_equal_to(changed)
+
+
+def test_delta_of_empty_stream(tmp_path):
+    # Given
+    base = tmp_path / 'base'
+    _write(base, delta.write_base, b'', tmp_path / ('base' + delta.signatureSuffix))
+
+    # When
+    _write(tmp_path / 'delta', delta.write_delta, b'', base)
+
+    # Then
+    assert_that(_restore(tmp_path / 'delta')).is_equal_to(b'')
+
+
+def test_restore_truncated_delta(tmp_path):
+    # Given
+    data = random.Random(0).getrandbits(8 * 1024 * 1024).to_bytes(1024 * 1024, 'little')
+    base = tmp_path / 'base'
+    _write(base, delta.write_base, data, tmp_path / ('base' + delta.signatureSuffix))
+    _write(tmp_path / 'delta', delta.write_delta, data[::-1], base)
+    content = (tmp_path / 'delta').read_bytes()
+    (tmp_path / 'delta').write_bytes(content[:len(content) // 2])
+
+    # When / Then
+    with pytest.raises(delta.DeltaError, match='truncated'):
+        _restore(tmp_path / 'delta')
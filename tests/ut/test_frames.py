@@ -0,0 +1,105 @@
+import gzip
+import os
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+
+from bashckup.actuators import frames
+
+"""
+Seekable gzip streams, made of independent frames and a frame table
+"""
+
+
+def _run(tmp_path: Path, function, data: bytes, *args) -> (dict, bytes):
+    source = tmp_path / 'source'
+    source.write_bytes(data)
+    output = tmp_path / 'output'
+    in_fd = os.open(source, os.O_RDONLY)
+    out_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        metrics = function(in_fd, out_fd, *args)
+    finally:
+        os.close(in_fd)
+        os.close(out_fd)
+    return metrics, output.read_bytes()
+
+
+def test_seekable_stream_is_a_gzip_stream(tmp_path):
+    # Given
+    data = os.urandom(100 * 1024) + bytes(100 * 1024)
+
+    # When
+    (metrics, compressed) = _run(tmp_path, frames.compress, data, 1, 64 * 1024)
+
+    # Then
+    assert_that(metrics).is_equal_to({'frames': 4})
+    assert_that(gzip.decompress(compressed)).is_equal_to(data)
+
+
+def test_frames_are_read_through_the_frame_table(tmp_path):
+    # Given
+    data = os.urandom(200 * 1024)
+    (_, compressed) = _run(tmp_path, frames.compress, data, 1, 64 * 1024)
+    (tmp_path / 'seekable.gz').write_bytes(compressed)
+
+    # When
+    fd = os.open(tmp_path / 'seekable.gz', os.O_RDONLY)
+    try:
+        table = frames.read_table(fd)
+        third = frames.read_frame(fd, table[2])
+    finally:
+        os.close(fd)
+
+    # Then
+    assert_that([start for (start, _, _) in table]).is_equal_to([0, 65536, 131072, 196608])
+    assert_that(third).is_equal_to(data[131072:196608])
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_frames_are_decompressed_in_order(tmp_path, threads):
+    # Given
+    data = os.urandom(1024 * 1024)
+    (_, compressed) = _run(tmp_path, frames.compress, data, 1, 64 * 1024)
+
+    # When
+    (metrics, decompressed) = _run(tmp_path, frames.decompress, compressed, threads)
+
+    # Then
+    assert_that(metrics).is_equal_to({'frames': 16})
+    assert_that(decompressed).is_equal_to(data)
+
+
+def test_stream_which_is_not_seekable_is_decompressed_as_gzip(tmp_path):
+    # Given
+    data = b'content' * 1000
+
+    # When
+    (metrics, decompressed) = _run(tmp_path, frames.decompress, gzip.compress(data) + gzip.compress(data), 2)
+
+    # Then
+    assert_that(metrics).is_equal_to({'frames': None})
+    assert_that(decompressed).is_equal_to(data + data)
+
+
+def test_truncated_stream_is_an_error(tmp_path):
+    # Given
+    (_, compressed) = _run(tmp_path, frames.compress, os.urandom(200 * 1024), 1, 64 * 1024)
+
+    # When
+    with pytest.raises(frames.FramesError):
+        _run(tmp_path, frames.decompress, compressed[:100 * 1024], 2)
+
+
+def test_file_without_frame_table(tmp_path):
+    # Given
+    (tmp_path / 'plain.gz').write_bytes(gzip.compress(b'content' * 1000))
+
+    # When
+    fd = os.open(tmp_path / 'plain.gz', os.O_RDONLY)
+    try:
+        with pytest.raises(frames.FramesError):
+            frames.read_table(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,183 @@
+import io
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+
+from bashckup.actuators import incremental
+
+"""
+Incremental backups of a tree with an index of the tree
+"""
+
+
+def _backup(tmp_path: Path, root: Path, name: str, level: int, reference: Path = None) -> (dict, Path, Path):
+    archive = tmp_path / f'{name}.tar'
+    index = tmp_path / f'{name}.index'
+    out_fd = os.open(archive, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        if reference is None:
+            metrics = incremental.backup_tree(root, out_fd, index, level, f'2023-07-1{level}T15:02:10', None)
+        else:
+            with incremental.TreeIndex(reference) as reference_index:
+                metrics = incremental.backup_tree(root, out_fd, index, level, f'2023-07-1{level}T15:02:10',
+                                                  reference_index)
+    finally:
+        os.close(out_fd)
+    return metrics, archive, index
+
+
+def _restore(archive: Path, root: Path) -> None:
+    in_fd = os.open(archive, os.O_RDONLY)
+    try:
+        incremental.restore_tree(in_fd, root, lambda: None)
+    finally:
+        os.close(in_fd)
+
+
+def _tree(tmp_path: Path) -> Path:
+    root = tmp_path / 'root'
+    (root / 'dir' / 'sub').mkdir(parents=True)
+    (root / 'dir' / 'sub' / 'deep').write_text('deep')
+    (root / 'dir-b').write_text('sorted after dir/ entries')
+    (root / 'file').write_text('content')
+    os.symlink('file', root / 'link')
+    return root
+
+
+def test_walk_is_sorted_by_key(tmp_path):
+    # Given
+    root = _tree(tmp_path)
+
+    # When
+    keys = [key for (key, _) in incremental.walk_tree(os.fsencode(root))]
+
+    # Then
+    assert_that(keys).is_equal_to([b'dir', b'dir\0sub', b'dir\0sub\0deep', b'dir-b', b'file', b'link'])
+    assert_that(keys).is_sorted()
+
+
+def test_parallel_walk_is_ordered(tmp_path):
+    # Given
+    root = tmp_path / 'root'
+    for i in range(20):
+        for j in range(20):
+            (root / f'dir{i}' / f'sub{j}').mkdir(parents=True)
+            (root / f'dir{i}' / f'sub{j}' / 'file').write_text(f'{i} {j}')
+    expected = [key for (key, _) in incremental.walk_tree(os.fsencode(root))]
+
+    # When
+    keys = [key for (key, _) in incremental.walk_tree(os.fsencode(root), threads=4)]
+
+    # Then
+    assert_that(keys).is_length(20 + 20 * 20 * 2)
+    assert_that(keys).is_equal_to(expected)
+
+
+def test_parallel_walk_can_be_stopped(tmp_path):
+    # Given
+    root = _tree(tmp_path)
+    walk = incremental.walk_tree(os.fsencode(root), threads=4)
+
+    # When
+    first = next(walk)
+    walk.close()
+
+    # Then
+    assert_that(first[0]).is_equal_to(b'dir')
+
+
+def test_index_is_searched(tmp_path):
+    # Given
+    root = _tree(tmp_path)
+    (_, _, index_path) = _backup(tmp_path, root, 'full', 0)
+
+    # When
+    with incremental.TreeIndex(index_path) as index:
+        found = index.find(incremental.key_of(b'dir/sub/deep'))
+        missing = index.find(b'missing')
+        count = len(index)
+
+    # Then
+    assert_that(count).is_equal_to(6)
+    assert_that(found.size).is_equal_to(4)
+    assert_that(missing).is_none()
+
+
+def test_incremental_backup_only_contains_changes(tmp_path):
+    # Given
+    root = _tree(tmp_path)
+    (_, _, full_index) = _backup(tmp_path, root, 'full', 0)
+    (root / 'file').write_text('new content')
+    (root / 'dir' / 'sub' / 'deep').unlink()
+    (root / 'dir' / 'sub').rmdir()
+
+    # When
+    (metrics, archive, _) = _backup(tmp_path, root, 'incremental', 1, full_index)
+
+    # Then
+    assert_that(metrics).contains_entry({'scanned-files': 4}, {'changed-files': 2}, {'deleted-files': 1})
+    with tarfile.open(archive) as tar:
+        assert_that(tar.getnames()).is_equal_to([incremental.backupMember, 'dir', 'file', incremental.deletedMember])
+        assert_that(tar.extractfile(incremental.deletedMember).read()).is_equal_to(b'dir/sub')
+
+
+def test_restore_applies_changes_and_deletions(tmp_path):
+    # Given
+    root = _tree(tmp_path)
+    (_, full_archive, full_index) = _backup(tmp_path, root, 'full', 0)
+    (root / 'file').write_text('new content')
+    (root / 'dir').rename(root / 'renamed')
+    (_, incremental_archive, _) = _backup(tmp_path, root, 'incremental', 1, full_index)
+    restored = tmp_path / 'restored'
+    restored.mkdir()
+
+    # When
+    _restore(full_archive, restored)
+    _restore(incremental_archive, restored)
+
+    # Then
+    assert_that(sorted(os.listdir(restored))).is_equal_to(['dir-b', 'file', 'link', 'renamed'])
+    assert_that((restored / 'file').read_text()).is_equal_to('new content')
+    assert_that((restored / 'renamed' / 'sub' / 'deep').read_text()).is_equal_to('deep')
+    assert_that(os.readlink(restored / 'link')).is_equal_to('file')
+
+
+def test_file_changed_while_read_is_saved_again(tmp_path):
+    # Given
+    content = io.BytesIO(b'short')
+    reader = incremental._HashingReader(content, 10)
+
+    # When
+    data = reader.read(10) + reader.read(10)
+
+    # Then
+    assert_that(data).is_equal_to(b'short' + bytes(5))
+    assert_that(reader.changed).is_true()
+
+
+def test_restore_does_not_remove_deleted_entries_outside_of_root(tmp_path):
+    # Given
+    restored = tmp_path / 'restored'
+    restored.mkdir()
+    (restored / 'file').write_text('content')
+    outside = tmp_path / 'outside'
+    outside.write_text('must be kept')
+    archive = tmp_path / 'crafted.tar'
+    with tarfile.open(archive, 'w', format=tarfile.PAX_FORMAT) as tar:
+        for (name, content) in [(incremental.backupMember, b'{"level": 1, "reference": "2023-07-10T15:02:10"}'),
+                                (incremental.deletedMember, b'file\0../outside')]:
+            tar_info = tarfile.TarInfo(name)
+            tar_info.size = len(content)
+            tar.addfile(tar_info, io.BytesIO(content))
+
+    # When
+    with pytest.raises(incremental.IncrementalError) as e:
+        _restore(archive, restored)
+
+    # Then
+    assert_that(str(e.value)).is_equal_to(f'Deleted entry [../outside] is outside of [{restored}]')
+    assert_that(outside.read_text()).is_equal_to('must be kept')
+    assert_that((restored / 'file').exists()).is_true()
@@ -0,0 +1,131 @@
+import io
+import os
+import subprocess
+import tarfile
+
+import pytest
+from assertpy import assert_that
+
+from bashckup.actuators import mariadb
+from bashckup.actuators.mariadb import MariaDBError
+from bashckup.actuators.native import NativeProcess
+
+"""
+Parallel dump of MariaDB, parts which do not need a server
+"""
+
+
+def test_unescape_field():
+    # Given
+    field = b"('a\\\\nb','c\\nd','e\\tf','\\0')"
+
+    # When
+    result = mariadb.unescape_field(field)
+
+    # Then
+    assert_that(result).is_equal_to(b"('a\\nb','c\nd','e\tf','\0')")
+
+
+def test_insert_statements_are_grouped_by_size():
+    # Given
+    values = [b"(1,'a')", b"(2,'b')", b"(3,'c')"]
+
+    # When
+    statements = list(mariadb.insert_statements(b'my`table', [b'id', b'name'], iter(values), statement_size=16))
+
+    # Then
+    assert_that(statements).is_equal_to([b"INSERT INTO `my``table` (`id`,`name`) VALUES (1,'a'),(2,'b');\n",
+                                         b"INSERT INTO `my``table` (`id`,`name`) VALUES (3,'c');\n"])
+
+
+def _load(archive: bytes) -> NativeProcess:
+    process = NativeProcess(['bashckup-mariadb-load'], lambda i, o: mariadb.load_database('test', 2, i),
+                            subprocess.PIPE, subprocess.DEVNULL)
+    process.stdin.write(archive)
+    process.stdin.close()
+    process.wait()
+    return process
+
+
+def _archive(members: dict, checksums: dict = None) -> bytes:
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+        for (name, content) in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            if checksums is not None and name in checksums:
+                info.pax_headers = {mariadb.chunkChecksumHeader: checksums[name]}
+            archive.addfile(info, io.BytesIO(content))
+    return output.getvalue()
+
+
+def test_load_rejects_corrupted_chunk():
+    # Given
+    archive = _archive({'tables/00000.sql.gz': os.urandom(64)}, {'tables/00000.sql.gz': '0' * 64})
+
+    # When
+    process = _load(archive)
+
+    # Then
+    assert_that(process.returncode).is_equal_to(1)
+    assert_that(process.stderr.read().decode()).contains('Chunk [tables/00000.sql.gz] is corrupted')
+
+
+def test_load_rejects_archive_without_manifest():
+    # Given
+    archive = _archive({})
+
+    # When
+    process = _load(archive)
+
+    # Then
+    assert_that(process.returncode).is_equal_to(1)
+    assert_that(process.stderr.read().decode()).contains('Manifest is missing')
+
+
+def test_load_rejects_missing_chunks():
+    # Given
+    manifest = b'{"format": 1, "database": "test", "chunks": [{"name": "tables/00000.sql.gz", "sha256": "00"}]}'
+    archive = _archive({mariadb.manifestName: manifest})
+
+    # When
+    process = _load(archive)
+
+    # Then
+    assert_that(process.returncode).is_equal_to(1)
+    assert_that(process.stderr.read().decode()).contains('Chunks are missing: tables/00000.sql.gz')
+
+
+def test_dump_fails_when_connection_fails(tmp_path, monkeypatch):
+    # Given
+    (tmp_path / 'mysql').write_text('#!/bin/sh\necho "ERROR 2002 (HY000): Can\'t connect to server" >&2\nexit 1\n')
+    os.chmod(tmp_path / 'mysql', 0o755)
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ['PATH'])
+    out_fd = os.open(tmp_path / 'dump.tar', os.O_WRONLY | os.O_CREAT, 0o600)
+
+    # When
+    try:
+        with pytest.raises(MariaDBError) as e:
+            mariadb.dump_database('test', 2, out_fd)
+    finally:
+        os.close(out_fd)
+
+    # Then
+    assert_that(str(e.value)).is_equal_to(
+        "Connection to MariaDB ended unexpectedly: ERROR 2002 (HY000): Can't connect to server")
+
+
+def test_key_ranges():
+    # When
+    ranges = mariadb.key_ranges(1, 10, 3)
+
+    # Then
+    assert_that(ranges).is_equal_to([[1, 5], [5, 9], [9, None]])
+
+
+def test_key_ranges_are_not_empty():
+    # When
+    ranges = mariadb.key_ranges(1, 2, 10)
+
+    # Then
+    assert_that(ranges).is_equal_to([[1, 2], [2, None]])
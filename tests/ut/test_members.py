@@ -0,0 +1,111 @@
+import gzip
+import io
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that
+
+from bashckup.actuators import members
+
+"""
+Compression by blocks of a tar stream, with an index of its members
+"""
+
+
+def _tar(files: dict) -> bytes:
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w') as tar:
+        for (name, content) in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return stream.getvalue()
+
+
+def _compress(tmp_path: Path, data: bytes, block_size: int) -> (dict, Path, Path):
+    source = tmp_path / 'source'
+    source.write_bytes(data)
+    output = tmp_path / 'backup.tar.gz'
+    index = tmp_path / ('backup.tar.gz' + members.indexSuffix)
+    in_fd = os.open(source, os.O_RDONLY)
+    out_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        metrics = members.compress_blocks(in_fd, out_fd, 1, block_size, index)
+    finally:
+        os.close(in_fd)
+        os.close(out_fd)
+    return metrics, output, index
+
+
+def _extract(tmp_path: Path, output: Path, index: dict, names: [str]) -> (dict, bytes):
+    extracted = tmp_path / 'extracted.tar.gz'
+    out_fd = os.open(extracted, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        metrics = members.extract_members(output, index, names, out_fd)
+    finally:
+        os.close(out_fd)
+    return metrics, gzip.decompress(extracted.read_bytes())
+
+
+def test_blocks_are_a_gzip_stream_of_the_input(tmp_path):
+    # Given
+    data = _tar({'root/file1': os.urandom(200 * 1024), 'root/file2': b'content'})
+
+    # When
+    (metrics, output, index_path) = _compress(tmp_path, data, members.minimumBlockSize)
+
+    # Then
+    index = members.read_index(index_path)
+    assert_that(gzip.decompress(output.read_bytes())).is_equal_to(data)
+    assert_that(metrics).is_equal_to({'blocks': 4, 'indexed-members': 2})
+    assert_that(index['compressed-size']).is_equal_to(output.stat().st_size)
+    assert_that([name for (name, _, _) in index['members']]).is_equal_to(['root/file1', 'root/file2'])
+
+
+def test_only_blocks_of_selected_members_are_read(tmp_path):
+    # Given
+    files = {'root/big': os.urandom(300 * 1024), 'root/dir/file1': b'content 1', 'root/dir/file2': b'content 2',
+             'root/other': b'other'}
+    (_, output, index_path) = _compress(tmp_path, _tar(files), members.minimumBlockSize)
+    index = members.read_index(index_path)
+
+    # When
+    (metrics, data) = _extract(tmp_path, output, index, ['root/dir'])
+
+    # Then
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r') as tar:
+        assert_that({m.name: tar.extractfile(m).read() for m in tar.getmembers()}) \
+            .is_equal_to({'root/dir/file1': b'content 1', 'root/dir/file2': b'content 2'})
+    assert_that(metrics['read-blocks']).is_equal_to(1)
+    assert_that(metrics['blocks']).is_equal_to(5)
+
+
+def test_stream_which_is_not_a_tar_stream_has_no_members(tmp_path):
+    # Given
+    data = b'not a tar stream' * 100
+
+    # When
+    (metrics, output, index_path) = _compress(tmp_path, data, members.minimumBlockSize)
+
+    # Then
+    assert_that(gzip.decompress(output.read_bytes())).is_equal_to(data)
+    assert_that(metrics['indexed-members']).is_none()
+    assert_that(members.read_index(index_path)['members']).is_none()
+
+
+def test_index_failure_leaves_no_temporary_file(tmp_path, monkeypatch):
+    # Given
+    data = _tar({'root/file1': b'content'})
+
+    def failing_dump(*args, **kwargs):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(members.json, 'dump', failing_dump)
+
+    # When
+    with pytest.raises(OSError):
+        _compress(tmp_path, data, members.minimumBlockSize)
+
+    # Then
+    assert_that(sorted(os.listdir(tmp_path))).is_equal_to(['backup.tar.gz', 'source'])
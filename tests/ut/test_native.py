@@ -0,0 +1,103 @@
+import gzip
+import os
+import subprocess
+import threading
+
+from assertpy import assert_that
+
+from bashckup.actuators import native
+from bashckup.actuators.native import NativeProcess
+
+"""
+Stages run inside bashckup
+"""
+
+
+def test_gzip_round_trip():
+    # Given
+    data = os.urandom(1024) + b'a' * 3 * 1024 * 1024
+
+    # When
+    compressor = NativeProcess(['gzip'], lambda i, o: native.gzip_compress(i, o, 6), subprocess.PIPE,
+                               subprocess.PIPE)
+    decompressor = NativeProcess(['gunzip'], native.gzip_decompress, compressor.stdout, subprocess.PIPE)
+    compressor.stdout.close()
+    feeder = threading.Thread(target=lambda: (compressor.stdin.write(data), compressor.stdin.close()))
+    feeder.start()
+    result = decompressor.stdout.read()
+    feeder.join()
+
+    # Then
+    assert_that(compressor.wait()).is_equal_to(0)
+    assert_that(decompressor.wait()).is_equal_to(0)
+    assert_that(result).is_equal_to(data)
+
+
+def test_gzip_decompress_concatenated_members():
+    # Given
+    data = gzip.compress(b'first member\n') + gzip.compress(b'second member\n')
+
+    # When
+    process = NativeProcess(['gunzip'], native.gzip_decompress, subprocess.PIPE, subprocess.PIPE)
+    process.stdin.write(data)
+    process.stdin.close()
+    result = process.stdout.read()
+
+    # Then
+    assert_that(process.wait()).is_equal_to(0)
+    assert_that(result).is_equal_to(b'first member\nsecond member\n')
+
+
+def test_error_reported_as_return_code():
+    # Given
+    data = gzip.compress(b'truncated stream')[:-10]
+
+    # When
+    process = NativeProcess(['gunzip'], native.gzip_decompress, subprocess.PIPE, subprocess.PIPE)
+    process.stdin.write(data)
+    process.stdin.close()
+    process.stdout.read()
+
+    # Then
+    assert_that(process.wait()).is_equal_to(1)
+    assert_that(process.stderr.read().decode()).starts_with('EOFError')
+
+
+def test_transfer_stream_pipe_to_file_and_file_to_pipe(tmp_path):
+    # Given
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    backup_file = tmp_path / 'backup'
+
+    # When
+    with open(backup_file, 'wb') as f:
+        writer = NativeProcess(['splice'], native.transfer_stream, subprocess.PIPE, f)
+    writer.stdin.write(data)
+    writer.stdin.close()
+    writer.wait()
+    with open(backup_file, 'rb') as f:
+        reader = NativeProcess(['splice'], native.transfer_stream, f, subprocess.PIPE)
+    result = reader.stdout.read()
+
+    # Then
+    assert_that(writer.returncode).is_equal_to(0)
+    assert_that(reader.wait()).is_equal_to(0)
+    assert_that(result).is_equal_to(data)
+
+
+def test_transfer_stream_file_to_file(tmp_path):
+    # Given
+    data = os.urandom(1024 * 1024 + 3)
+    (tmp_path / 'src').write_bytes(data)
+
+    # When
+    in_fd = os.open(tmp_path / 'src', os.O_RDONLY)
+    out_fd = os.open(tmp_path / 'dest', os.O_WRONLY | os.O_CREAT)
+    try:
+        size = native.transfer_stream(in_fd, out_fd)
+    finally:
+        os.close(in_fd)
+        os.close(out_fd)
+
+    # Then
+    assert_that(size).is_equal_to(len(data))
+    assert_that((tmp_path / 'dest').read_bytes()).is_equal_to(data)
@@ -0,0 +1,105 @@
+import threading
+import time
+
+from assertpy import assert_that
+
+from bashckup.scheduler import Scheduler, read_durations, write_durations
+
+"""
+Scheduler of backup plans
+"""
+
+
+def test_order_longest_first():
+    # Given
+    backup_plans = {'short': {}, 'unknown': {}, 'alone': {'parallel': False}, 'long': {}}
+    scheduler = Scheduler(4, durations={'short': 10, 'long': 100, 'alone': 1000})
+
+    # When
+    result = scheduler.order(backup_plans)
+
+    # Then
+    assert_that(result).is_equal_to(['unknown', 'long', 'short', 'alone'])
+
+
+def test_run_respects_resource_limits():
+    # Given
+    backup_plans = {'a': {'resources': ['disk1']}, 'b': {'resources': ['disk1']}, 'c': {'resources': ['disk1']},
+                    'd': {'resources': ['disk2']}, 'e': {'resources': ['disk2']}}
+    scheduler = Scheduler(5, resource_limits={'disk1': 2})
+    lock = threading.Lock()
+    running = {'disk1': 0, 'disk2': 0}
+    max_running = {'disk1': 0, 'disk2': 0}
+
+    def run_plan(backup_id, backup_plan):
+        tag = backup_plan['resources'][0]
+        with lock:
+            running[tag] += 1
+            max_running[tag] = max(max_running[tag], running[tag])
+        time.sleep(0.05)
+        with lock:
+            running[tag] -= 1
+        return backup_id == 'e'
+
+    # When
+    error = scheduler.run(backup_plans, run_plan)
+
+    # Then
+    assert_that(error).is_true()
+    assert_that(max_running).is_equal_to({'disk1': 2, 'disk2': 1})
+    assert_that(scheduler.durations).contains_key('a', 'b', 'c', 'd', 'e')
+
+
+def test_run_plan_not_parallel_alone():
+    # Given
+    backup_plans = {'a': {}, 'alone': {'parallel': False}, 'b': {}}
+    scheduler = Scheduler(3)
+    lock = threading.Lock()
+    running = []
+    concurrent_with_alone = []
+
+    def run_plan(backup_id, backup_plan):
+        with lock:
+            running.append(backup_id)
+            if 'alone' in running and len(running) > 1:
+                concurrent_with_alone.append(list(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(backup_id)
+        return False
+
+    # When
+    error = scheduler.run(backup_plans, run_plan)
+
+    # Then
+    assert_that(error).is_false()
+    assert_that(concurrent_with_alone).is_empty()
+
+
+def test_durations_file(tmp_path):
+    # Given
+    durations_file = tmp_path / 'durations.json'
+
+    # When
+    missing = read_durations(durations_file)
+    write_durations(durations_file, {'a': 1.5, 'b': 3})
+    result = read_durations(durations_file)
+
+    # Then
+    assert_that(missing).is_empty()
+    assert_that(result).is_equal_to({'a': 1.5, 'b': 3.0})
+
+
+def test_durations_file_invalid(tmp_path):
+    # Given
+    durations_file = tmp_path / 'durations.json'
+    contents = ['{"a": 1', '[1]', '{"a": null}', '{"a": [1]}', '{"a": "1"}', '{"a": true}']
+
+    # When
+    results = []
+    for content in contents:
+        durations_file.write_text(content)
+        results.append(read_durations(durations_file))
+
+    # Then
+    assert_that(results).is_equal_to([{}] * len(contents))
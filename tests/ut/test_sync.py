@@ -0,0 +1,108 @@
+import os
+from pathlib import Path
+
+from assertpy import assert_that
+
+from bashckup.actuators import sync
+from bashckup.actuators.actuators import ActuatorMetadata
+from bashckup.actuators.post_backup import RsyncPostBackup
+
+"""
+Incremental synchronization of output directories
+"""
+
+
+def _write(path: Path, size: int) -> None:
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_bytes(bytes(size))
+
+
+def test_changes_since_previous_state(tmp_path):
+    # Given
+    _write(tmp_path / 'kept', 10)
+    _write(tmp_path / 'removed', 10)
+    _write(tmp_path / 'changed', 10)
+    previous = sync.list_files(tmp_path)
+    os.remove(tmp_path / 'removed')
+    _write(tmp_path / 'changed', 20)
+    _write(tmp_path / 'chunks' / 'ab' / 'new', 10)
+    _write(tmp_path / 'lost+found' / 'ignored', 10)
+
+    # When
+    (changed, deleted) = sync.changes(previous, sync.list_files(tmp_path))
+
+    # Then
+    assert_that(changed).is_equal_to(['changed', 'chunks/ab/new'])
+    assert_that(deleted).is_equal_to(['removed'])
+
+
+def test_state_is_kept_by_destination(tmp_path):
+    # Given
+    _write(tmp_path / 'file', 10)
+    files = sync.list_files(tmp_path)
+
+    # When
+    sync.write_state(tmp_path, 'user@host:/backup', files)
+
+    # Then
+    assert_that(sync.read_state(tmp_path, 'user@host:/backup')).is_equal_to(files)
+    assert_that(sync.read_state(tmp_path, 'user@other:/backup')).is_none()
+    assert_that(sync.list_files(tmp_path)).does_not_contain_key(sync.stateFileName)
+
+
+def test_split_balances_sizes():
+    # Given
+    files = {'a': (100, 0), 'b': (60, 0), 'c': (50, 0), 'd': (10, 0)}
+
+    # When
+    lists = sync.split(files, list(files), 2)
+
+    # Then
+    assert_that(lists).is_equal_to([['a', 'd'], ['b', 'c']])
+    assert_that(sync.split(files, ['d'], 4)).is_equal_to([['d']])
+
+
+def _rsync(output_directory: Path, streams: int) -> RsyncPostBackup:
+    global_context = {'backup-id': 'test', 'dry-run': True, 'verbose': False, 'backup': True}
+    metadata = {'writer': {'outputFile': ActuatorMetadata({'output-directory': str(output_directory)})}}
+    post_backup = RsyncPostBackup(global_context, {'ip-addr': 'host', 'user': 'user', 'dest-folder': '/backup',
+                                                   'mode': 'new-files', 'streams': streams}, metadata)
+    post_backup.prepare_module()
+    return post_backup
+
+
+def test_rsync_new_files_sends_only_changes(tmp_path):
+    # Given
+    _write(tmp_path / 'old', 10)
+    _write(tmp_path / 'removed', 10)
+    sync.write_state(tmp_path, 'user@host:/backup', sync.list_files(tmp_path))
+    os.remove(tmp_path / 'removed')
+    _write(tmp_path / 'new1', 30)
+    _write(tmp_path / 'new2', 20)
+    _write(tmp_path / 'new3', 10)
+
+    # When
+    args = _rsync(tmp_path, 2)._prepare_run_backup()
+
+    # Then
+    assert_that(args['transfers']).is_equal_to([
+        {'cmd': ['rsync', '--archive', '--stats', '--from0', '--files-from=-', f'{tmp_path}/', 'user@host:/backup'],
+         'paths': ['new1']},
+        {'cmd': ['rsync', '--archive', '--stats', '--from0', '--files-from=-', f'{tmp_path}/', 'user@host:/backup'],
+         'paths': ['new2', 'new3']}])
+    assert_that(args['deletions']).is_equal_to([
+        {'cmd': ['rsync', '--archive', '--delete-missing-args', '--from0', '--files-from=-', f'{tmp_path}/',
+                 'user@host:/backup'], 'paths': ['removed']}])
+
+
+def test_rsync_new_files_without_state_synchronizes_everything(tmp_path):
+    # Given
+    _write(tmp_path / 'file', 10)
+
+    # When
+    args = _rsync(tmp_path, 2)._prepare_run_backup()
+
+    # Then
+    assert_that(args).does_not_contain_key('transfers')
+    assert_that(args['cmd']).contains('--delete-after')
+    assert_that(args['files']).contains_key('file')
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from assertpy import assert_that
+
+from bashckup.actuators.exceptions import RunningException
+from bashckup.sync_stage import PostBackupStage, SyncStage
+
+"""
+Post backups run in background, and batched across the plans of a run
+"""
+
+
+class FakePostBackup:
+    """ Records batches it is run in, batches wait until 'release' is set """
+    batches = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def __init__(self, host: str, fail: bool = False):
+        self.host = host
+        self.fail = fail
+
+    @staticmethod
+    def module_name() -> str:
+        return 'fake'
+
+    def batch_key(self) -> tuple:
+        return self.host,
+
+    def prepare_batch(self) -> dict:
+        return {'host': self.host}
+
+    @classmethod
+    def run_batch(cls, batch) -> list:
+        cls.started.set()
+        cls.release.wait()
+        cls.batches.append([args['host'] for (_, args) in batch])
+        return [RunningException('Failed') if post_backup.fail else {'batch-size': len(batch)}
+                for (post_backup, _) in batch]
+
+
+def test_post_backups_waiting_for_the_same_key_are_run_together():
+    # Given
+    FakePostBackup.batches = []
+    FakePostBackup.started.clear()
+    FakePostBackup.release.clear()
+    stage = SyncStage()
+    futures = {'plan1': stage.submit('plan1', FakePostBackup('host-a'))}
+    FakePostBackup.started.wait()  # Worker of host-a is busy
+
+    # When
+    futures['plan2'] = stage.submit('plan2', FakePostBackup('host-a'))
+    futures['plan3'] = stage.submit('plan3', FakePostBackup('host-a', fail=True))
+    futures['plan4'] = stage.submit('plan4', FakePostBackup('host-b'))
+    FakePostBackup.release.set()
+    stage.wait()
+
+    # Then
+    assert_that(sorted(FakePostBackup.batches)).is_equal_to([['host-a'], ['host-a', 'host-a'], ['host-b']])
+    assert_that({backup_id: futures[backup_id].result() for backup_id in ['plan1', 'plan2', 'plan4']}).is_equal_to(
+        {'plan1': {'batch-size': 1}, 'plan2': {'batch-size': 2}, 'plan4': {'batch-size': 1}})
+    assert_that(futures['plan3'].exception()).is_instance_of(RunningException)
+
+
+def test_post_backups_of_plans_sharing_a_directory_run_in_order():
+    # Given
+    runs = []
+    release = threading.Event()
+    stage = PostBackupStage()
+
+    def post_backups(backup_id: str, error: bool = False, wait: threading.Event = None):
+        def run() -> bool:
+            if wait is not None:
+                wait.wait()
+            runs.append(backup_id)
+            return error
+        return run
+
+    # When
+    stage.submit('plan1', ['/backup/a'], post_backups('plan1', wait=release))
+    stage.submit('plan2', ['/backup/b'], post_backups('plan2'))
+    stage.submit('plan3', ['/backup/a', '/backup/b'], post_backups('plan3', error=True))
+    stage.submit('plan4', ['/backup/b'], post_backups('plan4'))
+    stage.submit('plan5', [], post_backups('plan5'))
+    while len(runs) < 2:  # plan2 and plan5 do not wait for plan1
+        time.sleep(0.01)
+    runs_before_release = list(runs)
+    release.set()
+    error = stage.wait()
+
+    # Then
+    assert_that(error).is_true()
+    assert_that(runs_before_release).contains_only('plan2', 'plan5')
+    assert_that(runs[2:]).is_equal_to(['plan1', 'plan3', 'plan4'])
+    assert_that(stage.failed).is_equal_to(['plan3'])
+
+
+class MissingResultPostBackup(FakePostBackup):
+    """ Returns fewer results than post backups in its batch """
+
+    @classmethod
+    def run_batch(cls, batch) -> list:
+        return []
+
+
+def test_post_backups_without_result_fail():
+    # Given
+    stage = SyncStage()
+
+    # When
+    future = stage.submit('plan1', MissingResultPostBackup('host-a'))
+    stage.wait()
+
+    # Then
+    assert_that(str(future.exception(timeout=1))).is_equal_to('Post backup fake gave 0 results for a batch of 1')
@@ -0,0 +1,51 @@
+import pytest
+from assertpy import assert_that
+
+from bashckup.actuators.transformers import GzipTransformer, PigzTransformer, ZstdTransformer
+
+"""
+Commands generated by transformers
+"""
+
+
+def test_pigz_threads_from_global_context():
+    # Given
+    global_context = {'backup-id': 'test', 'dry-run': True, 'verbose': False, 'backup': True, 'threads': 3}
+    transformer = PigzTransformer(global_context, {'level': 9}, {})
+
+    # When
+    transformer.prepare_module()
+
+    # Then
+    assert_that(transformer.generate_dry_run_backup_cmd()).is_equal_to(['pigz', '-9', '--processes', '3'])
+    assert_that(transformer.generate_dry_run_restore_cmd()).is_equal_to(['pigz', '-d', '--processes', '3'])
+
+
+def test_zstd_long():
+    # Given
+    global_context = {'backup-id': 'test', 'dry-run': True, 'verbose': False, 'backup': True, 'threads': 3}
+    transformer = ZstdTransformer(global_context, {'threads': 8, 'long': 30}, {})
+
+    # When
+    transformer.prepare_module()
+
+    # Then
+    assert_that(transformer.generate_dry_run_backup_cmd()).is_equal_to(
+        ['zstd', '-3', '-T8', '--stdout', '--long=30', '--quiet'])
+    assert_that(transformer.generate_dry_run_restore_cmd()).is_equal_to(['zstd', '-d', '-T8', '--stdout',
+                                                                          '--long=30', '--quiet'])
+
+
+@pytest.mark.parametrize('pigz_path, expected_cmd', [('/usr/bin/pigz', ['pigz', '-d', '--processes', '3']),
+                                                     (None, ['gzip', '-d'])])
+def test_gzip_restored_by_pigz_when_installed(monkeypatch, pigz_path, expected_cmd):
+    # Given
+    global_context = {'backup-id': 'test', 'dry-run': True, 'verbose': False, 'backup': False, 'threads': 3}
+    transformer = GzipTransformer(global_context, {}, {})
+    monkeypatch.setattr('shutil.which', lambda cmd: pigz_path if cmd == 'pigz' else None)
+
+    # When
+    transformer.prepare_module()
+
+    # Then
+    assert_that(transformer.generate_dry_run_restore_cmd()).is_equal_to(expected_cmd)